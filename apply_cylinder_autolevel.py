@@ -1,190 +1,476 @@
 #!/usr/bin/env python
 import sys
-import math
 import re
+import math
 import getopt
 import numpy as np
-from scipy import interpolate
 
 import probe
+import rotary_axis_cam
 
 # Code assumes we are in G90   (absolute travel mode)
 # Code assumes we are in G90.1 (absolute arc center mode)
 
-usage = 'apply_cylinder_autolevel.py input=input.nc output=output.nc'
-input_filename = 'input.nc'
-output_filename = 'output.nc'
-probe_filename = 'probe_results.tx' 
+# Can also be used as a module:
+#   import probe
+#   import apply_cylinder_autolevel
+#   probe_f, probe_dim = probe.load_probe_surface('probe_file.txt', 3.0)
+#   for line in apply_cylinder_autolevel.autolevel(open('input.nc'), probe_f, probe_dim):
+#       ...
 
-# The input Gcode file is built assuming a particular reference height (z_ref).
-# Typically this will be the nominal outer diameter of the material.
-z_ref = 3.0
+usage = 'apply_cylinder_autolevel.py --input=input.nc --output=output.nc --probe=probe_file.txt [--z-ref=3.0] [--edge-probe=probe_results_edge.txt] [--arc-tolerance=0.0005] [--surface=spline|harmonic|cylinder] [--harmonics=N] [--threaded] [--quiet] ' + rotary_axis_cam.metrics_usage
 
-try:
-    opts, args = getopt.getopt(sys.argv[1:], "h", ['input=', 'output='])
+# Setup Gcode mods
+G_commands = ['G0','G00','G1','G01']
+arc_commands = ['G2','G02','G3','G03']
 
-except:
-    print(usage)
-    sys.exit(1)
+# Lines per surface evaluation for the fitted surface models
+batch_lines = 65536
 
-for opt, arg in opts:
-    if opt == '-h':
-        print(usage)
-    if opt == '--input=':
-        input_filename = arg
-    if opt == '--output=':
-        output_filename = arg
-    if opt == '--probe=':
-        probe_filename = arg
-
-print('\nReading Input Gcode')
-try:
-    input_file = open(input_filename,'r')
-except:
-    print('Error reading input file!\nExiting')
-    sys.exit(1)
-
-try:
-    output_file = open(output_filename,'w')
-except:
-    print('Error opening output file!\nExiting')
-    sys.exit(1)
-
-# Read probe data and setup
-print('\nReading Probe Data')
-try:
-    probe_num_X, probe_num_A, probe_X, probe_Z, probe_A = probe.read_cylinder_probe_file('probe_file.txt')
-
-except:
-    print('Error reading probe file!\nExiting')
-    sys.exit(1)
-probe_X_values = np.unique(probe_X)
-probe_A_values = np.unique(probe_A)
-
-# Check Probe Data dimensions
-probe_dim = None
-if probe_X_values.size == 1:
-    print('Probe Data is 2D (A and Z)')
-    probe_dim = 1
-else:
-    print('Probe Data is 3D (X, A and Z)')
-    probe_dim = 2
 
+def arc_words(line):
+    # Letter values of an arc line (comments removed), as text
+    return dict(re.findall(r'([A-Z])\s*([-+]?(?:\d+\.?\d*|\.\d+))', line.split('(')[0].upper()))
 
-# Setup Gcode mods
-G_commands = ['G0','G00','G1','G01']
-z_safe = None
-
-x_current = 0
-a_current = 0
-
-# Store if last line is 'plunge', 'first' or None
-last_line = None
-last_Z = None
-
-# Convert Z to delta Z map
-dZ = probe_Z - z_ref
-
-dZ_min = np.min(dZ)
-dZ_max = np.max(dZ)
-print('  dZ Min: {:5.4f}'.format(dZ_min))
-print('  dZ Max: {:5.4f}'.format(dZ_max))
-
-    
-if probe_dim == 1:
-    print('\nInterpolating Probe Data in A axis only')
-    probe_f = interpolate.interp1d(probe_A_values, dZ)
-elif probe_dim == 2:
-    print('\nInterpolating Probe Data in X and A axes')
-    probe_f = interpolate.RectBivariateSpline(probe_X_values, probe_A_values, dZ)
-    max_error, avg_error = probe.interpolation_check(probe_f, probe_X_values, probe_A_values, dZ)
-    print('  Max Error: {:5.4e}'.format(max_error))
-
-# Process Gcode
-print('\nProcessing Gcode')
-for line in input_file:
-    if line[0] == '%':
-        # Don't modify
-        output_file.write(line)
-        last_line = None
-    elif line[0] == '(':
-        # Don't modify
-        output_file.write(line)
-        last_line = None
-    elif line[0] == 'M': # Misc
-        # Don't modify
-        output_file.write(line)
-        last_line = None
-    elif line[0] == 'G':
-        # Here we want to split the line to break out the coordinates
-        # X, Y, Z, A, B, C, and the feedrate F. However, we want to
-        # keep the delimiters, which requires the parenthesis.
-        line_split = re.split('(X|Y|Z|A|B|C|F)',line)
-        command = [item.strip() for item in line_split]
-        trailing = line[2:]
-        if command[0] in G_commands:
-            # Check if X is present
-            if 'X' in command:
-                x_index = command.index('X')
-                x_current = float(command[x_index + 1].strip())
-            # Check if A is present
-            if 'A' in command:
-                a_index = command.index('A')
-                a_current = float(command[a_index + 1].strip())
-            # Check if F is present
-            # Need this if added Z to command
-            if 'F' in command:
-                f_index = command.index('F')
-            # Check if Z is present
-            if 'Z' in command:
-                z_index = command.index('Z') + 1
-                z_current = float(command[z_index].strip())
-                if z_safe is None:
-                    # Assume first Z found is safe height
-                    z_safe = z_current
-                    print('\nZ Safe Height is: {:4.3f}'.format(z_safe))                
-                if z_current != z_safe:
-                    if probe_dim == 1:
-                        # Interpolate dZ based on A only
-                        dz_current = probe_f(a_current)[0]
-                    elif probe_dim == 2:
-                        # Interpolate dZ based on X and A
-                        dz_current = probe_f(x_current, a_current)[0,0]
+
+def arc_points(x0, y0, x1, y1, cx, cy, clockwise, tolerance):
+    # Splits an arc in the XY plane into chords within the tolerance of the
+    # arc. Returns the end point of every chord and its fraction along the
+    # arc, the last point is the arc end point. Start and end at the same
+    # point is a full circle.
+    r0 = math.hypot(x0 - cx, y0 - cy)
+    r1 = math.hypot(x1 - cx, y1 - cy)
+    angle0 = math.atan2(y0 - cy, x0 - cx)
+    angle1 = math.atan2(y1 - cy, x1 - cx)
+    if clockwise:
+        sweep = -((angle0 - angle1) % (2.0*math.pi))
+    else:
+        sweep = (angle1 - angle0) % (2.0*math.pi)
+    if sweep == 0.0:
+        sweep = -2.0*math.pi if clockwise else 2.0*math.pi
+    # Largest angle with a chord error (sagitta) within the tolerance
+    r_max = max(r0, r1)
+    max_angle = 2.0*math.acos(max(1.0 - tolerance/r_max, -1.0)) if r_max > 0.0 else 2.0*math.pi
+    count = max(int(math.ceil(abs(sweep)/max(max_angle, 1.0e-6))), 1)
+    t = np.arange(1, count + 1)/count
+    angle = angle0 + t*sweep
+    radius = r0 + t*(r1 - r0)
+    x = cx + radius*np.cos(angle)
+    y = cy + radius*np.sin(angle)
+    x[-1] = x1
+    y[-1] = y1
+
+    return x, y, t
+
+
+def autolevel(input_lines, probe_f, probe_dim, progress=None, stats=None, arc_tolerance=0.0005,
+              edge_probe_f=None, batch_size=None):
+    # Yields the input G-code lines with the Z values adjusted by the delta Z
+    # surface (probe.load_probe_surface). The first Z found is taken as the
+    # safe height and isn't adjusted.
+    #
+    # With edge_probe_f (probe.load_edge_probe_surface) X is also shifted by
+    # the probed edge location at the current A, and the Z surface is looked
+    # up at the shifted X. Moves in A only get an X added once the X position
+    # is known.
+    #
+    # Arcs (G2/G3 in the XY plane, with A fixed) are split into chords within
+    # arc_tolerance and the surface is found for all the chords of an arc in
+    # one call. If the surface changes by less than arc_tolerance along the
+    # arc, the arc is kept with the Z at its end adjusted, otherwise the
+    # chords are written as G1 moves. In inverse time mode (G93) each chord
+    # gets its share of the arc time. Arc centers are absolute (G90.1)
+    # unless G91.1 is found. Y isn't used for the surface lookup, the same
+    # as for G0/G1 moves.
+    #
+    # With batch_size, the Z of the G0/G1 moves in each batch_size lines is
+    # found in one call to the surface instead of one point at a time, e.g.
+    # for the fitted models (probe.HarmonicSurface, probe.CylinderSurface)
+    # which gain the most from it. The point cache isn't used then.
+    #
+    # If given, progress is updated as lines
+    # are read and stats is filled in with the line counts, safe height and
+    # probe cache counts. probe_f can also be a probe.ProbeSurface, so its
+    # cache is kept between programs.
+    if isinstance(probe_f, probe.ProbeSurface):
+        surface = probe_f
+    else:
+        surface = probe.ProbeSurface(probe_f, probe_dim)
+    lines = autolevel_lines(input_lines, surface, progress, stats, arc_tolerance, edge_probe_f, batch_size is not None)
+    if batch_size is None:
+        return lines
+    return fill_batches(lines, surface, batch_size)
+
+
+def fill_batches(lines, surface, batch_size):
+    # Yields the autolevel_lines lines, with the Z of the moves waiting for
+    # it found for every batch_size lines in one surface evaluation
+    batch = []
+    moves = []
+    for line in lines:
+        batch.append(line)
+        if type(line) is not str:
+            moves.append(line)
+        if len(batch) >= batch_size:
+            yield from fill_batch(batch, moves, surface)
+            batch = []
+            moves = []
+    yield from fill_batch(batch, moves, surface)
+
+
+def fill_batch(batch, moves, surface):
+    if moves:
+        dz = surface.evaluate([move[3] for move in moves], [move[4] for move in moves]).tolist()
+        for (command, z_index, ending, x, a, z), dz_move in zip(moves, dz):
+            command[z_index] = '{:5.4f}'.format(z + dz_move)
+    for line in batch:
+        if type(line) is str:
+            yield line
+        else:
+            yield ' '.join(line[0]) + line[2]
+
+
+def autolevel_lines(input_lines, surface, progress, stats, arc_tolerance, edge_probe_f, defer_z):
+    # The autolevel loop. With defer_z, G0/G1 moves that need a Z correction
+    # are yielded as (command, z_index, line ending, x, A, Z) for
+    # fill_batches instead of a line.
+    progress_mask = rotary_axis_cam.progress_mask
+    edge = None
+    if edge_probe_f is not None:
+        edge = probe.ProbeSurface(edge_probe_f, 1)
+    z_safe = None
+    z_current = None
+    f_index = None
+
+    x_current = 0
+    x_known = False
+    y_current = 0
+    a_current = 0
+    inverse_time = False
+    ij_absolute = True
+
+    line_count = 0
+    modified_count = 0
+    shifted_count = 0
+    arcs_kept = 0
+    arcs_split = 0
+    arc_segments = 0
+    for line in input_lines:
+        line_count += 1
+        if progress is not None and not line_count & progress_mask:
+            progress.update(line_count)
+        if line[0] == '%':
+            # Don't modify
+            yield line
+        elif line[0] == '(':
+            # Don't modify
+            yield line
+        elif line[0] == 'M': # Misc
+            # Don't modify
+            yield line
+        elif line[0] == 'G':
+            # Here we want to split the line to break out the coordinates
+            # X, Y, Z, A, B, C, and the feedrate F. However, we want to
+            # keep the delimiters, which requires the parenthesis. A comment
+            # at the end of the line is split off first and put back after.
+            code, comment_start, comment = line.partition('(')
+            line_split = re.split('(X|Y|Z|A|B|C|F)',code)
+            command = [item.strip() for item in line_split]
+            if command[0] in G_commands:
+                # Check if X is present
+                if 'X' in command:
+                    x_index = command.index('X')
+                    x_current = float(command[x_index + 1].strip())
+                if 'Y' in command:
+                    y_current = float(command[command.index('Y') + 1].strip())
+                # Check if A is present
+                if 'A' in command:
+                    a_index = command.index('A')
+                    a_current = float(command[a_index + 1].strip())
+                # Shift X to the probed edge at the current A, once the X
+                # position is known. X is added to moves in A only.
+                x_surface = x_current
+                if 'X' in command:
+                    x_known = True
+                if edge is not None and x_known:
+                    x_surface = x_current + edge(None, a_current)
+                    if 'X' in command:
+                        command[x_index + 1] = '{:5.4f}'.format(x_surface)
+                        shifted_count += 1
+                    elif 'A' in command:
+                        command[1:1] = ['X', '{:5.4f}'.format(x_surface)]
+                        shifted_count += 1
+                # Check if F is present
+                # Need this if added Z to command
+                if 'F' in command:
+                    f_index = command.index('F')
+                # Check if Z is present
+                if 'Z' in command:
+                    z_index = command.index('Z') + 1
+                    z_current = float(command[z_index].strip())
+                    if z_safe is None:
+                        # Assume first Z found is safe height
+                        z_safe = z_current
+                    correct_z = z_current != z_safe
+                else:
+                    correct_z = z_current != z_safe
+                    if correct_z:
+                        if f_index is None:
+                            f_index = len(command)
+                        command[f_index:f_index] = ['Z', '']
+                        z_index = f_index + 1
+                if comment_start:
+                    ending = ' (' + comment
+                else:
+                    ending = '\n'
+                if correct_z:
+                    modified_count += 1
+                    if defer_z:
+                        yield (command, z_index, ending, x_surface, a_current, z_current)
+                        continue
+                    dz_current = surface(x_surface, a_current)
                     command[z_index] = '{:5.4f}'.format(z_current + dz_current)
-                    #print(x_current, a_current, z_current, dz_current)
+                # Rebuild command with whitespace
+                yield ' '.join(command) + ending
+            elif command[0] in arc_commands:
+                words = arc_words(line)
+                x_end = float(words.get('X', x_current))
+                y_end = float(words.get('Y', y_current))
+                a_end = float(words.get('A', a_current))
+                if 'Z' in words:
+                    z_end = float(words['Z'])
+                    if z_safe is None:
+                        z_safe = z_end
+                else:
+                    z_end = z_current
+                correct_z = z_end is not None and z_end != z_safe
+                if not correct_z and edge is None:
+                    # Don't modify
+                    yield line
+                else:
+                    if ij_absolute:
+                        x_center = float(words.get('I', x_current))
+                        y_center = float(words.get('J', y_current))
+                    else:
+                        x_center = x_current + float(words.get('I', 0.0))
+                        y_center = y_current + float(words.get('J', 0.0))
+                    clockwise = command[0] in ['G2', 'G02']
+                    x, y, t = arc_points(x_current, y_current, x_end, y_end, x_center, y_center, clockwise, arc_tolerance)
+                    a = a_current + t*(a_end - a_current)
+                    # Flat enough to keep the arc if the corrections change
+                    # by less than the tolerance along it
+                    change = 0.0
+                    if edge is not None:
+                        dx = edge.evaluate(x, a)
+                        x = x + dx
+                        change = dx.max() - dx.min()
+                    if correct_z:
+                        z_start = z_current if z_current is not None else z_end
+                        dz = surface.evaluate(x, a)
+                        z = z_start + t*(z_end - z_start) + dz
+                        change = max(change, dz.max() - dz.min())
+                    if change <= arc_tolerance:
+                        arcs_kept += 1
+                        if edge is None:
+                            arc_line = '{} X {}'.format(command[0], words.get('X', x_current))
+                        else:
+                            arc_line = '{} X {:5.4f}'.format(command[0], x[-1])
+                        arc_line += ' Y {}'.format(words.get('Y', y_current))
+                        if correct_z:
+                            arc_line += ' Z {:5.4f}'.format(z[-1])
+                        elif 'Z' in words:
+                            arc_line += ' Z ' + words['Z']
+                        if 'A' in words:
+                            arc_line += ' A ' + words['A']
+                        if 'I' in words:
+                            if edge is not None and ij_absolute:
+                                arc_line += ' I {:5.4f}'.format(float(words['I']) + dx[-1])
+                            else:
+                                arc_line += ' I ' + words['I']
+                        if 'J' in words:
+                            arc_line += ' J ' + words['J']
+                        if 'F' in words:
+                            arc_line += ' F ' + words['F']
+                        yield arc_line + '\n'
+                    else:
+                        arcs_split += 1
+                        arc_segments += t.size
+                        feed = ''
+                        if 'F' in words:
+                            if inverse_time:
+                                feed = ' F {:5.4f}'.format(float(words['F'])*t.size)
+                            else:
+                                feed = ' F ' + words['F']
+                        for i in range(t.size):
+                            segment = 'G1 X {:5.4f} Y {:5.4f}'.format(x[i], y[i])
+                            if correct_z:
+                                segment += ' Z {:5.4f}'.format(z[i])
+                            if 'A' in words:
+                                segment += ' A {:5.4f}'.format(a[i])
+                            yield segment + feed + '\n'
+                            if not inverse_time:
+                                # Modal in units/min mode
+                                feed = ''
+                    modified_count += 1
+                x_known = True
+                x_current = x_end
+                y_current = y_end
+                a_current = a_end
+                z_current = z_end
             else:
-                if z_current != z_safe:
-                    if probe_dim == 1:
-                        # Interpolate dZ based on A only
-                        dz_current = probe_f(a_current)[0]
-                    elif probe_dim == 2:
-                        # Interpolate dZ based on X and A
-                        dz_current = probe_f(x_current, a_current)[0,0]
-                    command.insert(f_index, '{:5.4f}'.format(z_current + dz_current))
-                    command.insert(f_index, 'Z')
-            # Rebuild command with whitespace
-            new_line = ''
-            num_items = len(command)
-            for i in range(0,num_items-1):
-                new_line += command[i] + ' '
-            new_line += command[-1] + '\n'
-            output_file.write(new_line)
+                # Don't modify all other GXX commands
+                if line.startswith('G93'):
+                    inverse_time = True
+                elif line.startswith('G94'):
+                    inverse_time = False
+                if 'G90.1' in line:
+                    ij_absolute = True
+                elif 'G91.1' in line:
+                    ij_absolute = False
+                yield line
+
+    if stats is not None:
+        stats['lines_read'] = line_count
+        stats['lines_modified'] = modified_count
+        stats['lines_shifted'] = shifted_count
+        stats['arcs_kept'] = arcs_kept
+        stats['arcs_split'] = arcs_split
+        stats['arc_segments'] = arc_segments
+        stats['z_safe'] = z_safe
+        stats['surface_cache'] = surface.status()
+
+
+def main(argv):
+    input_filename = 'input.nc'
+    output_filename = 'output.nc'
+    probe_filename = 'probe_file.txt'
+    quiet = False
+    threaded = False
+    metrics = rotary_axis_cam.Metrics('apply_cylinder_autolevel')
+
+    # The input Gcode file is built assuming a particular reference height (z_ref).
+    # Typically this will be the nominal outer diameter of the material.
+    z_ref = 3.0
+    arc_tolerance = 0.0005
+    edge_probe_filename = None
+    surface_model = 'spline'
+    harmonics = None
+    batch_size = None
+
+    try:
+        opts, args = getopt.getopt(argv, "h", ['input=', 'output=', 'probe=', 'z-ref=', 'edge-probe=', 'arc-tolerance=', 'surface=', 'harmonics=', 'threaded', 'quiet'] + rotary_axis_cam.metrics_options)
+    except getopt.GetoptError:
+        print(usage)
+        sys.exit(1)
+
+    for opt, arg in opts:
+        if opt == '-h':
+            print(usage)
+            sys.exit()
+        if opt == '--input':
+            input_filename = arg
+        if opt == '--output':
+            output_filename = arg
+        if opt == '--probe':
+            probe_filename = arg
+        if opt == '--z-ref':
+            z_ref = float(arg)
+        if opt == '--surface':
+            surface_model = arg
+        if opt == '--harmonics':
+            harmonics = int(arg)
+        if opt == '--edge-probe':
+            edge_probe_filename = arg
+        if opt == '--arc-tolerance':
+            arc_tolerance = float(arg)
+        if opt == '--threaded':
+            threaded = True
+        if opt == '--quiet':
+            quiet = True
+        metrics.parse_option(opt, arg)
+
+    metrics.stage('open_files')
+    print('\nReading Input Gcode')
+    try:
+        input_file = rotary_axis_cam.open_file(input_filename,'r')
+    except IOError:
+        print('Error reading input file!\nExiting')
+        sys.exit(1)
+
+    try:
+        output_file = rotary_axis_cam.open_file(output_filename,'w')
+    except IOError:
+        print('Error opening output file!\nExiting')
+        sys.exit(1)
+
+    # Read probe data and setup
+    metrics.stage('read_probe')
+    print('\nReading Probe Data')
+    if surface_model not in ['spline', 'harmonic', 'cylinder']:
+        print('Invalid surface:', surface_model, '\nExiting!')
+        sys.exit(1)
+    try:
+        if surface_model == 'harmonic':
+            probe_f, probe_dim = probe.load_harmonic_surface(probe_filename, z_ref, harmonics, metrics=metrics)
+        elif surface_model == 'cylinder':
+            probe_f, probe_dim = probe.load_cylinder_surface(probe_filename, z_ref, metrics=metrics)
         else:
-            # Don't modify all other GXX commands
-            output_file.write(line)
-            last_line = None
-    # Plunge adjust logic here
-    #elif line[0] == 'X' or line[0] == 'Y':
-    #    # Don't modify
-    #    output_file.write(line)
-    #    if last_line == 'plunge':
-    #        output_file.write('G1 F{:.4f}\n'.format(current_F*second_cut_factor))
-    #        last_line = 'first'
-    #    elif last_line == 'first':
-    #        output_file.write('G1 F{:.4f}\n'.format(current_F))
-    #        last_line = None
-    #    else:
-    #        last_line = None
-
-input_file.close()
-output_file.close()
+            probe_f, probe_dim = probe.load_probe_surface(probe_filename, z_ref, metrics)
+    except (IOError, ValueError) as error:
+        print('Error reading probe file: ' + str(error) + '\nExiting')
+        sys.exit(1)
+    if surface_model != 'spline':
+        # Fitted models are evaluated for many moves at once
+        batch_size = batch_lines
+    probe_f = metrics.timed('surface_eval', probe_f)
+    edge_probe_f = None
+    if edge_probe_filename is not None:
+        print('\nReading Edge Probe Data')
+        try:
+            edge_probe_f = probe.load_edge_probe_surface(edge_probe_filename, metrics)
+        except (IOError, ValueError):
+            print('Error reading edge probe file!\nExiting')
+            sys.exit(1)
+        edge_probe_f = metrics.timed('edge_eval', edge_probe_f)
+    write = metrics.timed('write', output_file.write)
+
+    # Process Gcode
+    metrics.stage('process')
+    print('\nProcessing Gcode')
+    progress = rotary_axis_cam.Progress(input_file, quiet)
+    stats = {}
+    if threaded:
+        # Read and write in their own threads. The surface is evaluated in
+        # batches, so this thread spends its time in numpy rather than
+        # per-line calls.
+        if batch_size is None:
+            batch_size = batch_lines
+        rotary_axis_cam.run_threaded(input_file, output_file, lambda lines: autolevel(
+            lines, probe_f, probe_dim, progress, stats, arc_tolerance, edge_probe_f, batch_size))
+    else:
+        for line in autolevel(input_file, probe_f, probe_dim, progress, stats, arc_tolerance, edge_probe_f, batch_size):
+            write(line)
+    progress.finish(stats['lines_read'])
+    if stats['z_safe'] is not None:
+        print('\nZ Safe Height is: {:4.3f}'.format(stats['z_safe']))
+    if edge_probe_f is not None:
+        print('Lines shifted to the probed edge: {:d}'.format(stats['lines_shifted']))
+    if stats['arcs_kept'] or stats['arcs_split']:
+        print('Arcs kept: {:d}, split into G1 moves: {:d} ({:d} moves)'.format(
+            stats['arcs_kept'], stats['arcs_split'], stats['arc_segments']))
+    if batch_size is None:
+        print('Surface Cache: {:d} hits, {:d} misses'.format(stats['surface_cache']['hits'], stats['surface_cache']['misses']))
+
+    metrics.stage('close_files')
+    input_file.close()
+    output_file.close()
+
+    metrics.count('lines_read', stats['lines_read'])
+    metrics.count('lines_modified', stats['lines_modified'])
+    metrics.count('surface_cache_hits', stats['surface_cache']['hits'])
+    metrics.count('surface_cache_misses', stats['surface_cache']['misses'])
+    metrics.finish()
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
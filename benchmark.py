@@ -0,0 +1,304 @@
+#!/usr/bin/env python
+import os
+import sys
+import json
+import time
+import getopt
+import shutil
+import platform
+import subprocess
+import tempfile
+import tracemalloc
+
+import numpy as np
+
+import probe
+import generate_workload
+
+# Benchmark suite for the probe functions, the G-code generators and the
+# G-code modifiers.
+#
+# Probe functions are timed in-process (peak memory from tracemalloc). The
+# scripts are run as a separate process in a scratch folder, the same way
+# they are used on the machine, and their peak memory is the max RSS of the
+# child process. Inputs come from generate_workload.py.
+#
+# Results can be saved as a baseline and later runs compared against it:
+#   python benchmark.py --save=baseline.json
+#   python benchmark.py --compare=baseline.json
+# The compare run exits with a non-zero status if any case is slower than
+# the baseline by more than the threshold.
+
+usage = 'benchmark.py [--quick] [--full] [--repeat=3] [--lines=100000,1000000] [--save=file.json] [--compare=file.json] [--threshold=0.1] [case ...]'
+
+script_dir = os.path.dirname(os.path.abspath(__file__))
+
+# Problem sizes
+probe_grids = [(10, 24), (50, 180), (200, 360)]
+probe_grids_quick = [(10, 24), (50, 180)]
+line_counts = [100000, 1000000]
+line_counts_quick = [100000]
+line_counts_full = [100000, 1000000, 10000000]
+
+# Generator jobs (outer diameter sets z_ref for the probe files)
+generator_outer_diameter = 12.0
+
+
+def count_lines(filename):
+    with open(filename, 'rb') as input_file:
+        return sum(1 for line in input_file)
+
+
+# Timing
+def time_function(function, repeat):
+    # Returns best time (s) and peak traced memory (bytes)
+    # Untimed call first, so one-off imports (e.g. scipy) aren't counted
+    function()
+    best = None
+    peak = 0
+    for i in range(repeat):
+        tracemalloc.start()
+        start = time.perf_counter()
+        function()
+        elapsed = time.perf_counter() - start
+        peak = max(peak, tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+        best = elapsed if best is None else min(best, elapsed)
+
+    return best, peak
+
+
+# Runs a script in the child process and reports its peak memory on exit.
+# ru_maxrss can't be used from the parent, Linux carries the parent's high
+# water mark into the child across fork/exec.
+peak_memory_wrapper = """
+import os, sys, atexit, runpy
+script, report_filename = sys.argv[1], sys.argv[2]
+def report_peak():
+    peak = None
+    if os.path.isfile('/proc/self/status'):
+        for line in open('/proc/self/status'):
+            if line.startswith('VmHWM:'):
+                peak = int(line.split()[1])*1024
+    else:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        if sys.platform != 'darwin':
+            peak *= 1024
+    open(report_filename, 'w').write(str(peak))
+atexit.register(report_peak)
+sys.argv = [script] + sys.argv[3:]
+sys.path.insert(0, os.path.dirname(script))
+runpy.run_path(script, run_name='__main__')
+"""
+
+
+def time_script(script, work_dir, repeat, args=[]):
+    # Returns best time (s) and peak RSS (bytes) of a script run in work_dir.
+    # Its output is thrown away (stderr is only shown if it fails), so the
+    # Progress output doesn't end up in the results table.
+    best = None
+    peak = None
+    report_filename = os.path.join(work_dir, 'peak_memory.txt')
+    for i in range(repeat):
+        start = time.perf_counter()
+        result = subprocess.run([sys.executable, '-c', peak_memory_wrapper,
+                                 os.path.join(script_dir, script), report_filename] + args,
+                                cwd=work_dir, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+                                universal_newlines=True)
+        elapsed = time.perf_counter() - start
+        if result.returncode != 0:
+            print(result.stderr)
+            print('Error running', script, '\nExiting!')
+            sys.exit(1)
+        best = elapsed if best is None else min(best, elapsed)
+        peak = max(peak or 0, int(open(report_filename).read()))
+        os.remove(report_filename)
+
+    return best, peak
+
+
+def record(results, name, elapsed, peak, count, unit):
+    results[name] = {
+        'time': elapsed,
+        'count': count,
+        'throughput': count/elapsed,
+        'unit': unit,
+        'peak_memory_mb': None if peak is None else peak/1.0e6,
+    }
+    peak_string = '   n/a' if peak is None else '{:6.1f}'.format(peak/1.0e6)
+    print('{:45s} {:9.3f} s {:12.0f} {:9s} {} MB'.format(name, elapsed, count/elapsed, unit, peak_string))
+
+
+# Benchmark cases
+def bench_probe(results, work_dir, grids, repeat):
+    for num_x, num_a in grids:
+        filename = os.path.join(work_dir, 'probe_{:d}x{:d}.txt'.format(num_x, num_a))
+        generate_workload.write_probe_file(filename, num_x, num_a, 3.0)
+        num_points = num_x*num_a
+        tag = '[{:d}x{:d}]'.format(num_x, num_a)
+
+        elapsed, peak = time_function(lambda: probe.read_cylinder_probe_file(filename), repeat)
+        record(results, 'read_cylinder_probe_file' + tag, elapsed, peak, num_points, 'points/s')
+
+        probe_num_X, probe_num_A, probe_X, probe_Z, probe_A = probe.read_cylinder_probe_file(filename)
+        probe_X_values = np.unique(probe_X)
+        probe_A_values = np.unique(probe_A)
+        dZ = probe_Z - 3.0
+        probe_dim = 1 if probe_X_values.size == 1 else 2
+        if probe_dim == 1:
+            dZ = dZ[0]
+
+        # Keep the setup messages out of the results table
+        stdout = sys.stdout
+        sys.stdout = open(os.devnull, 'w')
+        try:
+            elapsed, peak = time_function(lambda: probe.setup_interpolation(probe_X_values, probe_A_values, dZ, probe_dim), repeat)
+        finally:
+            sys.stdout.close()
+            sys.stdout = stdout
+        record(results, 'setup_interpolation' + tag, elapsed, peak, num_points, 'points/s')
+
+        if probe_dim == 2:
+            from scipy import interpolate
+            probe_f = interpolate.RectBivariateSpline(probe_X_values, probe_A_values, dZ)
+            elapsed, peak = time_function(lambda: probe.interpolation_check(probe_f, probe_X_values, probe_A_values, dZ), repeat)
+            record(results, 'interpolation_check' + tag, elapsed, peak, probe_X_values.size*probe_A_values.size, 'points/s')
+
+
+def bench_generators(results, work_dir, repeat):
+    generators = {
+        'cut_recess_cylinder.py': {},
+        'cut_groove_cylinder.py': {'groove_depth': 0.7},
+    }
+    for script, extra_inputs in generators.items():
+        for use_probe in [False, True]:
+            run_dir = os.path.join(work_dir, script[:-3] + ('_probe' if use_probe else ''))
+            os.mkdir(run_dir)
+            inputs_file = open(os.path.join(run_dir, script[:-3] + '.inputs'), 'w')
+            inputs_file.write("inputs['outer_diameter'] = {!r}\n".format(generator_outer_diameter))
+            inputs_file.write("inputs['use_probe_file'] = {!r}\n".format(use_probe))
+            inputs_file.write("inputs['output_file'] = 'output.nc'\n")
+            for k, v in extra_inputs.items():
+                inputs_file.write("inputs[{!r}] = {!r}\n".format(k, v))
+            inputs_file.close()
+            if use_probe:
+                generate_workload.write_probe_file(os.path.join(run_dir, 'probe_results.txt'), 20, 24,
+                                                   generator_outer_diameter/2.0, x_start=-4.0, x_end=0.5)
+
+            elapsed, peak = time_script(script, run_dir, repeat)
+            num_lines = count_lines(os.path.join(run_dir, 'output.nc'))
+            name = script[:-3] + ('[probe]' if use_probe else '[constant]')
+            record(results, name, elapsed, peak, num_lines, 'lines/s')
+
+
+def bench_modifiers(results, work_dir, sizes, repeat):
+    for num_lines in sizes:
+        tag = '[{:d}]'.format(num_lines)
+
+        run_dir = os.path.join(work_dir, 'autolevel' + tag)
+        os.mkdir(run_dir)
+        generate_workload.write_wrapped_gcode(os.path.join(run_dir, 'input.nc'), num_lines, 3.0)
+        generate_workload.write_probe_file(os.path.join(run_dir, 'probe_file.txt'), 10, 24, 3.0)
+        elapsed, peak = time_script('apply_cylinder_autolevel.py', run_dir, repeat, ['--quiet'])
+        record(results, 'apply_cylinder_autolevel' + tag, elapsed, peak, num_lines, 'lines/s')
+        shutil.rmtree(run_dir)
+
+        run_dir = os.path.join(work_dir, 'inverse_time' + tag)
+        os.mkdir(run_dir)
+        generate_workload.write_wrapped_gcode(os.path.join(run_dir, 'test_input.nc'), num_lines, 3.0)
+        elapsed, peak = time_script('convert_to_inverse_time.py', run_dir, repeat, ['--quiet'])
+        record(results, 'convert_to_inverse_time' + tag, elapsed, peak, num_lines, 'lines/s')
+        shutil.rmtree(run_dir)
+
+        run_dir = os.path.join(work_dir, 'widen_holes' + tag)
+        os.mkdir(run_dir)
+        generate_workload.write_drill_gcode(os.path.join(run_dir, 'drill_holes.nc'), num_lines)
+        elapsed, peak = time_script('widen_holes.py', run_dir, repeat, ['--quiet'])
+        record(results, 'widen_holes' + tag, elapsed, peak, num_lines, 'lines/s')
+        shutil.rmtree(run_dir)
+
+
+def compare(results, baseline_filename, threshold):
+    baseline = json.load(open(baseline_filename))['results']
+    print('\nComparison against', baseline_filename)
+    regressions = 0
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        ratio = result['time']/baseline[name]['time']
+        status = ''
+        if ratio > 1.0 + threshold:
+            status = 'REGRESSION'
+            regressions += 1
+        elif ratio < 1.0 - threshold:
+            status = 'faster'
+        print('{:45s} {:6.2f}x time  {}'.format(name, ratio, status))
+
+    return regressions
+
+
+if __name__ == '__main__':
+    repeat = 3
+    grids = probe_grids
+    sizes = line_counts
+    save_filename = None
+    compare_filename = None
+    threshold = 0.1
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], 'h', ['quick', 'full', 'repeat=', 'lines=',
+                                                       'save=', 'compare=', 'threshold='])
+    except getopt.GetoptError:
+        print(usage)
+        sys.exit(1)
+
+    for opt, arg in opts:
+        if opt == '-h':
+            print(usage)
+            sys.exit()
+        if opt == '--quick':
+            grids = probe_grids_quick
+            sizes = line_counts_quick
+            repeat = 1
+        if opt == '--full':
+            sizes = line_counts_full
+        if opt == '--repeat':
+            repeat = int(arg)
+        if opt == '--lines':
+            sizes = [int(n) for n in arg.split(',')]
+        if opt == '--save':
+            save_filename = arg
+        if opt == '--compare':
+            compare_filename = arg
+        if opt == '--threshold':
+            threshold = float(arg)
+
+    cases = args if args else ['probe', 'generators', 'modifiers']
+    results = {}
+    work_dir = tempfile.mkdtemp(prefix='benchmark_')
+    print('{:45s} {:>11s} {:>22s} {:>9s}'.format('Case', 'Time', 'Throughput', 'Peak'))
+    try:
+        if 'probe' in cases:
+            bench_probe(results, work_dir, grids, repeat)
+        if 'generators' in cases:
+            bench_generators(results, work_dir, repeat)
+        if 'modifiers' in cases:
+            bench_modifiers(results, work_dir, sizes, repeat)
+    finally:
+        shutil.rmtree(work_dir)
+
+    if save_filename is not None:
+        output_file = open(save_filename, 'w')
+        json.dump({
+            'date': time.strftime('%Y-%m-%d %H:%M:%S'),
+            'python': platform.python_version(),
+            'machine': platform.platform(),
+            'results': results,
+        }, output_file, indent=2)
+        output_file.close()
+        print('\nResults saved to:', save_filename)
+
+    if compare_filename is not None:
+        if compare(results, compare_filename, threshold) > 0:
+            print('\nPerformance regression found')
+            sys.exit(1)
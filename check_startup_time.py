@@ -0,0 +1,177 @@
+#!/usr/bin/env python
+import os
+import sys
+import getopt
+import shutil
+import subprocess
+import tempfile
+
+# Checks the startup (import) time of every script against a time budget.
+# Each script is run with 'python -X importtime' in a scratch folder. The
+# generators get a minimal .inputs file there with probing turned off, so
+# the imports are the ones of a real constant depth job, lazy ones included,
+# and the run has to write its G-code. The import time reported is the total
+# for the script minus the cost of an empty interpreter.
+#
+# Exits with a non-zero status if any script is over budget, if it imports a
+# module it shouldn't need (e.g. scipy for a constant depth job) or if a
+# generator fails to write its G-code.
+
+usage = 'check_startup_time.py [--repeat=3] [--scale=1.0] [script.py ...]'
+
+# Budgets are in seconds. inputs is the .inputs file written for a
+# generator, the scripts without one are only started.
+# numpy alone is ~0.1-0.15 s, scipy.interpolate and matplotlib are ~0.5 s
+entry_points = {
+    'pre_probe_cylinder.py': {
+        'budget': 0.05,
+        'forbidden': ['numpy', 'scipy', 'matplotlib'],
+        'inputs': "pre_probe_inputs.update({'outer_diameter': 6.0, 'num_x_points': 1, 'num_a_points': 24, "
+                  "'start_x': 0.0, 'end_x': 0.0})\n",
+    },
+    'pre_probe_cylinder_edge.py': {
+        'budget': 0.05,
+        'forbidden': ['numpy', 'scipy', 'matplotlib'],
+        'inputs': "pre_probe_inputs.update({'outer_diameter': 6.0, 'num_a_points': 24, 'edge_x': 0.0, "
+                  "'probe_z': 2.9})\n",
+    },
+    'pre_probe_cylinder_plot.py': {
+        'budget': 0.3,
+        'forbidden': ['scipy', 'matplotlib'],
+    },
+    'cut_groove_cylinder.py': {
+        'budget': 0.05,
+        'forbidden': ['numpy', 'scipy', 'matplotlib'],
+        'inputs': "inputs['use_probe_file'] = False\n",
+    },
+    'cut_recess_cylinder.py': {
+        'budget': 0.05,
+        'forbidden': ['numpy', 'scipy', 'matplotlib'],
+        'inputs': "inputs['use_probe_file'] = False\n",
+    },
+    'drill_holes_cylinder.py': {
+        'budget': 0.3,
+        'forbidden': ['scipy', 'matplotlib'],
+        'inputs': "inputs['use_Z_probe_file'] = False\ninputs['use_X_probe_file'] = False\n",
+    },
+    'generate_cylinder.py': {
+        'budget': 0.05,
+        'forbidden': ['numpy', 'scipy', 'matplotlib'],
+    },
+    'apply_cylinder_autolevel.py': {
+        'budget': 0.3,
+        'forbidden': ['scipy', 'matplotlib'],
+    },
+    'convert_to_inverse_time.py': {
+        'budget': 0.05,
+        'forbidden': ['numpy', 'scipy', 'matplotlib'],
+    },
+    'widen_holes.py': {
+        'budget': 0.05,
+        'forbidden': ['numpy', 'scipy', 'matplotlib'],
+    },
+    'unwind_a_axis.py': {
+        'budget': 0.05,
+        'forbidden': ['numpy', 'scipy', 'matplotlib'],
+    },
+    'pipeline.py': {
+        'budget': 0.05,
+        'forbidden': ['numpy', 'scipy', 'matplotlib'],
+    },
+    'wrap_to_cylinder.py': {
+        'budget': 0.3,
+        'forbidden': ['scipy', 'matplotlib'],
+    },
+}
+
+
+def run_importtime(args, cwd):
+    # Returns the total import time (s), the list of imported modules and
+    # the exit status
+    result = subprocess.run([sys.executable, '-X', 'importtime'] + args,
+                            cwd=cwd, stdout=subprocess.DEVNULL,
+                            stderr=subprocess.PIPE, universal_newlines=True)
+    total_us = 0
+    modules = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        fields = line[len('import time:'):].split('|')
+        name = fields[2][1:].rstrip()
+        modules.append(name.strip())
+        # Only top level imports are summed, nested ones are included in
+        # the cumulative time of their parent
+        if not name.startswith(' '):
+            total_us += int(fields[1])
+
+    return total_us/1.0e6, modules, result.returncode
+
+
+def check_script(script, settings, repeat, scale):
+    script_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), script)
+    inputs_text = settings.get('inputs')
+    times = []
+    modules = []
+    generated = True
+    for i in range(repeat):
+        work_dir = tempfile.mkdtemp(prefix='startup_')
+        try:
+            if inputs_text is not None:
+                inputs_file = open(os.path.join(work_dir, script[:-len('.py')] + '.inputs'), 'w')
+                inputs_file.write(inputs_text)
+                inputs_file.close()
+            baseline, _, _ = run_importtime(['-c', 'pass'], work_dir)
+            total, modules, status = run_importtime([script_path], work_dir)
+            if inputs_text is not None:
+                generated &= status == 0 and any(name.endswith('.nc') for name in os.listdir(work_dir))
+        finally:
+            shutil.rmtree(work_dir)
+        times.append(max(total - baseline, 0.0))
+    import_time = min(times)
+    budget = settings['budget']*scale
+
+    errors = []
+    if not generated:
+        errors.append('no G-code written')
+    if import_time > budget:
+        errors.append('over budget')
+    for module in settings['forbidden']:
+        if module in modules:
+            errors.append('imports ' + module)
+
+    status = 'OK' if not errors else 'FAIL (' + ', '.join(errors) + ')'
+    print('{:30s} {:7.3f} s  budget {:5.3f} s  {}'.format(script, import_time, budget, status))
+
+    return not errors
+
+
+if __name__ == '__main__':
+    repeat = 3
+    scale = 1.0
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], 'h', ['repeat=', 'scale='])
+    except getopt.GetoptError:
+        print(usage)
+        sys.exit(1)
+
+    for opt, arg in opts:
+        if opt == '-h':
+            print(usage)
+            sys.exit()
+        if opt == '--repeat':
+            repeat = int(arg)
+        if opt == '--scale':
+            scale = float(arg)
+
+    scripts = args if args else list(entry_points)
+    print('Checking script startup time (best of {:d})\n'.format(repeat))
+    passed = True
+    for script in scripts:
+        if script not in entry_points:
+            print('Unknown script:', script, '\nExiting!')
+            sys.exit(1)
+        passed &= check_script(script, entry_points[script], repeat, scale)
+
+    if not passed:
+        print('\nStartup time check failed')
+        sys.exit(1)
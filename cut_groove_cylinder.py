@@ -2,13 +2,11 @@
 import os
 import sys
 import math
-import numpy as np
-import probe
 
 import rotary_axis_cam
 
 # Create G-code to cut a groove in cylinder in a manner that accepts pre-probe
-# results. 
+# results.
 # Inverse Time mode (G93) is used to specify feed rates
 
 
@@ -16,6 +14,16 @@ import rotary_axis_cam
 #   1) The center of the cylinder is along the Y=0, Z=0 axis
 #   2) Ignores X-axis, unless it's specified.
 
+# Can also be used as a module:
+#   import cut_groove_cylinder
+#   job_inputs, job_cutter_inputs = cut_groove_cylinder.check_inputs({'groove_depth': 0.5}, {})
+#   for line in cut_groove_cylinder.cut_groove(job_inputs, job_cutter_inputs):
+#       ...
+
+# With skip_air_cuts, stock has to be this far below a move for it to be
+# treated as air (probe and spline error)
+air_cut_margin = 0.005
+
 script_inputs_file = './cut_groove_cylinder.inputs'
 inputs = {
     'outer_diameter' : 12.0,
@@ -24,6 +32,7 @@ inputs = {
     'angular_increment': 15,
     'direction': 1,
     'use_probe_file': False,
+    'skip_air_cuts': False, # with use_probe_file, cut to the nominal depth and rapid over air
     'output_file': None
 }
 cutter_inputs = {
@@ -31,192 +40,290 @@ cutter_inputs = {
     'depth_per_pass' : 0.05,
     'feedrate_plunge' : 0.75,
     'feedrate_linear': 5.0, # IPM
+    'local_retract': False, # rapid down to the probed surface + safe_clearance before plunging
+    'rapid_angular': 3600.0, # deg/min, only used for time estimates
+    # Feed scheduling, used when chip_load is set. The feed of every move is
+    # the highest that keeps the chip load within chip_load for its depth of
+    # cut (the groove is always a full width slot), up to feedrate_max.
+    'chip_load': None,       # in/tooth
+    'spindle_rpm': None,
+    'num_flutes': 2,
+    'feedrate_max': None,    # IPM
+    'axial_limit': None,     # in, deeper cuts are fed slower (optional)
 }
 
-if os.path.isfile(script_inputs_file):
-    print('Input file exists, loading inputs file')
-    exec(open(script_inputs_file).read())
-else:
-    # Write inputs file
-    try:
-        outputfile = open(script_inputs_file, 'w')
-    except IOError:
-        print('Cannot open', script_inputs_file, '\nExiting!')
-    print('Writing input values to:', script_inputs_file)
-    outputfile.write('inputs = {\n')
-    rotary_axis_cam.write_dict(outputfile, inputs)
-    outputfile.write('cutter_inputs = {\n')
-    rotary_axis_cam.write_dict(outputfile, cutter_inputs)
-    outputfile.close()
-    print('Update cut_groove_cylinder.inputs and re-run')
-    sys.exit()
-
-if inputs['use_probe_file']:
-    # Load module for interpolation
-    from scipy import interpolate
-
-outer_radius = inputs['outer_diameter']/2.0
-z_ref = outer_radius
-
-# Angular Data
-angular_increment = inputs['angular_increment']
-direction = inputs['direction']
-
-if direction == 1:
-    A_values = range(angular_increment, angular_increment + 360, angular_increment)
-elif direction == -1:
-    A_values = range(360-angular_increment, -angular_increment, -angular_increment)
-else:
-    print('Invalid value for direction\nExiting')
-    sys.exit(1)
-
-angular_increment_distance = math.pi/180.0*angular_increment*outer_radius
-a_current = 0
-
-# X-axis Data
-if inputs['x_loc'] is not None:
-    x_groove = inputs['x_loc']
 
-# Z-axis Data
-safe_z_height = outer_radius + cutter_inputs['safe_clearance']
-groove_depth = inputs['groove_depth']
-if cutter_inputs['depth_per_pass'] < 0.0:
-    print('depth_per_pass needs to be a positive value.\nExiting!')
-    sys.exit(1)
-elif cutter_inputs['depth_per_pass'] > groove_depth:
-    cutter_inputs['depth_per_pass'] = groove_depth
-num_passes = int(math.ceil(groove_depth/cutter_inputs['depth_per_pass']))
-
-z_final = outer_radius - groove_depth
-
-z_current = z_ref - cutter_inputs['depth_per_pass']
-
-# Time (min)
-total_time = 0.0
-
-print('\nGroove Data')
-if inputs['x_loc'] is not None:
-    print('Groove X: {:5.4f}'.format(inputs['x_loc']))
-print('Final Groove Depth: {:5.4f}'.format(inputs['groove_depth']))
-print('Depth per Pass: {:5.4f}'.format(cutter_inputs['depth_per_pass']))
-print('Number of Passes: {:3d}'.format(num_passes))
-
-# Read Probe Data if needed
-if inputs['use_probe_file']:
-    print('\nReading Probe Data')
-    probe_num_X, probe_num_A, probe_X, probe_Z, probe_A = probe.read_cylinder_probe_file('probe_results.txt')
-    probe_X_values = np.unique(probe_X)
-    probe_A_values = np.unique(probe_A)
-    
-    # Check Probe Data dimensions
-    probe_dim = None
-    if probe_X_values.size == 1:
-        print('Probe Data is 2D (A and Z)')
-        probe_dim = 1
-    else:
-        print('Probe Data is 3D (X, A and Z)')
-        probe_dim = 2
-        
-    # Convert Z to delta Z map
-    dZ = probe_Z - z_ref
-
-    dZ_min = np.min(dZ)
-    dZ_max = np.max(dZ)
-    print('  dZ Min: {:5.4f}'.format(dZ_min))
-    print('  dZ Max: {:5.4f}'.format(dZ_max))
-    
-    probe_f = probe.setup_interpolation(probe_X_values, probe_A_values, dZ, probe_dim)
-
-
-# Open Output File
-if inputs['output_file'] is None:
+def check_inputs(job_inputs, job_cutter_inputs):
+    # Returns complete copies of the inputs (defaults for anything not
+    # given). Raises ValueError for invalid inputs.
+    checked_inputs = dict(inputs)
+    checked_inputs.update(job_inputs)
+    checked_cutter_inputs = dict(cutter_inputs)
+    checked_cutter_inputs.update(job_cutter_inputs)
+
+    if checked_inputs['direction'] not in [1, -1]:
+        raise ValueError('Invalid value for direction')
+    if checked_cutter_inputs['depth_per_pass'] <= 0.0:
+        raise ValueError('depth_per_pass needs to be a positive value.')
+    elif checked_cutter_inputs['depth_per_pass'] > checked_inputs['groove_depth']:
+        checked_cutter_inputs['depth_per_pass'] = checked_inputs['groove_depth']
+    rotary_axis_cam.check_feed_schedule(checked_cutter_inputs)
+
+    return checked_inputs, checked_cutter_inputs
+
+
+def output_filename(job_inputs):
+    if job_inputs['output_file'] is not None:
+        return job_inputs['output_file']
+
     # Autocreate filename
-    output_filename = 'cut_groove_'
-    output_filename += str(inputs['outer_diameter']) + '_od_'
-    if inputs['x_loc'] is not None:
-        output_filename += str(inputs['x_loc']) + '_x_'
-    output_filename += str(inputs['groove_depth']) + '_depth'
-    if inputs['use_probe_file']: output_filename += '_autolevel'
-    output_filename += '.nc'
-    
- 
-else:
-    output_filename = inputs['output_file']
-print('\nWriting Gcode to:', output_filename)
-output_file = open(output_filename,'w')
-
-# Write Header
-output_file.write('(G-code automatically written using cut_recess_cylinder.py)\n')
-output_file.write('G90   (set absolute distance mode)\n')
-output_file.write('G90.1 (set absolute distance mode for arc centers)\n')
-output_file.write('G17   (set active plane to XY)\n')
-output_file.write('G20   (set units to inches)\n')
-output_file.write('G94   (standard feed rates)\n')
-output_file.write('\n')
-output_file.write('(Script Inputs)\n')
-output_file.write('(Groove X: {:6.4f})\n'.format(inputs['x_loc']))
-output_file.write('(Groove Depth: {:6.4f})\n'.format(inputs['groove_depth']))
-output_file.write('(Feedrate Plunge: {:3.2f})\n'.format(cutter_inputs['feedrate_plunge']))
-output_file.write('(Feedrate Linear: {:3.2f})\n'.format(cutter_inputs['feedrate_linear']))
-output_file.write('(Depth per Pass: {:5.4f})\n'.format(cutter_inputs['depth_per_pass']))
-output_file.write('\n')
-
-# Position at Start
-output_file.write('G0 Z {:5.4f} (Safe Z height)\n'.format(safe_z_height))
-if inputs['x_loc'] is not None:
-    output_file.write('G0 X {:5.4f} Y 0.0000 A {:5.4f}\n'.format(x_groove, a_current))
-else:
-    print('Warning, omitting X value in start location')
-    output_file.write('G0 Y 0.0000 A {:5.4f}\n'.format(a_current))
-
-A_absolute = 0
-done = False
-while done is False:
-    output_file.write('({:2.2f} cut)\n'.format(z_current))
-    # Plunge into material
-    if inputs['use_probe_file']:
-        if probe_dim == 1:
-            # Interpolate dZ based on A only
-            dz_current = probe_f(0)[0]
-        elif probe_dim == 2:
-            # Interpolate dZ based on X and A
-            dz_current = probe_f(x_groove, a_current)[0,0]
-        z_local = z_current + dz_current
+    filename = 'cut_groove_'
+    filename += str(job_inputs['outer_diameter']) + '_od_'
+    if job_inputs['x_loc'] is not None:
+        filename += str(job_inputs['x_loc']) + '_x_'
+    filename += str(job_inputs['groove_depth']) + '_depth'
+    if job_inputs['use_probe_file']: filename += '_autolevel'
+    filename += '.nc'
+
+    return filename
+
+
+def cut_groove(inputs, cutter_inputs, probe_f=None, probe_dim=None, stats=None):
+    # Yields the G-code lines for the groove. inputs and cutter_inputs come
+    # from check_inputs. probe_f and probe_dim are the delta Z surface from
+    # probe.load_probe_surface, used when inputs['use_probe_file'] is set.
+    # If given, stats is filled in with the machining time (mins), with
+    # skip_air_cuts the time saved by not cutting air (mins) and with feed
+    # scheduling the lowest and highest feed rates used (IPM).
+    use_probe = inputs['use_probe_file'] and probe_f is not None
+    skip_air = use_probe and inputs['skip_air_cuts']
+    schedule = rotary_axis_cam.check_feed_schedule(cutter_inputs)
+
+    outer_radius = inputs['outer_diameter']/2.0
+    z_ref = outer_radius
+
+    # Angular Data
+    angular_increment = inputs['angular_increment']
+    direction = inputs['direction']
+
+    if direction == 1:
+        A_values = range(angular_increment, angular_increment + 360, angular_increment)
+    else:
+        A_values = range(360-angular_increment, -angular_increment, -angular_increment)
+
+    angular_increment_distance = math.pi/180.0*angular_increment*outer_radius
+    a_current = 0
+
+    # X-axis Data
+    x_groove = inputs['x_loc']
+
+    # Z-axis Data
+    safe_z_height = outer_radius + cutter_inputs['safe_clearance']
+    groove_depth = inputs['groove_depth']
+    z_final = outer_radius - groove_depth
+    z_current = z_ref - cutter_inputs['depth_per_pass']
+
+    # Time (min)
+    total_time = 0.0
+    air_time_saved = 0.0
+
+    # Write Header
+    yield '(G-code automatically written using cut_recess_cylinder.py)\n'
+    yield 'G90   (set absolute distance mode)\n'
+    yield 'G90.1 (set absolute distance mode for arc centers)\n'
+    yield 'G17   (set active plane to XY)\n'
+    yield 'G20   (set units to inches)\n'
+    yield 'G94   (standard feed rates)\n'
+    yield '\n'
+    yield '(Script Inputs)\n'
+    if x_groove is not None:
+        yield '(Groove X: {:6.4f})\n'.format(x_groove)
+    yield '(Groove Depth: {:6.4f})\n'.format(inputs['groove_depth'])
+    yield '(Feedrate Plunge: {:3.2f})\n'.format(cutter_inputs['feedrate_plunge'])
+    yield '(Feedrate Linear: {:3.2f})\n'.format(cutter_inputs['feedrate_linear'])
+    yield '(Depth per Pass: {:5.4f})\n'.format(cutter_inputs['depth_per_pass'])
+    yield '\n'
+
+    # Position at Start
+    yield 'G0 Z {:5.4f} (Safe Z height)\n'.format(safe_z_height)
+    if x_groove is not None:
+        yield 'G0 X {:5.4f} Y 0.0000 A {:5.4f}\n'.format(x_groove, a_current)
     else:
-        z_local = z_current
-    output_file.write('G1 Z {:5.4f} F {:3.2f} (plunge cut)\n'.format(z_local,cutter_inputs['feedrate_plunge']))
-    total_time += (safe_z_height - z_local)/cutter_inputs['feedrate_plunge']
-
-    current_feedrate_linear = cutter_inputs['feedrate_linear']
-    current_feedrate_inverse_t = current_feedrate_linear/angular_increment_distance
-    output_file.write('G93 (switch to inverse time)\n')
-    for A in A_values:
-        if inputs['use_probe_file']:
-            if probe_dim == 1:
-                # Interpolate dZ based on A only
-                dz_current = probe_f(A)[0]
-            elif probe_dim == 2:
-                # Interpolate dZ based on X and A
-                dz_current = probe_f(x_groove, A)[0,0]
-            z_local = z_current + dz_current
-        A_absolute += angular_increment*direction
-        output_file.write('G1 Z {:5.4f} A {:6.2f} F {:5.4f} ({:6.2f})\n'.format(z_local, A_absolute, current_feedrate_inverse_t, A))
-        total_time += 1.0/current_feedrate_inverse_t
-    output_file.write('G94 (switch back to normal feed rate)\n')
-    if z_current == z_final:
-        done = True
+        yield 'G0 Y 0.0000 A {:5.4f}\n'.format(a_current)
+
+    # With local_retract, rapid down to just above the probed surface at the
+    # plunge point rather than feeding down from the safe height
+    z_start = safe_z_height
+    if use_probe and cutter_inputs['local_retract']:
+        import probe
+        dz_max = probe.max_along_moves(probe_f, probe_dim, [x_groove], [0.0], [x_groove], [0.0])[0]
+        z_start = z_ref + dz_max + cutter_inputs['safe_clearance']
+        yield 'G0 Z {:5.4f} (local retract)\n'.format(z_start)
+
+    # With skip_air_cuts the passes are at the nominal depth and the probe
+    # only says where the stock is. The top of the stock along every move of
+    # the circle is found at once, moves above it are rapids and passes that
+    # are above it everywhere are left out. The groove has no X travel (and
+    # no mill size), so only the groove X is checked.
+    if skip_air:
+        import probe
+        A0 = [a_current + angular_increment*direction*i for i in range(len(A_values) + 1)]
+        X0 = [x_groove]*len(A_values)
+        stock = z_ref + probe.max_along_moves(probe_f, probe_dim, X0, A0[:-1], X0, A0[1:]) + air_cut_margin
+        stock_plunge = z_ref + probe.max_along_moves(probe_f, probe_dim, [x_groove], [0.0], [x_groove], [0.0])[0] + air_cut_margin
+        circle_time = len(A_values)*angular_increment_distance/cutter_inputs['feedrate_linear']
+        rapid_time = angular_increment/cutter_inputs['rapid_angular']
+
+    # Otherwise the passes follow the probed surface. The offsets around the
+    # circle are the same for every pass, so they are found once.
+    if use_probe and not skip_air:
+        import probe
+        surface = probe.ProbeSurface(probe_f, probe_dim)
+        dz_plunge = surface(x_groove, a_current)
+        dz_circle = surface.precompute_grid([x_groove], list(A_values))[0].tolist()
+
+    # With feed scheduling, the depth of cut is from the previous pass (or the
+    # top of the stock found for skip_air_cuts, which can be above z_ref)
+    feedrates_used = []
+    z_previous = float('inf') if skip_air else z_ref
+    A_absolute = 0
+    done = False
+    while done is False:
+        if skip_air and z_current >= stock_plunge and bool((z_current >= stock).all()):
+            # Above the stock everywhere, leave the pass out
+            air_time_saved += (z_start - z_current)/cutter_inputs['feedrate_plunge'] + circle_time
+        else:
+            yield '({:2.2f} cut)\n'.format(z_current)
+            # Plunge into material
+            if use_probe and not skip_air:
+                z_local = z_current + dz_plunge
+            else:
+                z_local = z_current
+            if skip_air and z_current >= stock_plunge:
+                yield 'G0 Z {:5.4f} (above stock)\n'.format(z_local)
+                air_time_saved += (z_start - z_local)/cutter_inputs['feedrate_plunge']
+            else:
+                yield 'G1 Z {:5.4f} F {:3.2f} (plunge cut)\n'.format(z_local,cutter_inputs['feedrate_plunge'])
+                total_time += (z_start - z_local)/cutter_inputs['feedrate_plunge']
+
+            current_feedrate_linear = cutter_inputs['feedrate_linear']
+            current_feedrate_inverse_t = current_feedrate_linear/angular_increment_distance
+            yield 'G93 (switch to inverse time)\n'
+            rapid_A = None
+            for i, A in enumerate(A_values):
+                if skip_air and z_current >= stock[i]:
+                    # Above the stock, rapid instead (A moves are combined)
+                    if rapid_A is None:
+                        rapid_A = A_absolute
+                    A_absolute += angular_increment*direction
+                    air_time_saved += 1.0/current_feedrate_inverse_t - rapid_time
+                    total_time += rapid_time
+                    continue
+                if rapid_A is not None:
+                    A_absolute, rapid_line = rotary_axis_cam.air_rapid_A(rapid_A, A_absolute)
+                    yield rapid_line
+                    rapid_A = None
+                if use_probe and not skip_air:
+                    z_local = z_current + dz_circle[i]
+                if schedule:
+                    z_stock = min(stock[i], z_previous) if skip_air else z_previous
+                    feedrate = rotary_axis_cam.engagement_feedrate(cutter_inputs, z_stock - z_current)
+                    feedrates_used.append(feedrate)
+                    current_feedrate_inverse_t = feedrate/angular_increment_distance
+                A_absolute += angular_increment*direction
+                yield 'G1 Z {:5.4f} A {:6.2f} F {:5.4f} ({:6.2f})\n'.format(z_local, A_absolute, current_feedrate_inverse_t, A)
+                total_time += 1.0/current_feedrate_inverse_t
+            if rapid_A is not None:
+                A_absolute, rapid_line = rotary_axis_cam.air_rapid_A(rapid_A, A_absolute)
+                yield rapid_line
+            yield 'G94 (switch back to normal feed rate)\n'
+        if z_current == z_final:
+            done = True
+        else:
+            z_previous = z_current
+            z_current -= cutter_inputs['depth_per_pass']
+            z_current = max(z_current,z_final)
+
+    # Raise to safe Z height
+    yield 'G0 Z {:5.4f} (Safe Z height)\n'.format(safe_z_height)
+
+    yield 'M5 M2\n'
+    yield '(Machine Time Required: {:4.0f} mins)'.format(total_time)
+
+    if stats is not None:
+        stats['total_time'] = total_time
+        if skip_air:
+            stats['air_time_saved'] = air_time_saved
+        if feedrates_used:
+            stats['feedrate_min'] = min(feedrates_used)
+            stats['feedrate_max'] = max(feedrates_used)
+
+
+def main(argv):
+    metrics = rotary_axis_cam.metrics_from_argv('cut_groove_cylinder', argv)
+    metrics.stage('read_inputs')
+
+    defaults = {'inputs': inputs, 'cutter_inputs': cutter_inputs}
+    if os.path.isfile(script_inputs_file):
+        print('Input file exists, loading inputs file')
+        job = rotary_axis_cam.read_inputs_file(script_inputs_file, defaults)
     else:
-        z_current -= cutter_inputs['depth_per_pass']
-        z_current = max(z_current,z_final)
+        # Write inputs file
+        rotary_axis_cam.write_inputs_file(script_inputs_file, defaults)
+        print('Update cut_groove_cylinder.inputs and re-run')
+        sys.exit()
+
+    try:
+        job_inputs, job_cutter_inputs = check_inputs(job['inputs'], job['cutter_inputs'])
+    except ValueError as error:
+        print(str(error) + '\nExiting!')
+        sys.exit(1)
+
+    outer_radius = job_inputs['outer_diameter']/2.0
+    num_passes = int(math.ceil(job_inputs['groove_depth']/job_cutter_inputs['depth_per_pass']))
+
+    print('\nGroove Data')
+    if job_inputs['x_loc'] is not None:
+        print('Groove X: {:5.4f}'.format(job_inputs['x_loc']))
+    print('Final Groove Depth: {:5.4f}'.format(job_inputs['groove_depth']))
+    print('Depth per Pass: {:5.4f}'.format(job_cutter_inputs['depth_per_pass']))
+    print('Number of Passes: {:3d}'.format(num_passes))
+
+    # Read Probe Data if needed
+    probe_f = None
+    probe_dim = None
+    if job_inputs['use_probe_file']:
+        metrics.stage('read_probe')
+        # Load module for interpolation, only needed when autoleveling
+        import probe
+        print('\nReading Probe Data')
+        probe_f, probe_dim = probe.load_probe_surface('probe_results.txt', outer_radius, metrics)
+        probe_f = metrics.timed('surface_eval', probe_f)
+
+    # Open Output File
+    metrics.stage('generate')
+    filename = output_filename(job_inputs)
+    print('\nWriting Gcode to:', filename)
+    if job_inputs['x_loc'] is None:
+        print('Warning, omitting X value in start location')
+    output_file = rotary_axis_cam.open_file(filename,'w')
+    stats = {}
+    output_file.writelines(cut_groove(job_inputs, job_cutter_inputs, probe_f, probe_dim, stats))
+
+    print('Machining Time Required: {:4.0f} mins'.format(stats['total_time']))
+    print('                         {:3.2f} hrs'.format(stats['total_time']/60.0))
+    if 'air_time_saved' in stats:
+        print('Air Cut Time Saved: {:4.0f} mins'.format(stats['air_time_saved']))
+    if 'feedrate_min' in stats:
+        print('Scheduled Feed Rates: {:3.2f} to {:3.2f} IPM'.format(stats['feedrate_min'], stats['feedrate_max']))
 
-# Raise to safe Z height
-output_file.write('G0 Z {:5.4f} (Safe Z height)\n'.format(safe_z_height))
+    # Close File
+    metrics.stage('close_files')
+    output_file.close()
+    metrics.count('bytes_written', os.path.getsize(filename))
 
-print('Machining Time Required: {:4.0f} mins'.format(total_time))
-print('                         {:3.2f} hrs'.format(total_time/60.0))
+    metrics.finish()
 
-output_file.write('M5 M2\n')
-output_file.write('(Machine Time Required: {:4.0f} mins)'.format(total_time))
 
-# Close File
-output_file.close()
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -1,18 +1,32 @@
 #!/usr/bin/env python
+import os
 import sys
 import math
-import numpy as np
-import probe
+
+import rotary_axis_cam
 
 # Create G-code to cut recess in cylinder in a manner that accepts pre-probe
-# results. Instead of cutting in a spiral pattern, cut are made in circles.
-# Inverse Time mode (G93) is used to specify feed rates
+# results. By default cuts are made in circles, with an X stepover between
+# them. With helical, A turns continuously while X advances up to one
+# stepover per revolution instead. Inverse Time mode (G93) is used to specify feed rates
 
 
 # Script assumes
 #   1) The center of the cylinder is along the Y=0, Z=0 axis
 #   2) X = 0 is the start of the cylinder
 
+# Can also be used as a module:
+#   import cut_recess_cylinder
+#   job = cut_recess_cylinder.check_inputs({'recess_depth': 0.08}, {}, {})
+#   for line in cut_recess_cylinder.cut_recess(*job):
+#       ...
+
+# With skip_air_cuts, stock has to be this far below a move for it to be
+# treated as air (probe and spline error)
+air_cut_margin = 0.005
+
+# Inputs can optionally be overridden with a cut_recess_cylinder.inputs file
+script_inputs_file = './cut_recess_cylinder.inputs'
 inputs = {
     'outer_diameter' : 12.0,
     'recess_depth' : 0.06,
@@ -22,6 +36,8 @@ inputs = {
     'angular_increment': 15,
     'direction': -1,
     'use_probe_file': False,
+    'skip_air_cuts': False, # with use_probe_file, cut to the nominal depth and rapid over air
+    'helical': False, # one continuous helix from x_start to x_end instead of circles
     'output_file': None
 }
 cutter_inputs = {
@@ -32,6 +48,17 @@ cutter_inputs = {
     'depth_per_pass' : 0.10,
     'feedrate_plunge' : 0.5,  # IPM
     'feedrate_linear': 12.0,   # IPM
+    'local_retract': False,  # retract to the probed surface + safe_clearance between passes
+    'rapid_linear': 100.0,   # IPM, only used for time estimates
+    'rapid_angular': 3600.0, # deg/min
+    # Feed scheduling, used when chip_load is set. The linear feed of every
+    # move is the highest that keeps the chip load within chip_load for its
+    # width and depth of cut, up to feedrate_max.
+    'chip_load': None,       # in/tooth
+    'spindle_rpm': None,
+    'num_flutes': 2,
+    'feedrate_max': None,    # IPM
+    'axial_limit': None,     # in, deeper cuts are fed slower (optional)
 }
 isogrid_inputs = {
     'flange_width' : 0.3125,
@@ -40,271 +67,452 @@ isogrid_inputs = {
     'rib_width': 0.05,
 }
 
-if inputs['use_probe_file']:
-    # Load module for interpolation
-    from scipy import interpolate
-
-outer_radius = inputs['outer_diameter']/2.0
-z_ref = outer_radius
-
-# Angular Data
-angular_increment = inputs['angular_increment']
-direction = inputs['direction']
-if direction == 1:
-    A_values = range(angular_increment, angular_increment + 360, angular_increment)
-elif direction == -1:
-    A_values = range(360-angular_increment, -angular_increment, -angular_increment)
-else:
-    print('Invalid value for direction\nExiting')
-    sys.exit(1)
-A_values_fc = range(360-angular_increment, -angular_increment, -angular_increment)
-angular_increment_distance = math.pi/180.0*angular_increment*outer_radius
-A_start = 360
-
-# X-axis Data
-dx_stepover = cutter_inputs['mill_diameter']*cutter_inputs['overlap']
-if inputs['isogrid'] is True:
-    print('Using isogrid parameters to size recess')
-    triangle_height = (3.0**0.5)/2.0 * isogrid_inputs['pattern_size'] # isogrid triangle height
-    x_start = isogrid_inputs['flange_width'] + cutter_inputs['material_to_leave'] + cutter_inputs['mill_diameter']/2.0
-    recess_length = triangle_height*isogrid_inputs['num_rows'] - isogrid_inputs['rib_width'] - 2*cutter_inputs['material_to_leave']
-    dx_recess = recess_length - cutter_inputs['mill_diameter']
-    x_end = x_start + dx_recess
-    print('Triangle Height: {:4.3f}'.format(triangle_height))
-    print('Number of Rows: {:2d}'.format(isogrid_inputs['num_rows']))
-else:
-    print('Using specified x_start and x_end values for recess')
-    x_start = inputs['x_start'] + cutter_inputs['material_to_leave'] + cutter_inputs['mill_diameter']/2.0
-    x_end = inputs['x_end'] - cutter_inputs['material_to_leave'] - cutter_inputs['mill_diameter']/2.0
-
-# Z-axis Data
-safe_z_height = outer_radius + cutter_inputs['safe_clearance']
-dz_recess = inputs['recess_depth'] - cutter_inputs['material_to_leave']
-# NOTE: Dont want depth per pass to exceed dz_recess
-if cutter_inputs['depth_per_pass'] > dz_recess:
-    cutter_inputs['depth_per_pass'] = dz_recess
-z_final = z_ref - dz_recess
-# Check depth per pass
-num_passes = int(math.ceil(dz_recess/cutter_inputs['depth_per_pass']))
-z_current = z_ref - cutter_inputs['depth_per_pass']
-print(z_current)
-# Time (min)
-total_time = 0.0
-
-print('\nDimensions')
-print('Outer Radius: {:5.4f}'.format(outer_radius))
-print('Recess X start: {:5.4f}'.format(x_start))
-print('Recess X end: {:5.4f}'.format(x_end))
-print('dZ recess nominal: {:5.4f}'.format(dz_recess))
-print('Z recess nominal: {:5.4f}'.format(z_final))
-print('Number of Passes: {:3d}'.format(num_passes))
-
-# Read Probe Data if needed
-if inputs['use_probe_file']:
-    print('\nReading Probe Data')
-    probe_num_X, probe_num_A, probe_X, probe_Z, probe_A = probe.read_cylinder_probe_file('probe_results.txt')
-    probe_X_values = np.unique(probe_X)
-    probe_A_values = np.unique(probe_A)
-    
-    # Check Probe Data dimensions
-    probe_dim = None
-    if probe_X_values.size == 1:
-        print('Probe Data is 2D (A and Z)')
-        probe_dim = 1
+
+def check_inputs(job_inputs, job_cutter_inputs, job_isogrid_inputs):
+    # Returns complete copies of the inputs (defaults for anything not
+    # given). Raises ValueError for invalid inputs.
+    checked_inputs = dict(inputs)
+    checked_inputs.update(job_inputs)
+    checked_cutter_inputs = dict(cutter_inputs)
+    checked_cutter_inputs.update(job_cutter_inputs)
+    checked_isogrid_inputs = dict(isogrid_inputs)
+    checked_isogrid_inputs.update(job_isogrid_inputs)
+
+    if checked_inputs['direction'] not in [1, -1]:
+        raise ValueError('Invalid value for direction')
+    dz_recess = checked_inputs['recess_depth'] - checked_cutter_inputs['material_to_leave']
+    if dz_recess <= 0.0:
+        raise ValueError('recess_depth needs to be larger than material_to_leave.')
+    if checked_cutter_inputs['depth_per_pass'] <= 0.0:
+        raise ValueError('depth_per_pass needs to be a positive value.')
+    # NOTE: Dont want depth per pass to exceed dz_recess
+    if checked_cutter_inputs['depth_per_pass'] > dz_recess:
+        checked_cutter_inputs['depth_per_pass'] = dz_recess
+    rotary_axis_cam.check_feed_schedule(checked_cutter_inputs)
+
+    return checked_inputs, checked_cutter_inputs, checked_isogrid_inputs
+
+
+def recess_extents(inputs, cutter_inputs, isogrid_inputs):
+    # Returns the X start and end of the mill center
+    if inputs['isogrid'] is True:
+        triangle_height = (3.0**0.5)/2.0 * isogrid_inputs['pattern_size'] # isogrid triangle height
+        x_start = isogrid_inputs['flange_width'] + cutter_inputs['material_to_leave'] + cutter_inputs['mill_diameter']/2.0
+        recess_length = triangle_height*isogrid_inputs['num_rows'] - isogrid_inputs['rib_width'] - 2*cutter_inputs['material_to_leave']
+        dx_recess = recess_length - cutter_inputs['mill_diameter']
+        x_end = x_start + dx_recess
     else:
-        print('Probe Data is 3D (X, A and Z)')
-        probe_dim = 2
-        
-    # Convert Z to delta Z map
-    dZ = probe_Z - z_ref
-
-    dZ_min = np.min(dZ)
-    dZ_max = np.max(dZ)
-    print('  dZ Min: {:5.4f}'.format(dZ_min))
-    print('  dZ Max: {:5.4f}'.format(dZ_max))
-    
-    probe_f = probe.setup_interpolation(probe_X_values, probe_A_values, dZ, probe_dim)
-    
-
-# Open Output File
-if inputs['output_file'] is None:
+        x_start = inputs['x_start'] + cutter_inputs['material_to_leave'] + cutter_inputs['mill_diameter']/2.0
+        x_end = inputs['x_end'] - cutter_inputs['material_to_leave'] - cutter_inputs['mill_diameter']/2.0
+
+    return x_start, x_end
+
+
+def pass_depths(z_ref, z_final, depth_per_pass):
+    # Nominal Z of each pass
+    z_current = z_ref - depth_per_pass
+    depths = [z_current]
+    while z_current != z_final:
+        z_current -= depth_per_pass
+        z_current = max(z_current,z_final)
+        depths.append(z_current)
+
+    return depths
+
+
+def output_filename(job_inputs, job_cutter_inputs):
+    if job_inputs['output_file'] is not None:
+        return job_inputs['output_file']
+
     # Autocreate filename
-    output_filename = 'cut_recess_'
-    output_filename += str(inputs['outer_diameter']) + '_od_'
-    output_filename += str(cutter_inputs['mill_diameter']) + '_bit_'
-    output_filename += 'leave_' + str(cutter_inputs['material_to_leave'])
-    if inputs['use_probe_file']: output_filename += '_autolevel'
-    output_filename += '.nc'
-    
- 
-else:
-    output_filename = inputs['output_file']
-print('\nWriting Gcode to:', output_filename)
-output_file = open(output_filename,'w')
-
-# Write Header
-output_file.write('(G-code automatically written using cut_recess_cylinder.py)\n')
-output_file.write('G90   (set absolute distance mode)\n')
-output_file.write('G90.1 (set absolute distance mode for arc centers)\n')
-output_file.write('G17   (set active plane to XY)\n')
-output_file.write('G20   (set units to inches)\n')
-output_file.write('G94   (standard feed rates)\n')
-output_file.write('\n')
-output_file.write('(Script Inputs)\n')
-output_file.write('(Recess Start: {:6.4f})\n'.format(inputs['x_start']))
-output_file.write('(Recess End: {:6.4f})\n'.format(inputs['x_end']))
-output_file.write('(Recess Depth: {:6.4f})\n'.format(inputs['recess_depth']))
-output_file.write('(Feedrate Plunge: {:3.2f})\n'.format(cutter_inputs['feedrate_plunge']))
-output_file.write('(Feedrate Linear: {:3.2f})\n'.format(cutter_inputs['feedrate_linear']))
-output_file.write('(Depth per Pass: {:5.4f})\n'.format(cutter_inputs['depth_per_pass']))
-output_file.write('(Material to Leave: {:5.4f})\n'.format(cutter_inputs['material_to_leave']))
-output_file.write('\n')
-
-# Position at Start
-# Start at A=360 for first cut
-output_file.write('G0 Z {:5.4f} (Safe Z height)\n'.format(safe_z_height))
-output_file.write('G0 Y 0.0000 A {:5.4f}\n'.format(A_start))
-
-A_absolute = A_start
-done = False
-while done is False:
-    print('    Writing G-code for {:5.4f} depth'.format(z_current))
-    output_file.write('({:5.4f} cut)\n'.format(z_current))
-    output_file.write('G0 X {:5.4f}\n'.format(x_start))
-    # Plunge into material
-    if inputs['use_probe_file']:
-        if probe_dim == 1:
-            # Interpolate dZ based on A only
-            dz_current = probe_f(0)[0]
-        elif probe_dim == 2:
-            # Interpolate dZ based on X and A
-            dz_current = probe_f(x_start, 0)[0,0]
-        z_local = z_current + dz_current
+    filename = 'cut_recess_'
+    filename += str(job_inputs['outer_diameter']) + '_od_'
+    filename += str(job_cutter_inputs['mill_diameter']) + '_bit_'
+    filename += 'leave_' + str(job_cutter_inputs['material_to_leave'])
+    if job_inputs['use_probe_file']: filename += '_autolevel'
+    filename += '.nc'
+
+    return filename
+
+
+def recess_path(inputs, cutter_inputs, isogrid_inputs):
+    # The feed moves of one pass after the plunge, the same at every depth.
+    # Returns a list of moves (x, A, dA, feedrate_inverse_t, length,
+    # radial_engagement) and the index of the first move of the final cut.
+    # x and A are the end of the move (A is the angle used for the probe
+    # lookup, 0-360) and dA is the change in the absolute A, 0 for X moves.
+    # length (in) and radial_engagement (width of cut) are used for feed
+    # scheduling.
+    outer_radius = inputs['outer_diameter']/2.0
+    mill_diameter = cutter_inputs['mill_diameter']
+
+    # Angular Data
+    angular_increment = inputs['angular_increment']
+    direction = inputs['direction']
+    if direction == 1:
+        A_values = range(angular_increment, angular_increment + 360, angular_increment)
     else:
-        z_local = z_current
-    output_file.write('G1 Z {:5.4f} F {:3.2f} (plunge cut)\n'.format(z_local, cutter_inputs['feedrate_plunge']))
-    total_time += (safe_z_height - z_local)/cutter_inputs['feedrate_plunge']
-    
+        A_values = range(360-angular_increment, -angular_increment, -angular_increment)
+    A_values_fc = range(360-angular_increment, -angular_increment, -angular_increment)
+    angular_increment_distance = math.pi/180.0*angular_increment*outer_radius
+
+    # X-axis Data
+    dx_stepover = mill_diameter*cutter_inputs['overlap']
+    x_start, x_end = recess_extents(inputs, cutter_inputs, isogrid_inputs)
+
     # First Cut
     # Need to make first cut moving in the Negative A axis to leave a good edge
     # on the flange. Start at A=360 to keep interpolation values positive
     # Cut at fraction of full speed since it's cutting the full width of the bit
-    current_feedrate_linear = cutter_inputs['feedrate_linear']*0.75
-    current_feedrate_inverse_t = current_feedrate_linear/angular_increment_distance
-    output_file.write('(first cut)\n')
-    output_file.write('G93 (switch to inverse time)\n')
-    x_current = x_start
-    for A in A_values_fc:
-        if inputs['use_probe_file']:
-            if probe_dim == 1:
-                # Interpolate dZ based on A only
-                dz_current = probe_f(A)[0]
-            elif probe_dim == 2:
-                # Interpolate dZ based on X and A
-                dz_current = probe_f(x_current, A)[0,0]
-            z_local = z_current + dz_current
-        else:
-            z_local = z_current
-        A_absolute -= angular_increment
-        output_file.write('G1 Z {:5.4f} A {:6.2f} F {:5.4f} ({:6.2f})\n'.format(z_local, A_absolute, current_feedrate_inverse_t, A))
-        total_time += 1.0/current_feedrate_inverse_t
-    x_current += dx_stepover
+    current_feedrate_inverse_t = cutter_inputs['feedrate_linear']*0.75/angular_increment_distance
+    moves = [(x_start, A, -angular_increment, current_feedrate_inverse_t, angular_increment_distance, mill_diameter)
+             for A in A_values_fc]
+    A_last = A_values_fc[-1]
 
     # Keep Cutting
-    current_feedrate_linear = cutter_inputs['feedrate_linear']
-    current_feedrate_inverse_t = current_feedrate_linear/angular_increment_distance
-    while x_current < x_end:
+    # Stepovers move into the wall, so they cut the full width of the bit
+    stepover_feedrate_inverse_t = cutter_inputs['feedrate_linear']*0.75/dx_stepover
+    circle_feedrate_inverse_t = cutter_inputs['feedrate_linear']/angular_increment_distance
+    if inputs['helical'] and x_end > x_start:
+        # One helix from x_start to x_end, the pitch is rounded down so X
+        # never advances more than the stepover per revolution. Feeds are
+        # from the helical length. When autoleveling Z changes along the
+        # helix, so it's split on the probe angle grid (every
+        # angular_increment, the last segment of a turn is shorter when it
+        # doesn't divide 360). Otherwise it's one move per revolution.
+        num_turns = max(1, int(math.ceil((x_end - x_start)/dx_stepover - 1.0e-9)))
+        pitch = (x_end - x_start)/num_turns
         if inputs['use_probe_file']:
-            if probe_dim == 1:
-                # Interpolate dZ based on A only
-                dz_current = probe_f(0)[0]
-            elif probe_dim == 2:
-                # Interpolate dZ based on X and A
-                dz_current = probe_f(x_current, 0)[0,0]
-            z_local = z_current + dz_current
+            turn_angles = list(range(angular_increment, 360, angular_increment)) + [360]
         else:
-            z_local = z_current
-        
+            turn_angles = [360]
+        segment_dA = [angle - previous for previous, angle in zip([0] + turn_angles[:-1], turn_angles)]
+        for turn in range(num_turns):
+            for angle, dA in zip(turn_angles, segment_dA):
+                if turn == num_turns - 1 and angle == 360:
+                    x_current = x_end
+                else:
+                    x_current = x_start + (x_end - x_start)*(turn + angle/360.0)/num_turns
+                segment_length = math.hypot(math.pi/180.0*dA*outer_radius, pitch*dA/360.0)
+                moves.append((x_current, angle if direction == 1 else 360 - angle, dA*direction,
+                              cutter_inputs['feedrate_linear']/segment_length, segment_length, pitch))
+
+        # Final Pass, a circle at x_end to clean up the end of the helix
+        final_index = len(moves)
+        moves += [(x_end, A, angular_increment*direction, circle_feedrate_inverse_t, angular_increment_distance, pitch)
+                  for A in A_values]
+
+        return moves, final_index
+
+    x_last = x_start
+    x_current = x_start + dx_stepover
+    while x_current < x_end:
         # Move in X direction
-        current_feedrate_linear = cutter_inputs['feedrate_linear']*0.75
-        current_feedrate_inverse_t = current_feedrate_linear/dx_stepover
-        
-        output_file.write('G1 X {:5.4f} Z {:5.4f} F {:5.4f}\n'.format(x_current, z_local, current_feedrate_inverse_t))
-        total_time += 1.0/current_feedrate_inverse_t
-        
-        current_feedrate_linear = cutter_inputs['feedrate_linear']
-        current_feedrate_inverse_t = current_feedrate_linear/angular_increment_distance
-        for A in A_values:
-            if inputs['use_probe_file']:
-                if probe_dim == 1:
-                    # Interpolate dZ based on A only
-                    dz_current = probe_f(A)[0]
-                elif probe_dim == 2:
-                    # Interpolate dZ based on X and A
-                    dz_current = probe_f(x_current, A)[0,0]
-                z_local = z_current + dz_current
-            else:
-                z_local = z_current
-            A_absolute += angular_increment*direction
-            output_file.write('G1 Z {:5.4f} A {:6.2f} F {:5.4f} ({:6.2f})\n'.format(z_local, A_absolute, current_feedrate_inverse_t, A))
-            total_time += 1.0/current_feedrate_inverse_t
-        
+        moves.append((x_current, 0, 0, stepover_feedrate_inverse_t, dx_stepover, mill_diameter))
+        moves += [(x_current, A, angular_increment*direction, circle_feedrate_inverse_t, angular_increment_distance, dx_stepover)
+                  for A in A_values]
+        A_last = A_values[-1]
         # Increment X
+        x_last = x_current
         x_current += dx_stepover
 
     # Final Pass
-    output_file.write('(final cut)\n')
-    x_current = x_end
-    # Interpolate Z based on X and A (0-360)
-    if inputs['use_probe_file']:
-        if probe_dim == 1:
-            # Interpolate dZ based on A only
-            dz_current = probe_f(A)[0]
-        elif probe_dim == 2:
-            # Interpolate dZ based on X and A
-            dz_current = probe_f(x_current, A)[0,0]
-        z_local = z_current + dz_current
-    else:
-        z_local = z_current
-        
-    # Move in X direction
-    current_feedrate_linear = cutter_inputs['feedrate_linear']*0.75
-    current_feedrate_inverse_t = current_feedrate_linear/dx_stepover
-    output_file.write('G1 X {:5.4f} Z {:5.4f} F {:5.4f}\n'.format(x_current, z_local, current_feedrate_inverse_t))
-    total_time += 1.0/current_feedrate_inverse_t
-
-    current_feedrate_linear = cutter_inputs['feedrate_linear']
-    current_feedrate_inverse_t = current_feedrate_linear/angular_increment_distance
-    for A in A_values:
-        if inputs['use_probe_file']:
-            if probe_dim == 1:
-                # Interpolate dZ based on A only
-                dz_current = probe_f(A)[0]
-            elif probe_dim == 2:
-                # Interpolate dZ based on X and A
-                dz_current = probe_f(x_current, A)[0,0]
-            z_local = z_current + dz_current
+    final_index = len(moves)
+    moves.append((x_end, A_last, 0, stepover_feedrate_inverse_t, x_end - x_last, mill_diameter))
+    moves += [(x_end, A, angular_increment*direction, circle_feedrate_inverse_t, angular_increment_distance, x_end - x_last)
+              for A in A_values]
+
+    return moves, final_index
+
+
+def cut_recess(inputs, cutter_inputs, isogrid_inputs, probe_f=None, probe_dim=None, stats=None):
+    # Yields the G-code lines for the recess. The inputs come from
+    # check_inputs. probe_f and probe_dim are the delta Z surface from
+    # probe.load_probe_surface, used when inputs['use_probe_file'] is set.
+    # If given, stats is filled in with the machining time (mins), with
+    # helical the time saved against circles (mins), with skip_air_cuts the
+    # time saved by not cutting air (mins) and with feed scheduling the
+    # lowest and highest feed rates used (IPM).
+    use_probe = inputs['use_probe_file'] and probe_f is not None
+    skip_air = use_probe and inputs['skip_air_cuts']
+    schedule = rotary_axis_cam.check_feed_schedule(cutter_inputs)
+
+    outer_radius = inputs['outer_diameter']/2.0
+    z_ref = outer_radius
+    A_start = 360
+
+    # X-axis Data
+    x_start, x_end = recess_extents(inputs, cutter_inputs, isogrid_inputs)
+    path, final_index = recess_path(inputs, cutter_inputs, isogrid_inputs)
+
+    # Z-axis Data
+    safe_z_height = outer_radius + cutter_inputs['safe_clearance']
+    dz_recess = inputs['recess_depth'] - cutter_inputs['material_to_leave']
+    z_final = z_ref - dz_recess
+
+    # Time (min)
+    total_time = 0.0
+    air_time_saved = 0.0
+
+    # Write Header
+    yield '(G-code automatically written using cut_recess_cylinder.py)\n'
+    yield 'G90   (set absolute distance mode)\n'
+    yield 'G90.1 (set absolute distance mode for arc centers)\n'
+    yield 'G17   (set active plane to XY)\n'
+    yield 'G20   (set units to inches)\n'
+    yield 'G94   (standard feed rates)\n'
+    yield '\n'
+    yield '(Script Inputs)\n'
+    yield '(Recess Start: {:6.4f})\n'.format(inputs['x_start'])
+    yield '(Recess End: {:6.4f})\n'.format(inputs['x_end'])
+    yield '(Recess Depth: {:6.4f})\n'.format(inputs['recess_depth'])
+    yield '(Feedrate Plunge: {:3.2f})\n'.format(cutter_inputs['feedrate_plunge'])
+    yield '(Feedrate Linear: {:3.2f})\n'.format(cutter_inputs['feedrate_linear'])
+    yield '(Depth per Pass: {:5.4f})\n'.format(cutter_inputs['depth_per_pass'])
+    yield '(Material to Leave: {:5.4f})\n'.format(cutter_inputs['material_to_leave'])
+    if inputs['helical']:
+        yield '(Helical: one stepover per revolution)\n'
+    yield '\n'
+
+    # Position at Start
+    # Start at A=360 for first cut
+    yield 'G0 Z {:5.4f} (Safe Z height)\n'.format(safe_z_height)
+    yield 'G0 Y 0.0000 A {:5.4f}\n'.format(A_start)
+
+    # Every pass ends at x_end and the next starts at x_start, both at A=0
+    # (a multiple of 360). With local_retract, the retract between passes
+    # only clears the highest probed surface along that rapid.
+    depths = pass_depths(z_ref, z_final, cutter_inputs['depth_per_pass'])
+    retract_height = safe_z_height
+    if use_probe and cutter_inputs['local_retract']:
+        import probe
+        dz_max = probe.max_along_moves(probe_f, probe_dim, [x_end], [0.0], [x_start], [0.0],
+                                       tool_radius=cutter_inputs['mill_diameter']/2.0)[0]
+        retract_height = z_ref + dz_max + cutter_inputs['safe_clearance']
+
+    # With skip_air_cuts the passes are at the nominal depth and the probe
+    # only says where the stock is. The top of the stock under the tool is
+    # found for every move of the path at once, moves above it are rapids
+    # and passes that are above it everywhere are left out.
+    active = [True]*len(depths)
+    if skip_air:
+        import probe
+        tool_radius = cutter_inputs['mill_diameter']/2.0
+        X0 = [x_start]
+        A0 = [A_start]
+        for x, A, dA, feedrate_inverse_t, length, radial_engagement in path:
+            X0.append(x)
+            A0.append(A0[-1] + dA)
+        stock = z_ref + probe.max_along_moves(probe_f, probe_dim, X0[:-1], A0[:-1], X0[1:], A0[1:],
+                                              tool_radius=tool_radius) + air_cut_margin
+        stock_plunge = z_ref + probe.max_along_moves(probe_f, probe_dim, [x_start], [0.0], [x_start], [0.0],
+                                                     tool_radius=tool_radius)[0] + air_cut_margin
+        rapid_times = [abs(x - x0)/cutter_inputs['rapid_linear'] + abs(dA)/cutter_inputs['rapid_angular']
+                       for (x, A, dA, feedrate_inverse_t, length, radial_engagement), x0 in zip(path, X0)]
+        path_time = sum(1.0/move[3] for move in path)
+        active = [z_current < stock_plunge or bool((z_current < stock).any()) for z_current in depths]
+        if not any(active):
+            # Nothing to cut, still write an (empty) program
+            active[0] = True
+        for pass_num, z_current in enumerate(depths):
+            if not active[pass_num]:
+                air_time_saved += (safe_z_height - z_current)/cutter_inputs['feedrate_plunge'] + path_time
+    last_pass = max(pass_num for pass_num in range(len(depths)) if active[pass_num])
+
+    # Time saved by the helix against cutting the same passes as circles, at
+    # the nominal feeds (negative when the helix is slower)
+    helical_time_saved = 0.0
+    if inputs['helical']:
+        circle_path, circle_final_index = recess_path(dict(inputs, helical=False), cutter_inputs, isogrid_inputs)
+        helical_time_saved = (sum(1.0/move[3] for move in circle_path) - sum(1.0/move[3] for move in path))*sum(active)
+
+    # Otherwise the passes follow the probed surface. The offsets along the
+    # path are the same for every pass, so they are found once.
+    if use_probe and not skip_air:
+        import probe
+        surface = probe.ProbeSurface(probe_f, probe_dim)
+        dz_plunge = surface(x_start, 0)
+        dz_path = surface.evaluate([move[0] for move in path], [move[1] for move in path]).tolist()
+
+    # With feed scheduling, the depth of cut is from the previous pass (or the
+    # top of the stock found for skip_air_cuts, which can be above z_ref)
+    feedrates_used = []
+    A_absolute = A_start
+    z_start = safe_z_height
+    for pass_num, z_current in enumerate(depths):
+        if pass_num > 0:
+            z_previous = depths[pass_num - 1]
+        elif skip_air:
+            z_previous = float('inf')
+        else:
+            z_previous = z_ref
+        if not active[pass_num]:
+            continue
+        yield '({:5.4f} cut)\n'.format(z_current)
+        yield 'G0 X {:5.4f}\n'.format(x_start)
+        # Plunge into material
+        if use_probe and not skip_air:
+            z_local = z_current + dz_plunge
         else:
             z_local = z_current
-        A_absolute += angular_increment*direction
-        output_file.write('G1 Z {:5.4f} A {:6.2f} F {:5.4f} ({:6.2f})\n'.format(z_local, A_absolute, current_feedrate_inverse_t, A))
-        total_time += 1.0/current_feedrate_inverse_t
-        
-    output_file.write('G94 (switch back to normal feed rate)\n')
-    # Raise to safe Z height
-    output_file.write('G0 Z {:5.4f} (Safe Z height)\n'.format(safe_z_height))
-    if z_current == z_final:
-        done = True
+        if skip_air and z_current >= stock_plunge:
+            yield 'G0 Z {:5.4f} (above stock)\n'.format(z_local)
+            air_time_saved += (z_start - z_local)/cutter_inputs['feedrate_plunge']
+        else:
+            yield 'G1 Z {:5.4f} F {:3.2f} (plunge cut)\n'.format(z_local, cutter_inputs['feedrate_plunge'])
+            total_time += (z_start - z_local)/cutter_inputs['feedrate_plunge']
+
+        yield '(first cut)\n'
+        yield 'G93 (switch to inverse time)\n'
+        rapid_A = None
+        rapid_X = None
+        x_last = x_start
+        for i, (x_current, A, dA, current_feedrate_inverse_t, length, radial_engagement) in enumerate(path):
+            air = skip_air and z_current >= stock[i]
+            helix = dA != 0 and x_current != x_last
+            x_last = x_current
+            if rapid_A is not None and (not air or dA == 0 or i == final_index):
+                A_absolute, rapid_line = rotary_axis_cam.air_rapid_A(rapid_A, A_absolute, rapid_X)
+                yield rapid_line
+                rapid_A = None
+                rapid_X = None
+            if i == final_index:
+                yield '(final cut)\n'
+            if air:
+                # Above the stock, rapid instead (A moves are combined)
+                air_time_saved += 1.0/current_feedrate_inverse_t - rapid_times[i]
+                total_time += rapid_times[i]
+                if dA == 0:
+                    yield 'G0 X {:5.4f}\n'.format(x_current)
+                else:
+                    if rapid_A is None:
+                        rapid_A = A_absolute
+                    A_absolute += dA
+                    if helix:
+                        rapid_X = x_current
+                continue
+
+            if use_probe and not skip_air:
+                z_local = z_current + dz_path[i]
+            else:
+                z_local = z_current
+            if schedule and length > 0.0:
+                z_stock = min(stock[i], z_previous) if skip_air else z_previous
+                feedrate = rotary_axis_cam.engagement_feedrate(cutter_inputs, z_stock - z_current, radial_engagement,
+                                                               cutter_inputs['mill_diameter'])
+                feedrates_used.append(feedrate)
+                current_feedrate_inverse_t = feedrate/length
+            if dA == 0:
+                # Move in X direction
+                yield 'G1 X {:5.4f} Z {:5.4f} F {:5.4f}\n'.format(x_current, z_local, current_feedrate_inverse_t)
+            elif helix:
+                # Move in X and A direction
+                A_absolute += dA
+                yield 'G1 X {:5.4f} Z {:5.4f} A {:6.2f} F {:5.4f} ({:6.2f})\n'.format(x_current, z_local, A_absolute, current_feedrate_inverse_t, A)
+            else:
+                A_absolute += dA
+                yield 'G1 Z {:5.4f} A {:6.2f} F {:5.4f} ({:6.2f})\n'.format(z_local, A_absolute, current_feedrate_inverse_t, A)
+            total_time += 1.0/current_feedrate_inverse_t
+        if rapid_A is not None:
+            A_absolute, rapid_line = rotary_axis_cam.air_rapid_A(rapid_A, A_absolute, rapid_X)
+            yield rapid_line
+
+        yield 'G94 (switch back to normal feed rate)\n'
+        # Raise to safe Z height
+        if retract_height != safe_z_height and pass_num < last_pass:
+            z_start = retract_height
+            yield 'G0 Z {:5.4f} (local retract)\n'.format(z_start)
+        else:
+            yield 'G0 Z {:5.4f} (Safe Z height)\n'.format(safe_z_height)
+
+    yield 'M5 M2\n'
+    yield '(Machine Time Required: {:4.0f} mins)'.format(total_time)
+
+    if stats is not None:
+        stats['total_time'] = total_time
+        if inputs['helical']:
+            stats['helical_time_saved'] = helical_time_saved
+        if skip_air:
+            stats['air_time_saved'] = air_time_saved
+        if feedrates_used:
+            stats['feedrate_min'] = min(feedrates_used)
+            stats['feedrate_max'] = max(feedrates_used)
+
+
+def main(argv):
+    metrics = rotary_axis_cam.metrics_from_argv('cut_recess_cylinder', argv)
+    metrics.stage('read_inputs')
+
+    job = {'inputs': inputs, 'cutter_inputs': cutter_inputs, 'isogrid_inputs': isogrid_inputs}
+    if os.path.isfile(script_inputs_file):
+        print('Input file exists, loading inputs file')
+        job = rotary_axis_cam.read_inputs_file(script_inputs_file, job)
+
+    try:
+        job_inputs, job_cutter_inputs, job_isogrid_inputs = check_inputs(
+            job['inputs'], job['cutter_inputs'], job['isogrid_inputs'])
+    except ValueError as error:
+        print(str(error) + '\nExiting!')
+        sys.exit(1)
+
+    outer_radius = job_inputs['outer_diameter']/2.0
+    z_ref = outer_radius
+    if job_inputs['isogrid'] is True:
+        print('Using isogrid parameters to size recess')
+        print('Triangle Height: {:4.3f}'.format((3.0**0.5)/2.0 * job_isogrid_inputs['pattern_size']))
+        print('Number of Rows: {:2d}'.format(job_isogrid_inputs['num_rows']))
     else:
-        z_current -= cutter_inputs['depth_per_pass']
-        z_current = max(z_current,z_final)
+        print('Using specified x_start and x_end values for recess')
+    x_start, x_end = recess_extents(job_inputs, job_cutter_inputs, job_isogrid_inputs)
+    dz_recess = job_inputs['recess_depth'] - job_cutter_inputs['material_to_leave']
+    z_final = z_ref - dz_recess
+    depths = pass_depths(z_ref, z_final, job_cutter_inputs['depth_per_pass'])
+
+    print('\nDimensions')
+    print('Outer Radius: {:5.4f}'.format(outer_radius))
+    print('Recess X start: {:5.4f}'.format(x_start))
+    print('Recess X end: {:5.4f}'.format(x_end))
+    print('dZ recess nominal: {:5.4f}'.format(dz_recess))
+    print('Z recess nominal: {:5.4f}'.format(z_final))
+    print('Number of Passes: {:3d}'.format(len(depths)))
+
+    # Read Probe Data if needed
+    probe_f = None
+    probe_dim = None
+    if job_inputs['use_probe_file']:
+        metrics.stage('read_probe')
+        # Load module for interpolation, only needed when autoleveling
+        import probe
+        print('\nReading Probe Data')
+        probe_f, probe_dim = probe.load_probe_surface('probe_results.txt', z_ref, metrics)
+        probe_f = metrics.timed('surface_eval', probe_f)
+
+    # Open Output File
+    metrics.stage('generate')
+    filename = output_filename(job_inputs, job_cutter_inputs)
+    print('\nWriting Gcode to:', filename)
+    for z_current in depths:
+        print('    Writing G-code for {:5.4f} depth'.format(z_current))
+    output_file = rotary_axis_cam.open_file(filename,'w')
+    stats = {}
+    output_file.writelines(cut_recess(job_inputs, job_cutter_inputs, job_isogrid_inputs, probe_f, probe_dim, stats))
+
+    print('Machining Time Required: {:4.0f} mins'.format(stats['total_time']))
+    print('                         {:3.2f} hrs'.format(stats['total_time']/60.0))
+    if 'helical_time_saved' in stats:
+        print('Helical Time Saved: {:4.1f} mins (against circles)'.format(stats['helical_time_saved']))
+    if 'air_time_saved' in stats:
+        print('Air Cut Time Saved: {:4.0f} mins'.format(stats['air_time_saved']))
+    if 'feedrate_min' in stats:
+        print('Scheduled Feed Rates: {:3.2f} to {:3.2f} IPM'.format(stats['feedrate_min'], stats['feedrate_max']))
 
+    # Close File
+    metrics.stage('close_files')
+    output_file.close()
+    metrics.count('bytes_written', os.path.getsize(filename))
 
-print('Machining Time Required: {:4.0f} mins'.format(total_time))
-print('                         {:3.2f} hrs'.format(total_time/60.0))
+    metrics.finish()
 
-output_file.write('M5 M2\n')
-output_file.write('(Machine Time Required: {:4.0f} mins)'.format(total_time))
 
-# Close File
-output_file.close()
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -3,12 +3,11 @@ import sys
 import os
 import math
 import numpy as np
-import probe
 
 import rotary_axis_cam
 
 # Create G-code to cut a groove in cylinder in a manner that accepts pre-probe
-# results. 
+# results.
 # Inverse Time mode (G93) is used to specify feed rates
 
 
@@ -16,8 +15,23 @@ import rotary_axis_cam
 #   1) The center of the cylinder is along the Y=0, Z=0 axis
 #   2) Ignores X-axis, unless it's specified.
 
+# Several rows of holes can be drilled in one program by giving rows, a list
+# of (x_loc, angular_increment, angular_offset). The holes of all the rows
+# are then put in the order that minimizes the rapid time between them
+# (nearest neighbor, improved with 2-opt). A is taken the short way around,
+# so the A values written keep increasing or decreasing past 360.
+
+# Can also be used as a module:
+#   import drill_holes_cylinder
+#   job_inputs, job_cutter_inputs = drill_holes_cylinder.check_inputs({'angular_increment': 45}, {})
+#   for line in drill_holes_cylinder.drill_holes(job_inputs, job_cutter_inputs):
+#       ...
+
+# Height above the probed (or nominal) surface that helical ramps start at
+helical_clearance = 0.02
+
 script_inputs_file = './drill_holes_cylinder.inputs'
-inputs = { 
+inputs = {
     'outer_diameter' : 12.0,
     'hole_diameter' : 0.406,
     'drill_depth' : 0.75,
@@ -26,6 +40,7 @@ inputs = {
     'angular_offset': 0,
     'direction': 1,
     'peck_drill': False,
+    'rows': None, # [(x_loc, angular_increment, angular_offset), ...]
     'use_Z_probe_file': False,
     'use_X_probe_file': False,
     'output_file': None
@@ -36,236 +51,425 @@ cutter_inputs = {
     'feedrate_plunge' : 0.5, # IPM
     'feedrate_linear': 1.0, # IPM
     'peck_amount': 0.0,
+    'rapid_linear': 100.0, # IPM, only used to order rows of holes
+    'rapid_angular': 3600.0, # deg/min
+    'local_retract': False, # retract to the probed surface + safe_clearance between holes
+    'helical_pitch': None, # Z per turn to ramp into holes that are widened, None to plunge
 }
 
-if os.path.isfile(script_inputs_file):
-    print('Input file exists, loading inputs file')
-    exec(open(script_inputs_file).read())
-else:
-    # Write inputs file
-    try:
-        outputfile = open(script_inputs_file, 'w')
-    except IOError:
-        print('Cannot open', script_inputs_file, '\nExiting!')
-    print('Writing input values to:', script_inputs_file)
-    outputfile.write('inputs = {\n')
-    rotary_axis_cam.write_dict(outputfile, inputs)
-    outputfile.write('cutter_inputs = {\n')
-    rotary_axis_cam.write_dict(outputfile, cutter_inputs)
-    outputfile.close()
-    print('Update drill_holes_cylinder.inputs and re-run')
-    sys.exit()
-
-# Check mill diameter
-if cutter_inputs['mill_diameter'] > inputs['hole_diameter']:
-    print('Error! Mill diameter is larger than hole diameter')
-    sys.exit(1)
-
-if inputs['use_Z_probe_file']:
-    # Load module for interpolation
-    from scipy import interpolate
-
-outer_radius = inputs['outer_diameter']/2.0
-z_ref = outer_radius
-
-# Angular Data
-angular_increment = inputs['angular_increment']
-direction = inputs['direction']
-
-if direction == 1:
-    # Go from Start from Zero and go towards 360
-    A_values = np.arange(0, 360, angular_increment)
-elif direction == -1:
-    # Go from Start from 360 and go towards 0
-    A_values = np.arange(360, -angular_increment, -angular_increment)
-else:
-    print('Invalid value for direction\nExiting')
-    sys.exit(1)
-
-# Apply offset
-A_values += inputs['angular_offset']
-
-angular_increment_distance = math.pi/180.0*angular_increment*outer_radius
-a_current = 0
-
-# X-axis Data
-if inputs['x_loc'] is not None:
-    x_holes = inputs['x_loc']
-
-# Z-axis Data
-safe_z_height = outer_radius + cutter_inputs['safe_clearance']
-drill_depth = inputs['drill_depth']
-depth_diams = inputs['drill_depth']/cutter_inputs['mill_diameter']
-
-z_final = outer_radius - drill_depth
-
-# Time (min)
-total_time = 0.0
-
-print('\nDrill Holes')
-if inputs['x_loc'] is not None:
-    print('X location: {:5.4f}'.format(inputs['x_loc']))
-print('Drill Depth: {:5.4f}, Diameters: {:3.2f}'.format(inputs['drill_depth'],depth_diams)) 
-print('Angular Increment: {:3d} deg'.format(inputs['angular_increment']))
-print('Angular Offset: {:3d} deg'.format(inputs['angular_offset']))
-print('Angles:', A_values)
-widen_holes = False
-if cutter_inputs['mill_diameter'] < inputs['hole_diameter']:
-    widen_holes = True
-    print('Holes larger than Mill Diameter')
-    hole_delta_R = (inputs['hole_diameter'] - cutter_inputs['mill_diameter'])/2.0
-    print(hole_delta_R)
-
-# Read Probe Data if needed
-if inputs['use_Z_probe_file']:
-    print('\nReading Z Probe Data')
-    probe_num_X, probe_num_A, probe_X, probe_Z, probe_A = probe.read_cylinder_probe_file('probe_results.txt')
-    probe_X_values = np.unique(probe_X)
-    probe_A_values = np.unique(probe_A)
-    
-    # Check Probe Data dimensions
-    Z_probe_dim = None
-    if probe_X_values.size == 1:
-        print('Probe Data is 2D (A and Z)')
-        Z_probe_dim = 1
-    else:
-        print('Probe Data is 3D (X, A and Z)')
-        Z_probe_dim = 2
-        
-    # Convert Z to delta Z map
-    dZ = probe_Z - z_ref
-
-    dZ_min = np.min(dZ)
-    dZ_max = np.max(dZ)
-    print('  dZ Min: {:5.4f}'.format(dZ_min))
-    print('  dZ Max: {:5.4f}'.format(dZ_max))
-    
-    Z_probe_f = probe.setup_interpolation(probe_X_values, probe_A_values, dZ, Z_probe_dim)
-
-if inputs['use_X_probe_file']:
-    print('\nReading X Probe Data')
-    probe_num_X, probe_num_A, probe_X, probe_Z, probe_A = probe.read_cylinder_probe_file('probe_results_edge.txt')
-    probe_X_values = np.unique(probe_X)
-    probe_Z_values = np.unique(probe_Z)
-    probe_A_values = np.unique(probe_A)
-    
-    # Check Probe Data dimensions
-    X_probe_dim = None
-    if probe_Z_values.size == 1:
-        print('Probe Data is 2D (A and X)')
-        X_probe_dim = 1
+
+def check_inputs(job_inputs, job_cutter_inputs):
+    # Returns complete copies of the inputs (defaults for anything not
+    # given). Raises ValueError for invalid inputs.
+    checked_inputs = dict(inputs)
+    checked_inputs.update(job_inputs)
+    checked_cutter_inputs = dict(cutter_inputs)
+    checked_cutter_inputs.update(job_cutter_inputs)
+
+    # Check mill diameter
+    if checked_cutter_inputs['mill_diameter'] > checked_inputs['hole_diameter']:
+        raise ValueError('Error! Mill diameter is larger than hole diameter')
+    if checked_inputs['direction'] not in [1, -1]:
+        raise ValueError('Invalid value for direction')
+    if checked_cutter_inputs['helical_pitch'] is not None:
+        if checked_cutter_inputs['helical_pitch'] <= 0.0:
+            raise ValueError('helical_pitch needs to be a positive value.')
+        if checked_inputs['peck_drill']:
+            raise ValueError('peck_drill and helical_pitch can\'t both be used')
+        # The ramp orbits at the hole wall and never cuts the center, a mill
+        # under half the hole diameter would leave a core standing
+        if checked_cutter_inputs['mill_diameter'] < checked_inputs['hole_diameter']/2.0:
+            raise ValueError('helical_pitch needs a mill diameter of at least half the hole diameter')
+    if checked_inputs['rows'] is not None:
+        if len(checked_inputs['rows']) == 0:
+            raise ValueError('rows needs at least one row')
+        for row in checked_inputs['rows']:
+            if len(row) != 3:
+                raise ValueError('Each row needs to be (x_loc, angular_increment, angular_offset)')
+            if row[1] <= 0:
+                raise ValueError('angular_increment needs to be a positive value.')
+
+    return checked_inputs, checked_cutter_inputs
+
+
+def hole_angles(inputs):
+    # A location of each hole, in drilling order
+    angular_increment = inputs['angular_increment']
+    if inputs['direction'] == 1:
+        # Go from Start from Zero and go towards 360
+        A_values = np.arange(0, 360, angular_increment)
     else:
-        print('Bad Probe Dimensions.\nExiting!')
-        sys.exit(1)
+        # Go from Start from 360 and go towards 0
+        A_values = np.arange(360, -angular_increment, -angular_increment)
+
+    # Apply offset
+    A_values += inputs['angular_offset']
+
+    return A_values
+
 
-    dX_min = np.min(probe_X_values)
-    dX_max = np.max(probe_X_values)
-    print('  dX Min: {:5.4f}'.format(dX_min))
-    print('  dX Max: {:5.4f}'.format(dX_max))
-    
-    X_probe_f = probe.setup_interpolation(probe_Z_values, probe_A_values, probe_X, X_probe_dim)
+def hole_locations(inputs):
+    # X and A of every hole, in the naive order (row by row, in A order).
+    # Without rows this is the single row at x_loc, as hole_angles.
+    if inputs['rows'] is None:
+        A_values = hole_angles(inputs)
+        x_loc = np.nan if inputs['x_loc'] is None else inputs['x_loc']
+        return np.full(A_values.size, x_loc, dtype=float), A_values
+
+    X_rows = []
+    A_rows = []
+    for x_loc, angular_increment, angular_offset in inputs['rows']:
+        A_values = np.mod(np.arange(0, 360, angular_increment) + angular_offset, 360)
+        X_rows.append(np.full(A_values.size, x_loc, dtype=float))
+        A_rows.append(np.sort(A_values))
+
+    return np.concatenate(X_rows), np.concatenate(A_rows)
+
+
+def rapid_times(X0, A0, X1, A1, cutter_inputs, wrap=True):
+    # Rapid time (min) between points. X and A move together, so the slower
+    # axis sets the time. With wrap, A goes the short way around.
+    dA = A1 - A0
+    if wrap:
+        dA = np.mod(dA + 180.0, 360.0) - 180.0
+    return np.maximum(np.abs(X1 - X0)/cutter_inputs['rapid_linear'],
+                      np.abs(dA)/cutter_inputs['rapid_angular'])
+
+
+def order_holes(X_values, A_values, x_start, a_start, cutter_inputs):
+    # Returns the drilling order (indices into X_values and A_values) from
+    # the start location. Nearest neighbor gives the first order, then 2-opt
+    # reverses any part of it that makes the total rapid time shorter.
+    num_holes = X_values.size
+    # Node 0 is the start, 1..num_holes the holes and the last node is a free
+    # end (zero time to anything), so the path doesn't need to return
+    X = np.concatenate([[x_start], X_values])
+    A = np.concatenate([[a_start], A_values])
+    times = np.zeros((num_holes + 2, num_holes + 2))
+    times[:-1,:-1] = rapid_times(X[:,None], A[:,None], X[None,:], A[None,:], cutter_inputs)
+
+    # Nearest neighbor
+    path = [0]
+    visited = np.zeros(num_holes + 1, dtype=bool)
+    visited[0] = True
+    for i in range(num_holes):
+        time_to = np.where(visited, np.inf, times[path[-1],:-1])
+        path.append(int(np.argmin(time_to)))
+        visited[path[-1]] = True
+    path = np.array(path + [num_holes + 1])
+
+    # 2-opt, the start and the free end stay in place. Reversing
+    # path[i:j+1] replaces the moves into path[i] and out of path[j].
+    improved = True
+    while improved:
+        improved = False
+        for i in range(1, num_holes):
+            j = np.arange(i + 1, num_holes + 1)
+            before = path[i-1]
+            change = (times[before,path[j]] + times[path[i],path[j+1]]
+                      - times[before,path[i]] - times[path[j],path[j+1]])
+            best = int(np.argmin(change))
+            if change[best] < -1.0e-12:
+                path[i:j[best]+1] = path[i:j[best]+1][::-1].copy()
+                improved = True
+
+    return path[1:-1] - 1
+
+
+def output_filename(job_inputs):
+    if job_inputs['output_file'] is not None:
+        return job_inputs['output_file']
 
-# Open Output File
-if inputs['output_file'] is None:
     # Autocreate filename
-    output_filename = 'drill_holes_'
-    output_filename += str(inputs['outer_diameter']) + '_od_'
-    if inputs['x_loc'] is not None:
-        output_filename += str(inputs['x_loc']) + '_x_'
-    output_filename += str(inputs['drill_depth']) + '_depth'
-    if inputs['use_Z_probe_file']: output_filename += '_autolevel'
-    output_filename += '.nc'
-    
- 
-else:
-    output_filename = inputs['output_file']
-print('\nWriting Gcode to:', output_filename)
-output_file = open(output_filename,'w')
-
-# Write Header
-output_file.write('(G-code automatically written using cut_recess_cylinder.py)\n')
-output_file.write('G90   (set absolute distance mode)\n')
-output_file.write('G90.1 (set absolute distance mode for arc centers)\n')
-output_file.write('G17   (set active plane to XY)\n')
-output_file.write('G20   (set units to inches)\n')
-output_file.write('G94   (standard feed rates)\n')
-output_file.write('\n')
-output_file.write('(Script Inputs)\n')
-output_file.write('(X: {:6.4f})\n'.format(inputs['x_loc']))
-output_file.write('(Hole Size: {:6.4f})\n'.format(inputs['hole_diameter']))
-output_file.write('(Angular Increment: {:6.4f})\n'.format(inputs['angular_increment']))
-output_file.write('(Angular Offset: {:6.4f})\n'.format(inputs['angular_offset']))
-output_file.write('(Angles: ' + str(A_values) + ' )\n')
-output_file.write('(Mill Diameter: {:5.4f})\n'.format(cutter_inputs['mill_diameter']))
-output_file.write('(Feedrate Plunge: {:3.2f})\n'.format(cutter_inputs['feedrate_plunge']))
-output_file.write('(Feedrate Linear: {:3.2f})\n'.format(cutter_inputs['feedrate_linear']))
-output_file.write('\n')
-
-# Position at Start
-output_file.write('G0 Z {:5.4f} (Safe Z height)\n'.format(safe_z_height))
-if inputs['x_loc'] is not None:
-    output_file.write('G0 X {:5.4f} Y 0.0000\n'.format(x_holes))
-else:
-    print('Warning, omitting X value in start location')
-    output_file.write('G0 Y 0.0000 \n')
-
-hole_num = 1
-for A in A_values:
-    # Go to next A
-    output_file.write('G0 A {:6.2f}\n'.format(A))
-    # Determine probe offsets
-    if inputs['use_Z_probe_file']:
-        if Z_probe_dim == 1:
-            # Interpolate dZ based on A only
-            dz_current = Z_probe_f(A)[0]
-        elif Z_probe_dim == 2:
-            # Interpolate dZ based on X and A
-            dz_current = Z_probe_f(x_holes, A)[0,0]
-        z_local = z_final + dz_current
-        z_local_ref = z_ref + dz_current
+    filename = 'drill_holes_'
+    filename += str(job_inputs['outer_diameter']) + '_od_'
+    if job_inputs['rows'] is not None:
+        filename += str(len(job_inputs['rows'])) + '_rows_'
+    elif job_inputs['x_loc'] is not None:
+        filename += str(job_inputs['x_loc']) + '_x_'
+    filename += str(job_inputs['drill_depth']) + '_depth'
+    if job_inputs['use_Z_probe_file']: filename += '_autolevel'
+    filename += '.nc'
+
+    return filename
+
+
+def drill_holes(inputs, cutter_inputs, Z_probe_f=None, Z_probe_dim=None, X_probe_f=None, stats=None):
+    # Yields the G-code lines for the holes. inputs and cutter_inputs come
+    # from check_inputs. Z_probe_f and Z_probe_dim are the delta Z surface
+    # from probe.load_probe_surface, X_probe_f is the edge location from
+    # probe.load_edge_probe_surface. They are used when use_Z_probe_file and
+    # use_X_probe_file are set. If given, stats is filled in with the
+    # machining time (mins), with helical_pitch the ramp and plunge times
+    # (entry_time_helical, entry_time_plunge, mins) and with rows the rapid time between holes in
+    # the naive and optimized orders (mins).
+    use_Z_probe = inputs['use_Z_probe_file'] and Z_probe_f is not None
+    use_X_probe = inputs['use_X_probe_file'] and X_probe_f is not None
+
+    outer_radius = inputs['outer_diameter']/2.0
+    z_ref = outer_radius
+
+    # Hole locations
+    multi_row = inputs['rows'] is not None
+    X_values, A_values = hole_locations(inputs)
+    if multi_row:
+        x_start = inputs['rows'][0][0]
+        order = order_holes(X_values, A_values, x_start, 0.0, cutter_inputs)
+        # Naive is each row as its own program, A absolute
+        rapid_time_naive = np.sum(rapid_times(np.append(x_start, X_values[:-1]), np.append(0.0, A_values[:-1]),
+                                              X_values, A_values, cutter_inputs, wrap=False))
+        rapid_time = np.sum(rapid_times(np.append(x_start, X_values[order][:-1]), np.append(0.0, A_values[order][:-1]),
+                                        X_values[order], A_values[order], cutter_inputs))
+        # A is written continuous, so the short way round is taken
+        A_output = np.cumsum(np.mod(np.diff(np.append(0.0, A_values[order])) + 180.0, 360.0) - 180.0)
     else:
-        z_local = z_final
-        z_local_ref = z_ref
-    if inputs['use_X_probe_file']:
+        x_start = inputs['x_loc']
+        order = np.arange(A_values.size)
+        A_output = A_values
+
+    # Probe offsets of all the holes
+    if use_Z_probe:
+        import probe
+        dz_values = probe.ProbeSurface(Z_probe_f, Z_probe_dim).evaluate(X_values, A_values)
+    else:
+        dz_values = np.zeros(A_values.size)
+    if use_X_probe:
         # Interpolate dX based on A only
-        dx_current = X_probe_f(A)[0]
-        x_local = x_holes + dx_current 
-        output_file.write('G0 X {:5.4f} (dx: {:5.4f})\n'.format(x_local, dx_current))
-    # Plunge into material
-    if inputs['peck_drill'] is True:
-        # Peck drill
-        z_retract = z_local_ref + 0.05
-        output_file.write('G83 Z {:5.4f} Q {:5.4f} R {:5.4f} F {:3.2f} (peck drill, hole {:3d})\n'.format(z_local, cutter_inputs['peck_amount'], z_retract, cutter_inputs['feedrate_plunge'], hole_num))
+        dx_values = X_probe_f(A_values)[0]
+        x_local_values = X_values + dx_values
+    else:
+        x_local_values = X_values
+
+    # Retract height after each hole. With local_retract, just clear the
+    # highest probed surface along the rapid to the next hole.
+    local_retract = use_Z_probe and cutter_inputs['local_retract']
+    retract_heights = np.full(A_values.size, outer_radius + cutter_inputs['safe_clearance'])
+    if local_retract:
+        import probe
+        X_path = x_local_values[order]
+        dz_max = probe.max_along_moves(Z_probe_f, Z_probe_dim, X_path[:-1], A_output[:-1], X_path[1:], A_output[1:],
+                                       tool_radius=cutter_inputs['mill_diameter']/2.0)
+        retract_heights[:-1] = z_ref + dz_max + cutter_inputs['safe_clearance']
+
+    # Z-axis Data
+    safe_z_height = outer_radius + cutter_inputs['safe_clearance']
+    drill_depth = inputs['drill_depth']
+    z_final = outer_radius - drill_depth
+
+    widen_holes = cutter_inputs['mill_diameter'] < inputs['hole_diameter']
+    hole_delta_R = (inputs['hole_diameter'] - cutter_inputs['mill_diameter'])/2.0
+    helical = widen_holes and cutter_inputs['helical_pitch'] is not None
+    helix_length = 2.0*math.pi*(hole_delta_R-0.01)
+    entry_time_plunge = 0.0
+    entry_time_helical = 0.0
+
+    # Time (min)
+    total_time = 0.0
+
+    # Write Header
+    yield '(G-code automatically written using cut_recess_cylinder.py)\n'
+    yield 'G90   (set absolute distance mode)\n'
+    yield 'G90.1 (set absolute distance mode for arc centers)\n'
+    yield 'G17   (set active plane to XY)\n'
+    yield 'G20   (set units to inches)\n'
+    yield 'G94   (standard feed rates)\n'
+    yield '\n'
+    yield '(Script Inputs)\n'
+    if multi_row:
+        for x_loc, angular_increment, angular_offset in inputs['rows']:
+            yield '(Row X: {:6.4f}, Angular Increment: {:6.4f}, Angular Offset: {:6.4f})\n'.format(
+                x_loc, angular_increment, angular_offset)
+        yield '(Holes: {:d})\n'.format(A_values.size)
+    elif x_start is not None:
+        yield '(X: {:6.4f})\n'.format(x_start)
+    yield '(Hole Size: {:6.4f})\n'.format(inputs['hole_diameter'])
+    if not multi_row:
+        yield '(Angular Increment: {:6.4f})\n'.format(inputs['angular_increment'])
+        yield '(Angular Offset: {:6.4f})\n'.format(inputs['angular_offset'])
+        yield '(Angles: ' + str(A_values) + ' )\n'
+    yield '(Mill Diameter: {:5.4f})\n'.format(cutter_inputs['mill_diameter'])
+    yield '(Feedrate Plunge: {:3.2f})\n'.format(cutter_inputs['feedrate_plunge'])
+    yield '(Feedrate Linear: {:3.2f})\n'.format(cutter_inputs['feedrate_linear'])
+    yield '\n'
+
+    # Position at Start
+    yield 'G0 Z {:5.4f} (Safe Z height)\n'.format(safe_z_height)
+    if x_start is not None:
+        yield 'G0 X {:5.4f} Y 0.0000\n'.format(x_start)
     else:
-        # Normal plunge
-        output_file.write('G1 Z {:5.4f} F {:3.2f} (plunge, hole {:3d})\n'.format(z_local, cutter_inputs['feedrate_plunge'], hole_num))
-    hole_num += 1
-    total_time += (safe_z_height - z_local)/cutter_inputs['feedrate_plunge']
-    if widen_holes is True:
-        # Rough
-        # Move to arc starting point in Y axis at Half the Linear Feed Rate
-        output_file.write('G1 Y {:.4f} F {:.2f}\n'.format(hole_delta_R-0.01, 0.5*cutter_inputs['feedrate_linear']))
-        # Circular arc
-        output_file.write('G2 X {:.4f} Y {:.4f} I {:.4f} J {:.4f} F {:.2f}\n'.format(x_holes, hole_delta_R-0.01, x_holes, 0.0, cutter_inputs['feedrate_linear']))
-        # Final
-        # Move to arc starting point in Y axis at Half the Linear Feed Rate
-        output_file.write('G1 Y {:.4f} F {:.2f}\n'.format(hole_delta_R, 0.5*cutter_inputs['feedrate_linear']))
-        # Circular arc
-        output_file.write('G2 X {:.4f} Y {:.4f} I {:.4f} J {:.4f} F {:.2f}\n'.format(x_holes, hole_delta_R, x_holes, 0.0, cutter_inputs['feedrate_linear']))
-        # Return to center
-        output_file.write('G0 Y 0.0000\n')
-    # Raise to safe Z height
-    output_file.write('G0 Z {:5.4f} (Safe Z height)\n'.format(safe_z_height))
-
-print('Machining Time Required: {:4.0f} mins'.format(total_time))
-print('                         {:3.2f} hrs'.format(total_time/60.0))
-
-output_file.write('M5 M2\n')
-output_file.write('(Machine Time Required: {:4.0f} mins)'.format(total_time))
-
-# Close File
-output_file.close()
-
-if depth_diams > 5 and inputs['peck_drill'] is False:
-    print('\n***WARNING***')
-    print('Holes are {:3.2f} diameters deep. Considering using peck drilling instead'.format(depth_diams))
+        yield 'G0 Y 0.0000 \n'
+
+    hole_num = 1
+    z_start = safe_z_height
+    for k, A in zip(order, A_output):
+        x_local = x_local_values[k]
+        z_local = z_final + dz_values[k]
+        z_local_ref = z_ref + dz_values[k]
+        if multi_row:
+            # Go to next hole
+            if use_X_probe:
+                yield 'G0 X {:5.4f} A {:6.2f} (dx: {:5.4f})\n'.format(x_local, A, dx_values[k])
+            else:
+                yield 'G0 X {:5.4f} A {:6.2f}\n'.format(x_local, A)
+        else:
+            # Go to next A
+            yield 'G0 A {:6.2f}\n'.format(A)
+            if use_X_probe:
+                yield 'G0 X {:5.4f} (dx: {:5.4f})\n'.format(x_local, dx_values[k])
+        # Plunge into material
+        entry_time_plunge += (z_start - z_local)/cutter_inputs['feedrate_plunge']
+        if helical:
+            # Ramp down the rough hole wall, starting just above the surface
+            z_top = z_local_ref + helical_clearance
+            num_turns = max(int(math.ceil((z_top - z_local)/cutter_inputs['helical_pitch'] - 1.0e-9)), 1)
+            yield 'G0 Z {:5.4f} (helical ramp, hole {:3d})\n'.format(z_top, hole_num)
+            yield 'G1 Y {:.4f} F {:.2f}\n'.format(hole_delta_R-0.01, 0.5*cutter_inputs['feedrate_linear'])
+            for turn in range(1, num_turns + 1):
+                z_turn = z_top - (z_top - z_local)*turn/num_turns
+                yield 'G2 X {:.4f} Y {:.4f} Z {:.4f} I {:.4f} J {:.4f} F {:.2f}\n'.format(x_local, hole_delta_R-0.01, z_turn, x_local, 0.0, cutter_inputs['feedrate_linear'])
+            entry_time = num_turns*math.hypot(helix_length, (z_top - z_local)/num_turns)/cutter_inputs['feedrate_linear']
+            entry_time_helical += entry_time
+            total_time += entry_time
+        elif inputs['peck_drill'] is True:
+            # Peck drill
+            z_retract = z_local_ref + 0.05
+            yield 'G83 Z {:5.4f} Q {:5.4f} R {:5.4f} F {:3.2f} (peck drill, hole {:3d})\n'.format(z_local, cutter_inputs['peck_amount'], z_retract, cutter_inputs['feedrate_plunge'], hole_num)
+        else:
+            # Normal plunge
+            yield 'G1 Z {:5.4f} F {:3.2f} (plunge, hole {:3d})\n'.format(z_local, cutter_inputs['feedrate_plunge'], hole_num)
+        if not helical:
+            total_time += (z_start - z_local)/cutter_inputs['feedrate_plunge']
+        if widen_holes is True:
+            # Rough
+            if not helical:
+                # Move to arc starting point in Y axis at Half the Linear Feed Rate
+                yield 'G1 Y {:.4f} F {:.2f}\n'.format(hole_delta_R-0.01, 0.5*cutter_inputs['feedrate_linear'])
+            # Circular arc (cleanup at the bottom of the helical ramp)
+            yield 'G2 X {:.4f} Y {:.4f} I {:.4f} J {:.4f} F {:.2f}\n'.format(x_local, hole_delta_R-0.01, x_local, 0.0, cutter_inputs['feedrate_linear'])
+            # Final
+            # Move to arc starting point in Y axis at Half the Linear Feed Rate
+            yield 'G1 Y {:.4f} F {:.2f}\n'.format(hole_delta_R, 0.5*cutter_inputs['feedrate_linear'])
+            # Circular arc
+            yield 'G2 X {:.4f} Y {:.4f} I {:.4f} J {:.4f} F {:.2f}\n'.format(x_local, hole_delta_R, x_local, 0.0, cutter_inputs['feedrate_linear'])
+            # Return to center
+            yield 'G0 Y 0.0000\n'
+        # Raise to safe Z height
+        z_start = retract_heights[hole_num-1]
+        if local_retract and hole_num < A_values.size:
+            yield 'G0 Z {:5.4f} (local retract)\n'.format(z_start)
+        else:
+            yield 'G0 Z {:5.4f} (Safe Z height)\n'.format(safe_z_height)
+        hole_num += 1
+
+    yield 'M5 M2\n'
+    yield '(Machine Time Required: {:4.0f} mins)'.format(total_time)
+
+    if stats is not None:
+        stats['total_time'] = total_time
+        if helical:
+            stats['entry_time_plunge'] = entry_time_plunge
+            stats['entry_time_helical'] = entry_time_helical
+        if multi_row:
+            stats['rapid_time_naive'] = float(rapid_time_naive)
+            stats['rapid_time'] = float(rapid_time)
+
+
+def main(argv):
+    metrics = rotary_axis_cam.metrics_from_argv('drill_holes_cylinder', argv)
+    metrics.stage('read_inputs')
+
+    defaults = {'inputs': inputs, 'cutter_inputs': cutter_inputs}
+    if os.path.isfile(script_inputs_file):
+        print('Input file exists, loading inputs file')
+        job = rotary_axis_cam.read_inputs_file(script_inputs_file, defaults)
+    else:
+        # Write inputs file
+        rotary_axis_cam.write_inputs_file(script_inputs_file, defaults)
+        print('Update drill_holes_cylinder.inputs and re-run')
+        sys.exit()
+
+    try:
+        job_inputs, job_cutter_inputs = check_inputs(job['inputs'], job['cutter_inputs'])
+    except ValueError as error:
+        print(str(error) + '\nExiting!')
+        sys.exit(1)
+
+    outer_radius = job_inputs['outer_diameter']/2.0
+    depth_diams = job_inputs['drill_depth']/job_cutter_inputs['mill_diameter']
+
+    print('\nDrill Holes')
+    if job_inputs['rows'] is not None:
+        for x_loc, angular_increment, angular_offset in job_inputs['rows']:
+            print('Row X: {:5.4f}, Angular Increment: {} deg, Angular Offset: {} deg'.format(
+                x_loc, angular_increment, angular_offset))
+    elif job_inputs['x_loc'] is not None:
+        print('X location: {:5.4f}'.format(job_inputs['x_loc']))
+    print('Drill Depth: {:5.4f}, Diameters: {:3.2f}'.format(job_inputs['drill_depth'],depth_diams))
+    if job_inputs['rows'] is None:
+        print('Angular Increment: {:3d} deg'.format(job_inputs['angular_increment']))
+        print('Angular Offset: {:3d} deg'.format(job_inputs['angular_offset']))
+        print('Angles:', hole_angles(job_inputs))
+    if job_cutter_inputs['mill_diameter'] < job_inputs['hole_diameter']:
+        print('Holes larger than Mill Diameter')
+        print((job_inputs['hole_diameter'] - job_cutter_inputs['mill_diameter'])/2.0)
+
+    # Read Probe Data if needed
+    Z_probe_f = None
+    Z_probe_dim = None
+    X_probe_f = None
+    if job_inputs['use_Z_probe_file'] or job_inputs['use_X_probe_file']:
+        # Load module for interpolation, only needed when autoleveling
+        import probe
+    if job_inputs['use_Z_probe_file']:
+        metrics.stage('read_probe')
+        print('\nReading Z Probe Data')
+        Z_probe_f, Z_probe_dim = probe.load_probe_surface('probe_results.txt', outer_radius, metrics)
+        Z_probe_f = metrics.timed('surface_eval', Z_probe_f)
+    if job_inputs['use_X_probe_file']:
+        metrics.stage('read_probe')
+        print('\nReading X Probe Data')
+        try:
+            X_probe_f = probe.load_edge_probe_surface('probe_results_edge.txt', metrics)
+        except ValueError as error:
+            print(str(error) + '\nExiting!')
+            sys.exit(1)
+        X_probe_f = metrics.timed('surface_eval', X_probe_f)
+
+    # Open Output File
+    metrics.stage('generate')
+    filename = output_filename(job_inputs)
+    print('\nWriting Gcode to:', filename)
+    if job_inputs['x_loc'] is None and job_inputs['rows'] is None:
+        print('Warning, omitting X value in start location')
+    output_file = rotary_axis_cam.open_file(filename,'w')
+    stats = {}
+    output_file.writelines(drill_holes(job_inputs, job_cutter_inputs, Z_probe_f, Z_probe_dim, X_probe_f, stats))
+
+    print('Machining Time Required: {:4.0f} mins'.format(stats['total_time']))
+    print('                         {:3.2f} hrs'.format(stats['total_time']/60.0))
+    if 'entry_time_plunge' in stats:
+        saved = stats['entry_time_plunge'] - stats['entry_time_helical']
+        print('Hole Entry Time (plunge):  {:6.1f} mins'.format(stats['entry_time_plunge']))
+        print('Hole Entry Time (helical): {:6.1f} mins'.format(stats['entry_time_helical']))
+        print('Time Saved:                {:6.1f} mins'.format(saved))
+    if 'rapid_time' in stats:
+        saved = stats['rapid_time_naive'] - stats['rapid_time']
+        print('Rapid Time (row by row): {:6.3f} mins'.format(stats['rapid_time_naive']))
+        print('Rapid Time (optimized):  {:6.3f} mins'.format(stats['rapid_time']))
+        if stats['rapid_time_naive'] > 0.0:
+            print('Rapid Time Saved:        {:6.3f} mins ({:3.1f}%)'.format(saved, 100.0*saved/stats['rapid_time_naive']))
+
+    # Close File
+    metrics.stage('close_files')
+    output_file.close()
+    metrics.count('bytes_written', os.path.getsize(filename))
+
+    if depth_diams > 5 and job_inputs['peck_drill'] is False:
+        print('\n***WARNING***')
+        print('Holes are {:3.2f} diameters deep. Considering using peck drilling instead'.format(depth_diams))
+
+    metrics.finish()
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
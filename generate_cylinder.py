@@ -1,12 +1,57 @@
 #!/usr/bin/env python
+import os
 import sys
 import math
+import getopt
+
+import rotary_axis_cam
 
 # Generates G-code for machinging a cylindrical isogrid on a 4-axis machine
 # Cylinder rotates around the X-axis
 # Machining happens near the Y=0 plane
 # Cells are roughed from the inside out
 
+# The isogrid is laid out flat: X is along the cylinder, Y is the distance
+# around the outer diameter and Z=0 is the outer surface. Each row of the
+# isogrid is pattern_height long in X and holds num_radial_cells triangles
+# pointing in +X and num_radial_cells pointing in -X, offset by half a
+# pattern in Y. Every other row is offset by half a pattern in Y. Rows are
+# cut in alternating directions so the rapids between rows stay short.
+#
+# By default the program is flat: each cell orientation is written once as a
+# subprogram (O1001, O1002) and every cell moves the local origin to the
+# cell center with G52 and calls the subprogram with M98, so the file size
+# only grows by a few lines per cell.
+#
+# With --expand, for controllers without G52/M98, every cell is written out
+# in full and wrapped onto the cylinder: Y becomes A (degrees) at the outer
+# radius, Z is the radius and feeds are inverse time (G93). The roughing
+# path is computed once and moved, flipped and wrapped for all cells at once
+# with numpy.
+
+usage = 'generate_cylinder.py [--expand] [--output=test.nc] ' + rotary_axis_cam.metrics_usage
+output_filename = 'test.nc'
+expand = False
+metrics = rotary_axis_cam.Metrics('generate_cylinder')
+
+try:
+    opts, args = getopt.getopt(sys.argv[1:], 'h', ['expand', 'output='] + rotary_axis_cam.metrics_options)
+except getopt.GetoptError:
+    print(usage)
+    sys.exit(1)
+
+for opt, arg in opts:
+    if opt == '-h':
+        print(usage)
+        sys.exit()
+    if opt == '--expand':
+        expand = True
+    if opt == '--output':
+        output_filename = arg
+    metrics.parse_option(opt, arg)
+
+metrics.stage('read_inputs')
+
 # All units in inches
 cylinder_dimensions = {
     'outer_diameter' : 6.0,
@@ -14,7 +59,7 @@ cylinder_dimensions = {
     'overall_length' : 40,
 }
 isogrid_values = {
-    'num_radial_cells' : 12, 
+    'num_radial_cells' : 12,
     'end_flange' : 5/16,
     'start_flange' : 1.25,
     'skin_t' : 0.05,
@@ -24,6 +69,8 @@ isogrid_values = {
 rough_pass_values = {
     'feed' : 10,
     'plunge' : 2,
+    'rapid' : 100, # only used for the cycle time estimate
+    'clearance' : 0.1,
     'material_to_leave' : 0.02,
     'max_depth_per_pass' : 0.125,
     'max_stepover' : 0.125*0.4,
@@ -48,40 +95,12 @@ print('Pattern Height: {:5.3f}'.format(pattern_height))
 
 # Available length is the cylinder length availble for machining between the flanges
 available_length = cylinder_dimensions['overall_length']-isogrid_values['start_flange']-isogrid_values['end_flange']
-num_rows = math.floor(available_length/pattern_height)
+num_rows = int(math.floor(available_length/pattern_height))
 # Excess length is the material length that remains by requiring an integer number of divisions
 excess_length = available_length - num_rows*pattern_height
 print('Num Rows: {:3d}'.format(num_rows))
 print('Excess_Length: {:5.3f}'.format(excess_length))
 
-# Open the gcode file and write header
-output = open('test.nc','w')
-output.write('G0 G90 G54 G17 G40 G49 G80\n') # Safe start line
-
-# Find the starting point for the first row
-first_row_center_x1 = isogrid_values['start_flange'] + excess_length + apothem 
-first_row_center_x2 = isogrid_values['start_flange'] + excess_length + pattern_height - apothem 
-
-# Process Rows
-for i in range(1):
-    cell_x1 = first_row_center_x1
-    cell_x2 = first_row_center_x2
-    # Process Cells in Row
-    for j in range(2):
-        cell_y = j*pattern_height
-        # Cut First Cell
-        output.write('G0 X{:5.3f} Y{:5.3f}\n'.format(cell_x1,cell_y))    # Rapid to XY position
-        output.write('G52 X{:5.3f} Y{:5.3f}\n'.format(cell_x1,cell_y))   # Switch to local coordinate system 
-        output.write('M98 P1001\n')                                      # Call subprogram number 1000
-        cell_y = j*pattern_height + 0.5*pattern_height
-        # Cut Next Cell, Swithcing the direction
-        output.write('G0 X{:5.3f} Y{:5.3f}\n'.format(cell_x2,cell_y))    # Rapid to XY position
-        output.write('G52 X{:5.3f} Y{:5.3f}\n'.format(cell_x2,cell_y))   # Switch to local coordinate system 
-        output.write('M98 P1002\n')                                      # Call subprogram number 1000
-
-# End Main Program
-output.write('M30\n') # Program end and rewind
-
 # ROUGH SUBPROGRAM MACROS
 
 # Compute the number of roughing passes from the center to the sides
@@ -95,42 +114,182 @@ print('Depth to rough: {:5.3f}'.format(depth_to_rough))
 print('Depth Passes: {:3d}'.format(depth_passes))
 print('Depth per pass: {:5.3f}'.format(depth_per_pass))
 
-rough_apothem = apothem-isogrid_values['rib_t']/2-rough_pass_values['material_to_leave']
-rough_passes = math.ceil(rough_apothem/rough_pass_values['max_stepover']) 
+# Distance from the cell center to the tool center on the last pass
+rough_apothem = apothem-isogrid_values['rib_t']/2-rough_pass_values['material_to_leave']-tool_values['diameter']/2
+if rough_apothem <= 0.0:
+    print('Tool is too large for the cell size\nExiting!')
+    sys.exit(1)
+rough_passes = math.ceil(rough_apothem/rough_pass_values['max_stepover'])
 rough_stepover = rough_apothem/rough_passes
 print('\nHorizontal Values')
 print('Distance to rough: {:5.3f}'.format(rough_apothem))
-print('Passes: {:5.3f}'.format(rough_passes))
+print('Passes: {:3d}'.format(rough_passes))
 print('Stepover: {:5.3f}'.format(rough_stepover))
 
-# Start strings for subprograms
-subprogram_1_string = '\n'
-subprogram_2_string = '\n'
-
-subprogram_1_string += 'O1001 (ROUGH PASS CELL 1 BEGIN)\n' # Subprogram number
-subprogram_2_string += 'O1002 (ROUGH PASS CELL 2 BEGIN)\n' # Subprogram number
-for i in range(1,depth_passes+1):
-    print(i)
-    subprogram_1_string += 'G1 Z{:5.3f} F{:5.3f}\n'.format(-i*depth_per_pass,2)    # Plunge into material 
-    subprogram_2_string += 'G1 Z{:5.3f} F{:5.3f}\n'.format(-i*depth_per_pass,2)    # Plunge into material 
-
-    for j in range(1,rough_passes):
-        subprogram_1_string += 'G1 X{:5.3f} Y{:5.3f} F2.0\n'.format(-j*rough_stepover,0.0)  # First triangle point
-        subprogram_1_string += 'G1 X{:5.3f} Y{:5.3f} F2.0\n'.format(-j*rough_stepover,j*rough_stepover*(3**0.5))  # First triangle point
-        subprogram_1_string += 'G1 X{:5.3f} Y{:5.3f} F2.0\n'.format(j*rough_stepover*2,0.0)  # First triangle point
-        subprogram_1_string += 'G1 X{:5.3f} Y{:5.3f} F2.0\n'.format(-j*rough_stepover,-j*rough_stepover*(3**0.5))  # First triangle point
-        subprogram_1_string += 'G1 X{:5.3f} Y{:5.3f} F2.0\n'.format(-j*rough_stepover,0.0)  # First triangle point
-
-        subprogram_2_string += 'G1 X{:5.3f} Y{:5.3f} F2.0\n'.format(j*rough_stepover,0.0)  # First triangle point
-        subprogram_2_string += 'G1 X{:5.3f} Y{:5.3f} F2.0\n'.format(j*rough_stepover,j*rough_stepover*(3**0.5))  # First triangle point
-        subprogram_2_string += 'G1 X{:5.3f} Y{:5.3f} F2.0\n'.format(-j*rough_stepover*2,0.0)  # First triangle point
-        subprogram_2_string += 'G1 X{:5.3f} Y{:5.3f} F2.0\n'.format(j*rough_stepover,-j*rough_stepover*(3**0.5))  # First triangle point
-        subprogram_2_string += 'G1 X{:5.3f} Y{:5.3f} F2.0\n'.format(j*rough_stepover,0.0)  # First triangle point
-    
-subprogram_1_string += 'M99\n' # Return to main program
-subprogram_2_string += 'M99\n' # Return to main program
-output.write(subprogram_1_string)
-output.write(subprogram_2_string)
 
+def rough_path():
+    # Roughing moves for a cell pointing in +X, relative to the cell center.
+    # Returns a list of (move, x, y, z) with move 'plunge', 'cut' or
+    # 'retract'. The tool starts and ends at the cell center, above the part.
+    path = []
+    for i in range(1,depth_passes+1):
+        path.append(('plunge', 0.0, 0.0, -i*depth_per_pass))
+        for j in range(1,rough_passes+1):
+            a = j*rough_stepover
+            # Triangle with its base at -a and tip at 2a
+            for x, y in [(-a, 0.0), (-a, a*(3**0.5)), (2*a, 0.0), (-a, -a*(3**0.5)), (-a, 0.0)]:
+                path.append(('cut', x, y, -i*depth_per_pass))
+        # Back to the center before the next plunge
+        path.append(('cut', 0.0, 0.0, -i*depth_per_pass))
+    # Retract before moving to the next cell
+    path.append(('retract', 0.0, 0.0, rough_pass_values['clearance']))
+
+    return path
+
+
+def path_time(path):
+    # Time (min) to run the path from the center at the clearance height
+    x_last, y_last, z_last = 0.0, 0.0, rough_pass_values['clearance']
+    time = 0.0
+    for move, x, y, z in path:
+        distance = math.sqrt((x - x_last)**2 + (y - y_last)**2 + (z - z_last)**2)
+        time += distance/rough_pass_values[{'plunge': 'plunge', 'cut': 'feed', 'retract': 'rapid'}[move]]
+        x_last, y_last, z_last = x, y, z
+
+    return time
+
+
+def rough_subprogram(number, direction, path):
+    # Returns the lines of a roughing subprogram. direction is 1 for a cell
+    # pointing in +X and -1 for one pointing in -X.
+    lines = ['\n', 'O{:d} (ROUGH PASS CELL {:d} BEGIN)\n'.format(number, number - 1000)] # Subprogram number
+    for move, x, y, z in path:
+        if move == 'plunge':
+            lines.append('G1 Z{:5.3f} F{:5.3f}\n'.format(z,rough_pass_values['plunge']))    # Plunge into material
+        elif move == 'cut':
+            lines.append('G1 X{:5.3f} Y{:5.3f} F{:.1f}\n'.format(direction*x, y, rough_pass_values['feed']))
+        else:
+            lines.append('G0 Z{:5.3f}\n'.format(z))
+    lines.append('M99\n') # Return to main program
+
+    return lines
+
+
+def cell_centers():
+    # Center (x, y) and direction of every cell, in cutting order
+    first_row_center_x1 = isogrid_values['start_flange'] + excess_length + apothem
+    first_row_center_x2 = isogrid_values['start_flange'] + excess_length + pattern_height - apothem
+    cells = []
+    for i in range(num_rows):
+        cell_x1 = first_row_center_x1 + i*pattern_height
+        cell_x2 = first_row_center_x2 + i*pattern_height
+        # Every other row is shifted by half a pattern
+        row_y = (i % 2)*0.5*pattern_size
+        row = []
+        for j in range(isogrid_values['num_radial_cells']):
+            cell_y = row_y + j*pattern_size
+            row.append((cell_x1, cell_y, 1))
+            row.append((cell_x2, cell_y + 0.5*pattern_size, -1))
+        if i % 2:
+            # Cut back the other way
+            row.reverse()
+        cells += row
+
+    return cells
+
+
+path = rough_path()
+cell_time = path_time(path)
+cells = cell_centers()
+num_cells = len(cells)
+rapid_distance = 0.0
+x_last, y_last = 0.0, 0.0
+for x, y, direction in cells:
+    rapid_distance += math.hypot(x - x_last, y - y_last)
+    x_last, y_last = x, y
+cycle_time = num_cells*cell_time + rapid_distance/rough_pass_values['rapid']
+
+metrics.stage('generate')
+output = rotary_axis_cam.open_file(output_filename,'w')
+output.write('(G-code automatically written using generate_cylinder.py)\n')
+output.write('(Cells: {:d}, Estimated Cycle Time: {:4.0f} mins)\n'.format(num_cells, cycle_time))
+
+if not expand:
+    # Main program
+    lines = []
+    lines.append('G0 G90 G54 G17 G40 G49 G80\n') # Safe start line
+    lines.append('G0 Z{:5.3f}\n'.format(rough_pass_values['clearance']))
+    for x, y, direction in cells:
+        lines.append('G52 X{:5.3f} Y{:5.3f}\n'.format(x,y))    # Switch to local coordinate system
+        lines.append('G0 X0.000 Y0.000\n')                      # Rapid to cell center
+        if direction == 1:
+            lines.append('M98 P1001\n')                         # Call subprogram number 1001
+        else:
+            lines.append('M98 P1002\n')                         # Call subprogram number 1002
+
+    # End Main Program
+    lines.append('G52 X0.000 Y0.000\n') # Cancel local coordinate system
+    lines.append('M30\n') # Program end and rewind
+    output.writelines(lines)
+    output.writelines(rough_subprogram(1001, 1, path))
+    output.writelines(rough_subprogram(1002, -1, path))
+else:
+    import numpy as np
+
+    outer_radius = cylinder_dimensions['outer_diameter']/2.0
+    safe_z_height = outer_radius + rough_pass_values['clearance']
+
+    # Template for one cell, with the cell dependent X and A left as %
+    # fields. Inverse time feeds only depend on the move, not the cell, so
+    # they're part of the template.
+    template = 'G0 X%.4f A%.3f\n'
+    path_x = [0.0]
+    path_y = [0.0]
+    x_last, y_last, z_last = 0.0, 0.0, rough_pass_values['clearance']
+    for move, x, y, z in path:
+        if move == 'plunge':
+            template += 'G1 Z{:.4f} F{:.3f}\n'.format(outer_radius + z, rough_pass_values['plunge']/abs(z - z_last))
+        elif move == 'cut':
+            # Y is wrapped at the outer radius, the tool is cutting at the
+            # radius of the pass
+            distance = math.hypot(x - x_last, (y - y_last)*(outer_radius + z)/outer_radius)
+            template += 'G1 X%.4f A%.3f F{:.3f}\n'.format(rough_pass_values['feed']/distance)
+            path_x.append(x)
+            path_y.append(y)
+        else:
+            template += 'G0 Z{:.4f}\n'.format(outer_radius + z)
+        x_last, y_last, z_last = x, y, z
+
+    # Move, flip and wrap every cell
+    cell_x = np.array([cell[0] for cell in cells])
+    cell_y = np.array([cell[1] for cell in cells])
+    cell_direction = np.array([cell[2] for cell in cells])
+    X = cell_x[:,None] + cell_direction[:,None]*np.array(path_x)[None,:]
+    A = np.degrees((cell_y[:,None] + np.array(path_y)[None,:])/outer_radius)
+    values = np.empty((num_cells, 2*len(path_x)))
+    values[:,0::2] = X
+    values[:,1::2] = A
+
+    output.write('G0 G90 G17 G40 G49 G80\n') # Safe start line
+    output.write('G20   (set units to inches)\n')
+    output.write('G0 Z{:.4f} (Safe Z height)\n'.format(safe_z_height))
+    output.write('G93   (inverse time)\n')
+    output.writelines([template % tuple(row) for row in values.tolist()])
+    output.write('G94   (standard feed rates)\n')
+    output.write('M5 M30\n')
+
+metrics.stage('close_files')
 # Close file
 output.close()
+file_size = os.path.getsize(output_filename)
+metrics.count('bytes_written', file_size)
+
+print('\nProgram')
+if expand:
+    print('Expanded and wrapped onto {:5.3f} diameter'.format(cylinder_dimensions['outer_diameter']))
+print('Cells: {:d} ({:d} rows of {:d})'.format(num_cells, num_rows, 2*isogrid_values['num_radial_cells']))
+print('Written to: {} ({:.1f} kB)'.format(output_filename, file_size/1000.0))
+print('Estimated Cycle Time: {:4.0f} mins'.format(cycle_time))
+print('                      {:3.2f} hrs'.format(cycle_time/60.0))
+
+metrics.finish()
@@ -0,0 +1,221 @@
+#!/usr/bin/env python
+import sys
+import math
+import getopt
+
+import numpy as np
+
+# Generates synthetic, reproducible workloads for testing and benchmarking:
+#   probe   - Z probe results on an X by A grid (pre_probe_cylinder.py)
+#   edge    - X edge probe results around the part (pre_probe_cylinder_edge.py)
+#   wrapped - Wrapped rotary G-code in the style written by G-Code-Ripper
+#             (G94 feeds, X/A/Z moves, negative coordinates)
+#   drill   - Flat drilling program (input for widen_holes.py)
+#
+# The probe model is a cylinder with an eccentric and bowed axis, a taper,
+# ovality and measurement noise. The same seed always gives the same file.
+#
+# Probe files can be written in the plain format (as used in examples/) or
+# the lettered format written directly by the Mach4 M40 macro.
+
+usage = '''generate_workload.py probe   [--grid=10x24] [--radius=3.0] [--x-start=-3.0] [--x-end=0.0]
+                             [--eccentricity=0.005] [--taper=0.001] [--bow=0.002]
+                             [--ovality=0.001] [--noise=0.0002] [--format=plain|lettered]
+                             [--seed=0] [--output=probe_results.txt]
+generate_workload.py edge    [--num-a=24] [--edge-x=0.0] [--probe-z=3.125] [--wobble=0.01]
+                             [--noise=0.0002] [--format=plain|lettered] [--seed=0]
+                             [--output=probe_results_edge.txt]
+generate_workload.py wrapped [--lines=100000] [--radius=3.0] [--seed=0] [--output=wrapped.nc]
+generate_workload.py drill   [--lines=100000] [--output=drill_holes.nc]'''
+
+probe_model = {
+    'eccentricity': 0.005,   # axis offset (in)
+    'eccentricity_angle': 30.0,  # deg
+    'taper': 0.001,          # radius change per inch of X
+    'bow': 0.002,            # axis sag at mid length (in)
+    'bow_angle': 120.0,      # deg
+    'ovality': 0.001,        # 2 per rev radius variation (in)
+    'ovality_angle': 75.0,   # deg
+    'noise': 0.0002,         # standard deviation (in)
+}
+
+
+def format_probe_line(x, y, z, a, probe_format):
+    if probe_format == 'lettered':
+        return 'X{:.4f} Y{:.4f} Z{:.4f} A{:.3f}\r\n'.format(x, y, z, a)
+    else:
+        return '{:.4f} {:.4f} {:.4f} {:.3f}\n'.format(x, y, z, a)
+
+
+def probe_surface(X, A, radius, x_start, x_end, model):
+    # Radius seen by the probe at each (X, A) point
+    theta = np.radians(A)
+    length = x_end - x_start
+    if length != 0:
+        bow = model['bow']*(1.0 - (2.0*(X - x_start)/length - 1.0)**2)
+    else:
+        bow = 0.0*X
+    phi_e = math.radians(model['eccentricity_angle'])
+    phi_b = math.radians(model['bow_angle'])
+    phi_o = math.radians(model['ovality_angle'])
+    offset_y = model['eccentricity']*math.cos(phi_e) + bow*math.cos(phi_b)
+    offset_z = model['eccentricity']*math.sin(phi_e) + bow*math.sin(phi_b)
+
+    Z = radius + model['taper']*(X - x_start)
+    Z += offset_y*np.cos(theta) + offset_z*np.sin(theta)
+    Z += model['ovality']*np.cos(2.0*(theta - phi_o))
+
+    return Z
+
+
+def write_probe_file(filename, num_x, num_a, radius, x_start=-3.0, x_end=0.0,
+                     probe_format='plain', seed=0, model=probe_model):
+    rng = np.random.RandomState(seed)
+    if num_x == 1:
+        X_values = np.array([x_start])
+    else:
+        X_values = np.linspace(x_start, x_end, num_x)
+    A_values = np.arange(num_a)*360.0/num_a
+    X, A = np.meshgrid(X_values, A_values, indexing='ij')
+    Z = probe_surface(X, A, radius, x_start, x_end, model)
+    Z += rng.normal(0.0, model['noise'], Z.shape)
+    Y = np.round(rng.normal(0.0, 0.0001), 4)*np.ones(Z.shape)
+
+    output_file = open(filename, 'w', newline='')
+    for x, y, z, a in zip(X.ravel().tolist(), Y.ravel().tolist(), Z.ravel().tolist(), A.ravel().tolist()):
+        output_file.write(format_probe_line(x, y, z, a, probe_format))
+    output_file.close()
+
+
+def write_edge_probe_file(filename, num_a, edge_x=0.0, probe_z=3.125, wobble=0.01,
+                          wobble_angle=200.0, noise=0.0002, probe_format='plain', seed=0):
+    rng = np.random.RandomState(seed)
+    A = np.arange(num_a)*360.0/num_a
+    X = edge_x + wobble*np.cos(np.radians(A - wobble_angle)) + rng.normal(0.0, noise, num_a)
+
+    output_file = open(filename, 'w', newline='')
+    for x, a in zip(X.tolist(), A.tolist()):
+        output_file.write(format_probe_line(x, -0.0002, probe_z, a, probe_format))
+    output_file.close()
+
+
+def ripper_value(value):
+    # G-Code-Ripper style: a space before positive values, so negative
+    # values are written as e.g. X-1.2345
+    return '{: .4f}'.format(value)
+
+
+def write_wrapped_gcode(filename, num_lines, radius, depth=0.05, x_start=-3.0,
+                        x_end=0.0, seed=0):
+    # Wrapped engraving/pocketing passes: rapid to the start of a pass,
+    # plunge (the only lines with F), a run of X/A feed moves and a retract.
+    # Cut lengths and directions vary, A runs negative as well as positive.
+    rng = np.random.RandomState(seed)
+    safe_z = radius + 0.1
+    cut_z = radius - depth
+    output_file = open(filename, 'w')
+    output_file.write('( Code generated by synthetic G-Code-Ripper style workload )\n')
+    output_file.write('G20\nG90\nG94\n')
+    output_file.write('G0 Z' + ripper_value(safe_z) + '\n')
+    lines = 5
+    # Each pass is num_moves + 3 lines, leave room for the 2 end lines
+    while num_lines - 2 - lines >= 4:
+        num_moves = min(int(rng.randint(20, 400)), num_lines - 2 - lines - 3)
+        x = rng.uniform(x_start, x_end)
+        a = rng.uniform(-360.0, 360.0)
+        output_file.write('G0 X' + ripper_value(x) + ' A' + ripper_value(a) + '\n')
+        output_file.write('G1 Z' + ripper_value(cut_z) + ' F {:.1f}\n'.format(10.0))
+        dx = rng.normal(0.0, 0.02, num_moves)
+        da = rng.normal(0.0, 2.0, num_moves)
+        # No zero length moves
+        da = np.where(da < 0, -1.0, 1.0)*np.maximum(np.abs(da), 0.01)
+        xs = np.clip(x + np.cumsum(dx), x_start, x_end)
+        As = a + np.cumsum(da)
+        for x, a in zip(xs.tolist(), As.tolist()):
+            output_file.write('G1 X' + ripper_value(x) + ' A' + ripper_value(a) + '\n')
+        output_file.write('G0 Z' + ripper_value(safe_z) + '\n')
+        lines += num_moves + 3
+    output_file.write('M5\nM2\n')
+    output_file.close()
+
+
+def write_drill_gcode(filename, num_lines):
+    # Flat drilling program, three lines per hole
+    output_file = open(filename, 'w')
+    output_file.write('(Synthetic drilling program)\nG90\nG90.1\n')
+    for i in range(max(1, (num_lines - 4)//3)):
+        output_file.write('G0 X {:.4f} Y {:.4f}\n'.format(0.25*(i % 40), 0.25*(i//40 % 40)))
+        output_file.write('G1 Z -0.2000 F 2.0\n')
+        output_file.write('G0 Z 0.1000\n')
+    output_file.write('M5 M2\n')
+    output_file.close()
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2 or sys.argv[1] not in ['probe', 'edge', 'wrapped', 'drill']:
+        print(usage)
+        sys.exit(1)
+    kind = sys.argv[1]
+    try:
+        opts, args = getopt.getopt(sys.argv[2:], 'h', [
+            'grid=', 'num-a=', 'radius=', 'x-start=', 'x-end=', 'eccentricity=', 'taper=',
+            'bow=', 'ovality=', 'noise=', 'format=', 'seed=', 'output=', 'lines=',
+            'edge-x=', 'probe-z=', 'wobble='])
+    except getopt.GetoptError:
+        print(usage)
+        sys.exit(1)
+
+    settings = {
+        'grid': '10x24',
+        'num-a': 24,
+        'radius': 3.0,
+        'x-start': -3.0,
+        'x-end': 0.0,
+        'format': 'plain',
+        'seed': 0,
+        'output': None,
+        'lines': 100000,
+        'edge-x': 0.0,
+        'probe-z': 3.125,
+        'wobble': 0.01,
+    }
+    model = dict(probe_model)
+    for opt, arg in opts:
+        if opt == '-h':
+            print(usage)
+            sys.exit()
+        key = opt[2:]
+        if key in ['eccentricity', 'taper', 'bow', 'ovality', 'noise']:
+            model[key] = float(arg)
+        elif key in ['grid', 'format', 'output']:
+            settings[key] = arg
+        elif key in ['num-a', 'seed', 'lines']:
+            settings[key] = int(arg)
+        else:
+            settings[key] = float(arg)
+
+    if settings['format'] not in ['plain', 'lettered']:
+        print('Invalid probe format:', settings['format'], '\nExiting!')
+        sys.exit(1)
+
+    if kind == 'probe':
+        num_x, num_a = [int(n) for n in settings['grid'].lower().split('x')]
+        filename = settings['output'] or 'probe_results.txt'
+        write_probe_file(filename, num_x, num_a, settings['radius'], settings['x-start'],
+                         settings['x-end'], settings['format'], settings['seed'], model)
+        print('Wrote {:d}x{:d} probe grid to: {}'.format(num_x, num_a, filename))
+    elif kind == 'edge':
+        filename = settings['output'] or 'probe_results_edge.txt'
+        write_edge_probe_file(filename, settings['num-a'], settings['edge-x'], settings['probe-z'],
+                              settings['wobble'], noise=model['noise'],
+                              probe_format=settings['format'], seed=settings['seed'])
+        print('Wrote {:d} edge probe points to: {}'.format(settings['num-a'], filename))
+    elif kind == 'wrapped':
+        filename = settings['output'] or 'wrapped.nc'
+        write_wrapped_gcode(filename, settings['lines'], settings['radius'],
+                            x_start=settings['x-start'], x_end=settings['x-end'], seed=settings['seed'])
+        print('Wrote {:d} lines of wrapped G-code to: {}'.format(settings['lines'], filename))
+    elif kind == 'drill':
+        filename = settings['output'] or 'drill_holes.nc'
+        write_drill_gcode(filename, settings['lines'])
+        print('Wrote {:d} lines of drilling G-code to: {}'.format(settings['lines'], filename))
@@ -0,0 +1,377 @@
+#!/usr/bin/env python
+import os
+import sys
+import json
+import time
+import getopt
+import hashlib
+import threading
+import contextlib
+import collections
+from http.server import HTTPServer, BaseHTTPRequestHandler
+
+import probe
+import rotary_axis_cam
+import apply_cylinder_autolevel
+import convert_to_inverse_time
+
+# Long running job server for the G-code modifiers. Python, numpy and scipy
+# are loaded once at startup and fitted probe surfaces are kept in an LRU
+# cache keyed by the probe file contents (SHA-1) and z_ref, so a job only
+# pays for reading and writing the G-code.
+#
+# Jobs are sent as JSON to a localhost HTTP port:
+#   POST /autolevel  {"input": "in.nc", "output": "out.nc", "probe": "probe_results.txt", "z_ref": 3.0}
+#   POST /convert    {"input": "in.nc", "output": "out.nc", "verbose": false}
+#   GET  /status     cache and job counts
+# Relative file names are relative to the folder the server was started in.
+# Requests need Content-Type: application/json, and requests from a web page
+# (with an Origin header) are refused, so a page open in a browser can't send
+# jobs. The input, output and probe files have to be inside the folder the
+# server was started in (or the watch folder).
+#
+# A drop folder can also be watched (--watch). G-code files saved into the
+# folder are processed with --job once their size stops changing, and the
+# result is written to the processed/ sub folder with the same name.
+
+usage = '''job_server.py [--port=8765] [--cache-size=8] [--quiet]
+              [--watch=folder] [--job=autolevel|convert] [--probe=probe_results.txt]
+              [--z-ref=3.0] [--poll=1.0]'''
+
+gcode_extensions = ['.nc', '.ngc', '.tap', '.gcode']
+
+
+def gcode_extension(name):
+    # Extension of the file name, ignoring a compression suffix (part.nc.gz)
+    if rotary_axis_cam.file_compression(name) is not None:
+        name = os.path.splitext(name)[0]
+    return os.path.splitext(name)[1].lower()
+
+
+class ProbeCache:
+    # LRU cache of fitted probe surfaces. Keyed on the file contents rather
+    # than the name, so re-probing into the same file is picked up. Each
+    # surface is a probe.ProbeSurface, so its point cache is also kept
+    # between jobs.
+
+    def __init__(self, size=8, quiet=False):
+        self.size = size
+        self.quiet = quiet
+        self.surfaces = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, filename, z_ref):
+        # Returns the probe.ProbeSurface and whether it was a cache hit
+        input_file = open(filename, 'rb')
+        key = (hashlib.sha1(input_file.read()).hexdigest(), float(z_ref))
+        input_file.close()
+        if key in self.surfaces:
+            self.hits += 1
+            self.surfaces.move_to_end(key)
+            return self.surfaces[key], True
+
+        self.misses += 1
+        if self.quiet:
+            with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+                probe_f, probe_dim = probe.load_probe_surface(filename, z_ref)
+        else:
+            probe_f, probe_dim = probe.load_probe_surface(filename, z_ref)
+        self.surfaces[key] = probe.ProbeSurface(probe_f, probe_dim)
+        if len(self.surfaces) > self.size:
+            self.surfaces.popitem(last=False)
+            self.evictions += 1
+
+        return self.surfaces[key], False
+
+    def status(self):
+        return {
+            'size': len(self.surfaces),
+            'max_size': self.size,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+        }
+
+
+# Job fields and the types they can have
+job_fields = {
+    'input': (str,),
+    'output': (str,),
+    'probe': (str,),
+    'z_ref': (int, float),
+    'verbose': (bool,),
+}
+
+
+class JobRunner:
+    # Runs jobs one at a time, from the HTTP server and the folder watcher.
+    # Job files have to be inside one of folders (default the current
+    # folder).
+
+    def __init__(self, cache_size=8, quiet=False, folders=None):
+        self.quiet = quiet
+        if folders is None:
+            folders = [os.getcwd()]
+        self.folders = [os.path.realpath(folder) for folder in folders]
+        self.cache = ProbeCache(cache_size, quiet)
+        self.lock = threading.Lock()
+        self.jobs_done = 0
+        self.jobs_failed = 0
+
+    def run(self, kind, job):
+        # Returns a result dictionary, raises ValueError for bad jobs and
+        # IOError for missing files
+        if not isinstance(job, dict):
+            raise ValueError('Job needs to be a JSON object')
+        for name in ['input', 'output']:
+            if name not in job:
+                raise ValueError('Missing ' + name)
+        for name, value in job.items():
+            if name not in job_fields:
+                raise ValueError('Unknown field: ' + str(name))
+            if not isinstance(value, job_fields[name]) or (isinstance(value, bool) and bool not in job_fields[name]):
+                raise ValueError('Invalid value for ' + name)
+        job = dict(job)
+        for name in ['input', 'output', 'probe']:
+            if name in job:
+                job[name] = self.resolve(job[name])
+        with self.lock:
+            start = time.perf_counter()
+            try:
+                if kind == 'autolevel':
+                    result = self.autolevel(job)
+                elif kind == 'convert':
+                    result = self.convert(job)
+                else:
+                    raise ValueError('Unknown job: ' + kind)
+            except Exception:
+                self.jobs_failed += 1
+                raise
+            self.jobs_done += 1
+            result['job'] = kind
+            result['input'] = job['input']
+            result['output'] = job['output']
+            result['time'] = time.perf_counter() - start
+            if not self.quiet:
+                print('{}: {} -> {} ({:d} lines, {:.3f} s)'.format(
+                    kind, job['input'], job['output'], result['lines_read'], result['time']))
+
+        return result
+
+    def resolve(self, filename):
+        # Full path of a job file, raises ValueError if it's outside the
+        # allowed folders
+        path = os.path.realpath(filename)
+        for folder in self.folders:
+            if os.path.commonpath([path, folder]) == folder:
+                return path
+        raise ValueError('File is outside the server folder: ' + filename)
+
+    def autolevel(self, job):
+        if 'probe' not in job or 'z_ref' not in job:
+            raise ValueError('Missing probe or z_ref')
+        probe_start = time.perf_counter()
+        surface, cached = self.cache.get(job['probe'], job['z_ref'])
+        probe_time = time.perf_counter() - probe_start
+        stats = {}
+        with rotary_axis_cam.open_file(job['input'], 'r') as input_file:
+            write_output(job['output'], apply_cylinder_autolevel.autolevel(input_file, surface, surface.probe_dim, stats=stats))
+        stats['probe_cached'] = cached
+        stats['probe_time'] = probe_time
+
+        return stats
+
+    def convert(self, job):
+        stats = {}
+        with rotary_axis_cam.open_file(job['input'], 'r') as input_file:
+            write_output(job['output'], convert_to_inverse_time.convert(input_file, job.get('verbose', False), stats=stats))
+
+        return stats
+
+    def status(self):
+        return {
+            'jobs_done': self.jobs_done,
+            'jobs_failed': self.jobs_failed,
+            'probe_cache': self.cache.status(),
+        }
+
+
+def write_output(filename, lines):
+    # Written to a temporary file and renamed, so a partly written file is
+    # never left behind (or picked up by the machine). Compressed the same
+    # as the final file name.
+    temp_filename = filename + '.part'
+    try:
+        with rotary_axis_cam.open_file(temp_filename, 'w', rotary_axis_cam.file_compression(filename)) as output_file:
+            output_file.writelines(lines)
+    except Exception:
+        if os.path.isfile(temp_filename):
+            os.remove(temp_filename)
+        raise
+    os.replace(temp_filename, filename)
+
+
+# HTTP Server
+class JobHandler(BaseHTTPRequestHandler):
+    runner = None
+
+    def send_json(self, code, data):
+        body = json.dumps(data).encode()
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == '/status':
+            self.send_json(200, self.runner.status())
+        else:
+            self.send_json(404, {'error': 'Unknown path: ' + self.path})
+
+    def do_POST(self):
+        kind = self.path.strip('/')
+        if kind not in ['autolevel', 'convert']:
+            self.send_json(404, {'error': 'Unknown path: ' + self.path})
+            return
+        if 'Origin' in self.headers:
+            # Sent by browsers, jobs only come from local tools
+            self.send_json(403, {'error': 'Requests from web pages are not allowed'})
+            return
+        if self.headers.get('Content-Type', '').split(';')[0].strip().lower() != 'application/json':
+            self.send_json(415, {'error': 'Content-Type needs to be application/json'})
+            return
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            job = json.loads(self.rfile.read(length).decode())
+            result = self.runner.run(kind, job)
+        except (ValueError, IOError) as error:
+            self.send_json(400, {'error': str(error)})
+            return
+        self.send_json(200, result)
+
+    def log_message(self, format, *args):
+        if not self.runner.quiet:
+            BaseHTTPRequestHandler.log_message(self, format, *args)
+
+
+# Drop folder
+class FolderWatcher(threading.Thread):
+    # Polls a folder for new or changed G-code files. A file is processed
+    # once its size and modified time are the same on two polls in a row, so
+    # files still being saved aren't picked up.
+
+    def __init__(self, runner, folder, kind, job_settings, poll=1.0):
+        threading.Thread.__init__(self, daemon=True)
+        self.runner = runner
+        self.folder = folder
+        self.kind = kind
+        self.job_settings = job_settings
+        self.poll = poll
+        self.output_folder = os.path.join(folder, 'processed')
+        self.pending = {}
+        self.processed = {}
+
+    def scan(self):
+        for name in sorted(os.listdir(self.folder)):
+            filename = os.path.join(self.folder, name)
+            if gcode_extension(name) not in gcode_extensions or not os.path.isfile(filename):
+                continue
+            try:
+                file_stat = os.stat(filename)
+            except OSError:
+                # Removed since the listing
+                continue
+            signature = (file_stat.st_size, file_stat.st_mtime)
+            if self.processed.get(name) == signature:
+                continue
+            if self.pending.get(name) != signature:
+                # New or still changing, check again on the next poll
+                self.pending[name] = signature
+                continue
+            del self.pending[name]
+            self.processed[name] = signature
+            job = dict(self.job_settings)
+            job['input'] = filename
+            job['output'] = os.path.join(self.output_folder, name)
+            try:
+                self.runner.run(self.kind, job)
+            except Exception as error:
+                # Keep watching, a bad file only fails its own job
+                print('Error processing', filename + ':', error)
+
+    def run(self):
+        if not os.path.isdir(self.output_folder):
+            os.mkdir(self.output_folder)
+        while True:
+            self.scan()
+            time.sleep(self.poll)
+
+
+if __name__ == '__main__':
+    port = 8765
+    cache_size = 8
+    quiet = False
+    watch_folder = None
+    watch_job = 'autolevel'
+    probe_filename = 'probe_results.txt'
+    z_ref = 3.0
+    poll = 1.0
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], 'h', ['port=', 'cache-size=', 'quiet', 'watch=', 'job=',
+                                                       'probe=', 'z-ref=', 'poll='])
+    except getopt.GetoptError:
+        print(usage)
+        sys.exit(1)
+
+    for opt, arg in opts:
+        if opt == '-h':
+            print(usage)
+            sys.exit()
+        if opt == '--port':
+            port = int(arg)
+        if opt == '--cache-size':
+            cache_size = int(arg)
+        if opt == '--quiet':
+            quiet = True
+        if opt == '--watch':
+            watch_folder = arg
+        if opt == '--job':
+            watch_job = arg
+        if opt == '--probe':
+            probe_filename = arg
+        if opt == '--z-ref':
+            z_ref = float(arg)
+        if opt == '--poll':
+            poll = float(arg)
+
+    if watch_job not in ['autolevel', 'convert']:
+        print('Invalid job:', watch_job, '\nExiting!')
+        sys.exit(1)
+    if watch_folder is not None and not os.path.isdir(watch_folder):
+        print('Watch folder does not exist:', watch_folder, '\nExiting!')
+        sys.exit(1)
+
+    # Pay for the scipy import now rather than on the first job
+    from scipy import interpolate
+
+    folders = [os.getcwd()]
+    if watch_folder is not None:
+        folders += [watch_folder, os.path.dirname(os.path.abspath(probe_filename))]
+    runner = JobRunner(cache_size, quiet, folders)
+    JobHandler.runner = runner
+    server = HTTPServer(('127.0.0.1', port), JobHandler)
+    print('Job server listening on http://127.0.0.1:{:d}'.format(port))
+
+    if watch_folder is not None:
+        job_settings = {'probe': probe_filename, 'z_ref': z_ref}
+        FolderWatcher(runner, watch_folder, watch_job, job_settings, poll).start()
+        print('Watching', watch_folder, 'for', watch_job, 'jobs')
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print('\nStopping job server')
+    server.server_close()
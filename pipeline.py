@@ -0,0 +1,291 @@
+#!/usr/bin/env python
+import os
+import sys
+import time
+import getopt
+
+import rotary_axis_cam
+
+# Runs a chain of generate and modify steps in one process, without the
+# intermediate .nc files. Each stage is the generator function of a script
+# (e.g. wrap_to_cylinder.wrap, convert_to_inverse_time.convert,
+# apply_cylinder_autolevel.autolevel), fed the lines of the stage before it
+# as they are made, so only the final program is written to disk. The input
+# and output can be compressed (.gz, .xz, .bz2 or .zst, rotary_axis_cam.open_file).
+#
+# The job is an .inputs style file (python), for example:
+#
+#   pipeline_inputs = {
+#       'input': 'flat.nc',
+#       'output': 'part.nc.gz',
+#   }
+#   stages = [
+#       {'stage': 'wrap', 'radius': 3.0},
+#       {'stage': 'autolevel', 'probe': 'probe_results.txt', 'z_ref': 3.0},
+#       {'stage': 'unwind', 'g92': True},
+#   ]
+#
+# The first stage can also be a generator (cut_groove, cut_recess or
+# drill_holes) with its inputs dictionaries, in which case there's no input
+# file. With timing the time spent in each stage is printed, each stage's
+# time doesn't include the stages before it.
+
+usage = 'pipeline.py --job=pipeline.inputs [--timing] [--quiet] ' + rotary_axis_cam.metrics_usage
+
+pipeline_inputs = {
+    'input': None,     # G-code file for the first stage, None if it's a generator
+    'output': 'output.nc', # .gz, .xz, .bz2 or .zst for a compressed program
+    'timing': False,   # print the time spent in each stage
+}
+stages = []
+
+# Settings of each stage and their defaults
+stage_defaults = {
+    # Generators, the probe files are used if the inputs ask for them
+    'cut_groove': {'inputs': {}, 'cutter_inputs': {}, 'probe': 'probe_results.txt'},
+    'cut_recess': {'inputs': {}, 'cutter_inputs': {}, 'isogrid_inputs': {}, 'probe': 'probe_results.txt'},
+    'drill_holes': {'inputs': {}, 'cutter_inputs': {}, 'probe': 'probe_results.txt',
+                    'edge_probe': 'probe_results_edge.txt'},
+    # Modifiers
+    'wrap': {'radius': 3.0, 'tolerance': 0.0005, 'probe': None, 'z_ref': 3.0, 'max_segment': None},
+    'convert': {'verbose': False},
+    'autolevel': {'probe': 'probe_results.txt', 'z_ref': 3.0, 'edge_probe': None, 'arc_tolerance': 0.0005,
+                  'surface': 'spline'},
+    'widen_holes': {'old_diameter': 0.125, 'new_diameter': 0.136, 'feed': 4.0, 'pitch': None, 'top': 0.0},
+    'unwind': {'g92': False, 'a_rapid': 3600.0},
+}
+generator_stages = ['cut_groove', 'cut_recess', 'drill_holes']
+
+
+def check_stages(job_inputs, job_stages):
+    # Returns complete copies of the job inputs and stages (defaults for
+    # anything not given). Raises ValueError for invalid jobs.
+    checked_inputs = dict(pipeline_inputs)
+    checked_inputs.update(job_inputs)
+    if not job_stages:
+        raise ValueError('No stages in the job')
+    checked_stages = []
+    for stage_num, stage in enumerate(job_stages):
+        name = stage.get('stage')
+        if name not in stage_defaults:
+            raise ValueError('Unknown stage: {}'.format(name))
+        checked_stage = dict(stage_defaults[name])
+        for setting, value in stage.items():
+            if setting != 'stage' and setting not in checked_stage:
+                raise ValueError('Unknown setting for {}: {}'.format(name, setting))
+            checked_stage[setting] = value
+        if name in generator_stages and stage_num > 0:
+            raise ValueError('{} can only be the first stage'.format(name))
+        checked_stages.append(checked_stage)
+    first = checked_stages[0]['stage']
+    if first in generator_stages and checked_inputs['input'] is not None:
+        raise ValueError('{} makes its own program, input needs to be None'.format(first))
+    if first not in generator_stages and checked_inputs['input'] is None:
+        raise ValueError('{} needs an input file'.format(first))
+
+    return checked_inputs, checked_stages
+
+
+def stage_lines(stage, lines, progress, stats, metrics):
+    # Sets up one stage (reading its probe files) and returns its lines.
+    # lines are the lines of the stage before, None for a generator.
+    name = stage['stage']
+    if name == 'cut_groove':
+        import cut_groove_cylinder
+        inputs, cutter_inputs = cut_groove_cylinder.check_inputs(stage['inputs'], stage['cutter_inputs'])
+        probe_f, probe_dim = load_probe(stage['probe'], inputs, 'use_probe_file', metrics)
+        return cut_groove_cylinder.cut_groove(inputs, cutter_inputs, probe_f, probe_dim, stats)
+    if name == 'cut_recess':
+        import cut_recess_cylinder
+        inputs, cutter_inputs, isogrid_inputs = cut_recess_cylinder.check_inputs(
+            stage['inputs'], stage['cutter_inputs'], stage['isogrid_inputs'])
+        probe_f, probe_dim = load_probe(stage['probe'], inputs, 'use_probe_file', metrics)
+        return cut_recess_cylinder.cut_recess(inputs, cutter_inputs, isogrid_inputs, probe_f, probe_dim, stats)
+    if name == 'drill_holes':
+        import drill_holes_cylinder
+        inputs, cutter_inputs = drill_holes_cylinder.check_inputs(stage['inputs'], stage['cutter_inputs'])
+        Z_probe_f, Z_probe_dim = load_probe(stage['probe'], inputs, 'use_Z_probe_file', metrics)
+        X_probe_f = None
+        if inputs['use_X_probe_file']:
+            import probe
+            X_probe_f = probe.load_edge_probe_surface(stage['edge_probe'], metrics)
+        return drill_holes_cylinder.drill_holes(inputs, cutter_inputs, Z_probe_f, Z_probe_dim, X_probe_f, stats)
+    if name == 'wrap':
+        import wrap_to_cylinder
+        probe_f = None
+        probe_dim = None
+        if stage['probe'] is not None:
+            import probe
+            probe_f, probe_dim = probe.load_probe_surface(stage['probe'], stage['z_ref'], metrics)
+        return wrap_to_cylinder.wrap(lines, stage['radius'], stage['tolerance'], probe_f, probe_dim,
+                                     stage['max_segment'], progress, stats)
+    if name == 'convert':
+        import convert_to_inverse_time
+        return convert_to_inverse_time.convert(lines, stage['verbose'], progress, stats)
+    if name == 'autolevel':
+        import probe
+        import apply_cylinder_autolevel
+        batch_size = None
+        if stage['surface'] == 'spline':
+            probe_f, probe_dim = probe.load_probe_surface(stage['probe'], stage['z_ref'], metrics)
+        elif stage['surface'] == 'harmonic':
+            probe_f, probe_dim = probe.load_harmonic_surface(stage['probe'], stage['z_ref'], metrics=metrics)
+        elif stage['surface'] == 'cylinder':
+            probe_f, probe_dim = probe.load_cylinder_surface(stage['probe'], stage['z_ref'], metrics=metrics)
+        else:
+            raise ValueError('Invalid surface: {}'.format(stage['surface']))
+        if stage['surface'] != 'spline':
+            batch_size = apply_cylinder_autolevel.batch_lines
+        edge_probe_f = None
+        if stage['edge_probe'] is not None:
+            edge_probe_f = probe.load_edge_probe_surface(stage['edge_probe'], metrics)
+        return apply_cylinder_autolevel.autolevel(lines, probe_f, probe_dim, progress, stats,
+                                                  stage['arc_tolerance'], edge_probe_f, batch_size)
+    if name == 'widen_holes':
+        import widen_holes
+        return widen_holes.widen(lines, stage['old_diameter'], stage['new_diameter'], stage['feed'],
+                                 stage['pitch'], stage['top'], True, progress, stats)
+    if name == 'unwind':
+        import unwind_a_axis
+        return unwind_a_axis.unwind(lines, stage['g92'], stage['a_rapid'], progress, stats)
+
+
+def load_probe(filename, inputs, use_key, metrics):
+    # Z probe surface for a generator, at the nominal outer radius
+    if not inputs[use_key]:
+        return None, None
+    import probe
+    return probe.load_probe_surface(filename, inputs['outer_diameter']/2.0, metrics)
+
+
+def timed_lines(lines, times, name):
+    # Passes the lines on, adding the time spent getting each one to
+    # times[name]. This includes the stages before it.
+    perf_counter = time.perf_counter
+    lines = iter(lines)
+    while True:
+        start = perf_counter()
+        try:
+            line = next(lines)
+        except StopIteration:
+            times[name] += perf_counter() - start
+            return
+        times[name] += perf_counter() - start
+        yield line
+
+
+def main(argv):
+    job_filename = 'pipeline.inputs'
+    timing = False
+    quiet = False
+    metrics = rotary_axis_cam.Metrics('pipeline')
+
+    try:
+        opts, args = getopt.getopt(argv, "h", ['job=', 'timing', 'quiet'] + rotary_axis_cam.metrics_options)
+    except getopt.GetoptError:
+        print(usage)
+        sys.exit(1)
+
+    for opt, arg in opts:
+        if opt == '-h':
+            print(usage)
+            sys.exit()
+        if opt == '--job':
+            job_filename = arg
+        if opt == '--timing':
+            timing = True
+        if opt == '--quiet':
+            quiet = True
+        metrics.parse_option(opt, arg)
+
+    metrics.stage('read_inputs')
+    if not os.path.isfile(job_filename):
+        print('Job file not found:', job_filename, '\nExiting!')
+        sys.exit(1)
+    job = rotary_axis_cam.read_inputs_file(job_filename, {'pipeline_inputs': pipeline_inputs, 'stages': stages})
+    try:
+        job_inputs, job_stages = check_stages(job['pipeline_inputs'], job['stages'])
+    except ValueError as error:
+        print(str(error) + '\nExiting!')
+        sys.exit(1)
+    timing = timing or job_inputs['timing']
+    print('Stages:', ' -> '.join(stage['stage'] for stage in job_stages))
+
+    # Chain the stages, nothing runs until the output is written
+    metrics.stage('setup')
+    times = {}
+    lines = None
+    progress = None
+    input_file = None
+    if job_inputs['input'] is not None:
+        try:
+            input_file = rotary_axis_cam.open_file(job_inputs['input'], 'r')
+        except IOError:
+            print('Error reading input file!\nExiting')
+            sys.exit(1)
+        progress = rotary_axis_cam.Progress(input_file, quiet)
+        input_progress = progress
+        lines = input_file
+        if timing:
+            times['read'] = 0.0
+            lines = timed_lines(lines, times, 'read')
+    stage_stats = []
+    for stage in job_stages:
+        stats = {}
+        try:
+            lines = stage_lines(stage, lines, progress, stats, metrics)
+        except (IOError, ValueError) as error:
+            print('Error setting up {}: {}\nExiting!'.format(stage['stage'], error))
+            sys.exit(1)
+        # Only the first stage reads the file
+        progress = None
+        if stage['stage'] in generator_stages:
+            # Generators can yield empty lines (e.g. an air rapid with no
+            # move left), the modifiers expect file lines
+            lines = (line for line in lines if line)
+        if timing:
+            name = '{:d} {}'.format(len(stage_stats) + 1, stage['stage'])
+            times[name] = 0.0
+            lines = timed_lines(lines, times, name)
+        stage_stats.append(stats)
+
+    # Run
+    metrics.stage('run')
+    print('\nWriting Gcode to:', job_inputs['output'])
+    output_file = rotary_axis_cam.open_file(job_inputs['output'], 'w')
+    start = time.perf_counter()
+    try:
+        output_file.writelines(lines)
+    except ValueError as error:
+        output_file.close()
+        print(str(error) + '\nExiting!')
+        sys.exit(1)
+    run_time = time.perf_counter() - start
+    if input_file is not None and 'lines_read' in stage_stats[0]:
+        input_progress.finish(stage_stats[0]['lines_read'])
+
+    metrics.stage('close_files')
+    if input_file is not None:
+        input_file.close()
+    output_file.close()
+
+    for stage, stats in zip(job_stages, stage_stats):
+        if 'lines_read' in stats:
+            print('{}: {:d} lines read'.format(stage['stage'], stats['lines_read']))
+        if 'total_time' in stats:
+            print('{}: Machining Time Required: {:4.0f} mins'.format(stage['stage'], stats['total_time']))
+    if timing:
+        # Each timer includes the stages before it
+        print('\nStage Times')
+        previous = 0.0
+        for name, value in times.items():
+            print('  {:24s} {:9.4f} s'.format(name, value - previous))
+            previous = value
+        print('  {:24s} {:9.4f} s'.format('write', run_time - previous))
+        print('  {:24s} {:9.4f} s'.format('total', run_time))
+
+    metrics.finish()
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
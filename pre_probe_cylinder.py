@@ -9,6 +9,13 @@ import rotary_axis_cam
 #   1) The center of the cylinder is along the Y=0, Z=0 axis
 #   2) X = 0 is the start of the cylinder
 
+# Can also be used as a module:
+#   import pre_probe_cylinder
+#   job_inputs = pre_probe_cylinder.check_inputs({'outer_diameter': 6.0, 'num_x_points': 1,
+#                                                 'num_a_points': 24, 'start_x': -1.0, 'end_x': -1.0})
+#   for line in pre_probe_cylinder.pre_probe(job_inputs):
+#       ...
+
 script_inputs_file = './pre_probe_cylinder.inputs'
 pre_probe_inputs = {
     'outer_diameter' : None,
@@ -22,86 +29,121 @@ pre_probe_inputs = {
     'output_file': None,
 }
 
-if os.path.isfile(script_inputs_file):
-    print('Input file exists, loading inputs file\n')
-    exec(open(script_inputs_file).read())
-else:
-    # Write inputs file
-    try:
-        outputfile = open(script_inputs_file, 'w')
-    except IOError:
-        print('Cannot open', script_inputs_file, '\nExiting!')
-    print('Writing input values to:', script_inputs_file)
-    outputfile.write('pre_probe_inputs = {\n')
-    rotary_axis_cam.write_dict(outputfile, pre_probe_inputs)
-    outputfile.close()
-    print('Update pre_probe_cylinder.inputs and re-run')
-    sys.exit()
-
-
-print('Creating pre-probe G-code file')
-total_points = pre_probe_inputs['num_a_points']*pre_probe_inputs['num_x_points']
-outer_radius = pre_probe_inputs['outer_diameter']/2.0
-safe_z_height = outer_radius + pre_probe_inputs['safe_clearance']
-probe_min_z = outer_radius + pre_probe_inputs['min_probe_depth']
-
-if pre_probe_inputs['num_x_points'] < 1:
-    print('\nInvalid number of X points\nExiting!')
-    sys.exit(1)
-if pre_probe_inputs['num_x_points'] == 1:
-    delta_x = 0
-else:
-    delta_x = (pre_probe_inputs['end_x'] - pre_probe_inputs['start_x'])/(pre_probe_inputs['num_x_points']-1)
-delta_a = 360.0/pre_probe_inputs['num_a_points']
-
-print('Number of X Points: {:3d}'.format(pre_probe_inputs['num_x_points']))
-print('Number of A Points: {:3d}'.format(pre_probe_inputs['num_a_points']))
-print('Total Number of Points {:3d}'.format(total_points))
-
-
-# Open Output File
-if pre_probe_inputs['output_file'] is None:
+
+def check_inputs(job_inputs):
+    # Returns a complete copy of the inputs (defaults for anything not
+    # given). Raises ValueError for invalid inputs.
+    checked_inputs = dict(pre_probe_inputs)
+    checked_inputs.update(job_inputs)
+
+    for name in ['outer_diameter', 'num_x_points', 'num_a_points', 'start_x', 'end_x']:
+        if checked_inputs[name] is None:
+            raise ValueError('Missing value for ' + name)
+    if checked_inputs['num_x_points'] < 1:
+        raise ValueError('Invalid number of X points')
+
+    return checked_inputs
+
+
+def output_filename(job_inputs):
+    if job_inputs['output_file'] is not None:
+        return job_inputs['output_file']
+
     # Autocreate filename
-    output_filename = 'pre_probe_'
-    output_filename += str(pre_probe_inputs['outer_diameter']) + '_od'
-    output_filename += '.nc'
-else:
-    output_filename = pre_probe_inputs['output_file']
-print('\nWriting Gcode to:', output_filename)
-output_file = open(output_filename,'w')
-
-
-# Write Header
-output_file.write('(G-code automatically written using pre_probe_cylinder.py)\n')
-output_file.write('(Outer Diameter: {:4.2f})\n'.format(pre_probe_inputs['outer_diameter']))
-output_file.write('(Total Number of points to Probe: {:4d})\n'.format(total_points))
-output_file.write('G90   (set absolute distance mode)\n')
-output_file.write('G90.1 (set absolute distance mode for arc centers)\n')
-output_file.write('G17   (set active plane to XY)\n')
-output_file.write('G20   (set units to inches)\n')
-output_file.write('\n')
-
-output_file.write('M0 (Attach probe wires and clips that need attaching)\n')
-output_file.write('M40 (Open probe file)\n')
-output_file.write('\n')
-
-# Position at Start
-output_file.write('G0 Z {:5.4f} (Safe Z height)\n'.format(safe_z_height))
-output_file.write('G0 Y 0.0000\n')
-
-for i in range(pre_probe_inputs['num_x_points']):
-    x = pre_probe_inputs['start_x'] + i*delta_x
-    output_file.write('(X={:5.4f})\n'.format(x))
-    for j in range(pre_probe_inputs['num_a_points']):
-        a = j*delta_a
+    filename = 'pre_probe_'
+    filename += str(job_inputs['outer_diameter']) + '_od'
+    filename += '.nc'
+
+    return filename
+
+
+def pre_probe(pre_probe_inputs):
+    # Yields the G-code lines for probing the X by A grid. pre_probe_inputs
+    # come from check_inputs.
+    total_points = pre_probe_inputs['num_a_points']*pre_probe_inputs['num_x_points']
+    outer_radius = pre_probe_inputs['outer_diameter']/2.0
+    safe_z_height = outer_radius + pre_probe_inputs['safe_clearance']
+    probe_min_z = outer_radius + pre_probe_inputs['min_probe_depth']
+
+    if pre_probe_inputs['num_x_points'] == 1:
+        delta_x = 0
+    else:
+        delta_x = (pre_probe_inputs['end_x'] - pre_probe_inputs['start_x'])/(pre_probe_inputs['num_x_points']-1)
+    delta_a = 360.0/pre_probe_inputs['num_a_points']
+
+    # Write Header
+    yield '(G-code automatically written using pre_probe_cylinder.py)\n'
+    yield '(Outer Diameter: {:4.2f})\n'.format(pre_probe_inputs['outer_diameter'])
+    yield '(Total Number of points to Probe: {:4d})\n'.format(total_points)
+    yield 'G90   (set absolute distance mode)\n'
+    yield 'G90.1 (set absolute distance mode for arc centers)\n'
+    yield 'G17   (set active plane to XY)\n'
+    yield 'G20   (set units to inches)\n'
+    yield '\n'
+
+    yield 'M0 (Attach probe wires and clips that need attaching)\n'
+    yield 'M40 (Open probe file)\n'
+    yield '\n'
+
+    # Position at Start
+    yield 'G0 Z {:5.4f} (Safe Z height)\n'.format(safe_z_height)
+    yield 'G0 Y 0.0000\n'
+
+    for i in range(pre_probe_inputs['num_x_points']):
         x = pre_probe_inputs['start_x'] + i*delta_x
-        output_file.write('G0 X {:5.4f} A {:5.3f}\n'.format(x,a))
-        output_file.write('G31 Z {:5.4f} F {:2.1f}\n'.format(probe_min_z,pre_probe_inputs['probe_feedrate']))
-        output_file.write('G0 Z {:5.4f}\n'.format(safe_z_height))
+        yield '(X={:5.4f})\n'.format(x)
+        for j in range(pre_probe_inputs['num_a_points']):
+            a = j*delta_a
+            x = pre_probe_inputs['start_x'] + i*delta_x
+            yield 'G0 X {:5.4f} A {:5.3f}\n'.format(x,a)
+            yield 'G31 Z {:5.4f} F {:2.1f}\n'.format(probe_min_z,pre_probe_inputs['probe_feedrate'])
+            yield 'G0 Z {:5.4f}\n'.format(safe_z_height)
+
+    # Complete File
+    yield '\nM41 (Closes the opened log file)\n'
+    yield 'M30\n'
+
+
+def main(argv):
+    metrics = rotary_axis_cam.metrics_from_argv('pre_probe_cylinder', argv)
+    metrics.stage('read_inputs')
+
+    defaults = {'pre_probe_inputs': pre_probe_inputs}
+    if os.path.isfile(script_inputs_file):
+        print('Input file exists, loading inputs file\n')
+        job = rotary_axis_cam.read_inputs_file(script_inputs_file, defaults)
+    else:
+        # Write inputs file
+        rotary_axis_cam.write_inputs_file(script_inputs_file, defaults)
+        print('Update pre_probe_cylinder.inputs and re-run')
+        sys.exit()
+
+    print('Creating pre-probe G-code file')
+    try:
+        job_inputs = check_inputs(job['pre_probe_inputs'])
+    except ValueError as error:
+        print('\n' + str(error) + '\nExiting!')
+        sys.exit(1)
+
+    total_points = job_inputs['num_a_points']*job_inputs['num_x_points']
+    print('Number of X Points: {:3d}'.format(job_inputs['num_x_points']))
+    print('Number of A Points: {:3d}'.format(job_inputs['num_a_points']))
+    print('Total Number of Points {:3d}'.format(total_points))
+
+    # Open Output File
+    metrics.stage('generate')
+    filename = output_filename(job_inputs)
+    print('\nWriting Gcode to:', filename)
+    output_file = rotary_axis_cam.open_file(filename,'w')
+    output_file.writelines(pre_probe(job_inputs))
+
+    # Close File
+    metrics.stage('close_files')
+    output_file.close()
+    metrics.count('bytes_written', os.path.getsize(filename))
+
+    metrics.finish()
 
 
-# Complete File
-output_file.write('\nM41 (Closes the opened log file)\n')
-output_file.write('M30\n')
-# Close File
-output_file.close()
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -9,6 +9,9 @@ import rotary_axis_cam
 #   1) The center of the cylinder is along the Y=0, Z=0 axis
 #   2) X = 0 is the start of the cylinder
 
+metrics = rotary_axis_cam.metrics_from_argv('pre_probe_cylinder_edge', sys.argv[1:])
+metrics.stage('read_inputs')
+
 script_inputs_file = './pre_probe_cylinder_edge.inputs'
 pre_probe_inputs = {
     'outer_diameter' : None,
@@ -57,8 +60,9 @@ if pre_probe_inputs['output_file'] is None:
     output_filename += '.nc'
 else:
     output_filename = pre_probe_inputs['output_file']
+metrics.stage('generate')
 print('\nWriting Gcode to:', output_filename)
-output_file = open(output_filename,'w')
+output_file = rotary_axis_cam.open_file(output_filename,'w')
 
 
 # Write Header
@@ -97,5 +101,9 @@ output_file.write('G0 Z {:5.4f} (Safe Z height)\n'.format(safe_z_height))
 # Complete File
 output_file.write('\nM41 (Closes the opened log file)\n')
 output_file.write('M30\n')
+metrics.stage('close_files')
 # Close File
 output_file.close()
+metrics.count('bytes_written', os.path.getsize(output_filename))
+
+metrics.finish()
@@ -2,9 +2,12 @@
 import os
 import sys
 import numpy as np
-import matplotlib.pyplot as plt
 
 import probe
+import rotary_axis_cam
+
+metrics = rotary_axis_cam.metrics_from_argv('pre_probe_cylinder_plot', sys.argv[1:])
+metrics.stage('read_inputs')
 
 pre_probe_inputs = {
     'probe_filename': 'probe_results.txt',
@@ -24,6 +27,7 @@ else:
     print('No pre_probe_cylinder.inputs file found. Using defaults')
 
 # Read in cylinder probe data
+metrics.stage('read_probe')
 probe_num_X, probe_num_A, probe_X, probe_Z, probe_A = probe.read_cylinder_probe_file(pre_probe_inputs['probe_filename'])
 probe_X_values = np.unique(probe_X)
 probe_Z_values = np.unique(probe_Z)
@@ -47,6 +51,11 @@ else:
     print('Probe Data does not match known dimensions.\nExiting!')
     sys.exit(1)
 
+# Only load matplotlib once there is valid data to plot
+metrics.stage('import_matplotlib')
+import matplotlib.pyplot as plt
+metrics.stage('plot')
+
 if probe_type == 'Z':
 
     # Check for R_ref
@@ -119,3 +128,5 @@ elif probe_type == 'X':
     fig.legend()
 
     plt.savefig('probe_edge.png', dpi=150)
+
+metrics.finish()
@@ -1,12 +1,23 @@
 # Probe Module
 
+import io
 import sys
+import math
+import collections
 import numpy as np
-from scipy import interpolate
+
+import rotary_axis_cam
 
 def read_cylinder_probe_file(filename):
 
-    X, Y, Z, A = np.loadtxt(filename, unpack=True)
+    probe_file = rotary_axis_cam.open_file(filename)
+    probe_text = probe_file.read()
+    probe_file.close()
+    # Files written directly by the M40 macro have lettered values
+    # (X-3.0003 Y-0.0001 Z6.3715 A0.000), strip the letters
+    if 'X' in probe_text:
+        probe_text = probe_text.translate(str.maketrans('', '', 'XYZA'))
+    X, Y, Z, A = np.loadtxt(io.StringIO(probe_text), unpack=True)
     X_values = np.unique(X)
     num_X = X_values.size
     Z_values = np.unique(Z)
@@ -43,13 +54,77 @@ def read_cylinder_probe_file(filename):
     return num_X, num_A, X_final, Z_final, A_final
 
 
-def setup_interpolation(X, A, Z, probe_dim):
+def load_probe_surface(filename, z_ref, metrics=None):
+    # Reads a Z probe file and sets up the interpolation of the delta Z
+    # (probed Z - z_ref) surface. Returns the interpolation function and
+    # the probe dimension (1: A only, 2: X and A)
+    probe_num_X, probe_num_A, probe_X, probe_Z, probe_A = read_cylinder_probe_file(filename)
+    probe_X_values = np.unique(probe_X)
+    probe_A_values = np.unique(probe_A)
+
+    # Check Probe Data dimensions
+    probe_dim = None
+    if probe_X_values.size == 1:
+        print('Probe Data is 2D (A and Z)')
+        probe_dim = 1
+    else:
+        print('Probe Data is 3D (X, A and Z)')
+        probe_dim = 2
+
+    # Convert Z to delta Z map
+    dZ = probe_Z - z_ref
+
+    dZ_min = np.min(dZ)
+    dZ_max = np.max(dZ)
+    print('  dZ Min: {:5.4f}'.format(dZ_min))
+    print('  dZ Max: {:5.4f}'.format(dZ_max))
+
+    probe_f = setup_interpolation(probe_X_values, probe_A_values, dZ, probe_dim, metrics)
+
+    return probe_f, probe_dim
+
+
+def load_edge_probe_surface(filename, metrics=None):
+    # Reads an X edge probe file (pre_probe_cylinder_edge.py) and sets up the
+    # interpolation of the edge X location vs A. Raises ValueError if the
+    # file isn't a single Z height.
+    probe_num_X, probe_num_A, probe_X, probe_Z, probe_A = read_cylinder_probe_file(filename)
+    probe_X_values = np.unique(probe_X)
+    probe_Z_values = np.unique(probe_Z)
+    probe_A_values = np.unique(probe_A)
+
+    # Check Probe Data dimensions
+    if probe_Z_values.size == 1:
+        print('Probe Data is 2D (A and X)')
+    else:
+        raise ValueError('Bad Probe Dimensions.')
+
+    dX_min = np.min(probe_X_values)
+    dX_max = np.max(probe_X_values)
+    print('  dX Min: {:5.4f}'.format(dX_min))
+    print('  dX Max: {:5.4f}'.format(dX_max))
+
+    return setup_interpolation(probe_Z_values, probe_A_values, probe_X, 1, metrics)
+
+
+def setup_interpolation(X, A, Z, probe_dim, metrics=None):
+    # scipy is only loaded once a probe surface is actually needed, so
+    # constant depth jobs don't pay for the import
+    if metrics is not None:
+        metrics.stage('import_scipy')
+    from scipy import interpolate
+
+    if metrics is not None:
+        metrics.stage('spline_fit')
+
     if probe_dim == 1:
         print('\nInterpolating Probe Data in A axis only')
         f = interpolate.interp1d(A, Z)
     elif probe_dim == 2:
         print('\nInterpolating Probe Data in X and A axes')
         f = interpolate.RectBivariateSpline(X, A, Z)
+        if metrics is not None:
+            metrics.stage('interpolation_check')
         max_error, avg_error = interpolation_check(f, X, A, Z)
         print('  Max Error: {:5.4e}'.format(max_error))
     
@@ -75,3 +150,417 @@ def interpolation_check(probe_f, X_values, A_values, Z_values):
     
     return max_error, avg_error
     
+
+
+
+# Harmonic runout model
+def harmonic_columns(X, A, harmonics, degree, x_center=0.0, x_scale=1.0):
+    # Least squares design matrix, one row per point: X^p, X^p cos(kA) and
+    # X^p sin(kA) for p up to degree and k up to harmonics. X is scaled to
+    # about -1 to 1 to keep the fit well conditioned.
+    X_scaled = (np.asarray(X, dtype=float) - x_center)/x_scale
+    A_rad = np.radians(np.asarray(A, dtype=float))
+    columns = []
+    for p in range(degree + 1):
+        X_power = X_scaled**p
+        columns.append(X_power + 0.0*A_rad)
+        for k in range(1, harmonics + 1):
+            columns.append(X_power*np.cos(k*A_rad))
+            columns.append(X_power*np.sin(k*A_rad))
+
+    return np.stack(columns, axis=-1)
+
+
+class AnalyticSurface:
+    # Base for the fitted delta Z models (HarmonicSurface, CylinderSurface).
+    # Subclasses provide value(x, A) for one point and evaluate(X, A) for
+    # arrays. Called the same way as the spline for its probe_dim,
+    # probe_f(A) for 1 and probe_f(X, A) or probe_f(X, A, grid=False) for 2,
+    # so a model can be used in place of it.
+
+    def __call__(self, *args, grid=True):
+        if self.probe_dim == 1:
+            if isinstance(args[0], (int, float)):
+                return np.array([self.value(0.0, args[0])])
+            A = np.asarray(args[0], dtype=float)
+            return self.evaluate(0.0, A)[None]
+        if isinstance(args[0], (int, float)) and isinstance(args[1], (int, float)):
+            return np.array([[self.value(args[0], args[1])]])
+        X = np.asarray(args[0], dtype=float)
+        A = np.asarray(args[1], dtype=float)
+        if grid:
+            X, A = np.meshgrid(np.atleast_1d(X), np.atleast_1d(A), indexing='ij')
+        return self.evaluate(X, A)
+
+
+class HarmonicSurface(AnalyticSurface):
+    # Delta Z as a truncated Fourier series in A, each coefficient a
+    # polynomial in X (fit_harmonic_surface). The coefficients are in the
+    # harmonic_columns order.
+
+    def __init__(self, coefficients, harmonics, degree, probe_dim, x_center=0.0, x_scale=1.0):
+        self.coefficients = coefficients
+        self.harmonics = harmonics
+        self.degree = degree
+        self.probe_dim = probe_dim
+        self.x_center = x_center
+        self.x_scale = x_scale
+        # One row per term (1, cos A, sin A, cos 2A, ...), highest power of
+        # X first for Horner's rule
+        terms = np.reshape(coefficients, (degree + 1, 2*harmonics + 1)).T
+        self.term_coefficients = terms[:,::-1].tolist()
+        self.last_x = None
+        self.amplitudes = None
+
+    def terms(self, A_rad, cos, sin):
+        # 1, cos A, sin A, cos 2A, sin 2A, ... using the angle sum recurrence
+        cos_1 = cos(A_rad)
+        sin_1 = sin(A_rad)
+        terms = [1.0 + 0.0*cos_1, cos_1, sin_1]
+        cos_k = cos_1
+        sin_k = sin_1
+        for k in range(2, self.harmonics + 1):
+            cos_k, sin_k = cos_k*cos_1 - sin_k*sin_1, sin_k*cos_1 + cos_k*sin_1
+            terms.append(cos_k)
+            terms.append(sin_k)
+        return terms[:2*self.harmonics + 1]
+
+    def value(self, x, A):
+        # Single point without numpy. The X polynomials are only evaluated
+        # again when X changes (e.g. not along a circle).
+        if x != self.last_x:
+            x_scaled = (x - self.x_center)/self.x_scale
+            amplitudes = []
+            for coefficients in self.term_coefficients:
+                polynomial = 0.0
+                for c in coefficients:
+                    polynomial = polynomial*x_scaled + c
+                amplitudes.append(polynomial)
+            self.last_x = x
+            self.amplitudes = amplitudes
+        amplitudes = self.amplitudes
+        A_rad = math.radians(A)
+        cos_1 = math.cos(A_rad)
+        sin_1 = math.sin(A_rad)
+        cos_k = 1.0
+        sin_k = 0.0
+        value = amplitudes[0]
+        for k in range(1, self.harmonics + 1):
+            cos_k, sin_k = cos_k*cos_1 - sin_k*sin_1, sin_k*cos_1 + cos_k*sin_1
+            value += amplitudes[2*k - 1]*cos_k
+            value += amplitudes[2*k]*sin_k
+        return value
+
+    def evaluate(self, X, A):
+        X_scaled = (np.asarray(X, dtype=float) - self.x_center)/self.x_scale
+        A_rad = np.radians(np.asarray(A, dtype=float))
+        value = 0.0
+        for term, coefficients in zip(self.terms(A_rad, np.cos, np.sin), self.term_coefficients):
+            polynomial = coefficients[0]
+            for c in coefficients[1:]:
+                polynomial = polynomial*X_scaled + c
+            value = value + polynomial*term
+        return value + 0.0*X_scaled
+
+
+def fit_harmonic_surface(X, A, Z, probe_dim, harmonics, degree):
+    # Linear least squares fit of a HarmonicSurface to the probe points.
+    # Returns the surface and the residual (fit - probed) at every point.
+    X = np.ravel(X)
+    A = np.ravel(A)
+    Z = np.ravel(Z)
+    if probe_dim == 1:
+        degree = 0
+    x_center = 0.5*(X.max() + X.min())
+    x_scale = max(0.5*(X.max() - X.min()), 1.0e-9)
+    columns = harmonic_columns(X, A, harmonics, degree, x_center, x_scale)
+    coefficients = np.linalg.lstsq(columns, Z, rcond=None)[0]
+    surface = HarmonicSurface(coefficients, harmonics, degree, probe_dim, x_center, x_scale)
+
+    return surface, columns @ coefficients - Z
+
+
+def load_harmonic_surface(filename, z_ref, harmonics=None, degree=2, tolerance=0.0005, metrics=None):
+    # Reads a Z probe file and fits a harmonic runout model to the delta Z
+    # (probed Z - z_ref), a fast alternative to the spline. Without
+    # harmonics, the fewest harmonics that fit every probe point within the
+    # tolerance are used. Prints the residuals, the largest difference from
+    # the spline (load_probe_surface) and how many equally spaced probe
+    # angles the model needs. Returns the surface and the probe dimension.
+    probe_num_X, probe_num_A, probe_X, probe_Z, probe_A = read_cylinder_probe_file(filename)
+    probe_X_values = np.unique(probe_X)
+    probe_A_values = np.unique(probe_A)
+    probe_dim = 1 if probe_X_values.size == 1 else 2
+    degree = min(degree, probe_X_values.size - 1)
+    dZ = probe_Z - z_ref
+
+    # The 360 degree column is a copy of 0
+    X = probe_X[:,:-1]
+    A = probe_A[:,:-1]
+    dZ_points = dZ[:,:-1]
+    max_harmonics = (probe_num_A - 1)//2
+    if max_harmonics == 0:
+        raise ValueError('harmonic surface needs at least 3 probe angles')
+    if metrics is not None:
+        metrics.stage('harmonic_fit')
+    if harmonics is None:
+        for harmonics in range(1, max_harmonics + 1):
+            surface, residual = fit_harmonic_surface(X, A, dZ_points, probe_dim, harmonics, degree)
+            if np.max(np.abs(residual)) <= tolerance:
+                break
+    else:
+        harmonics = min(harmonics, max_harmonics)
+        surface, residual = fit_harmonic_surface(X, A, dZ_points, probe_dim, harmonics, degree)
+
+    print('\nHarmonic Model: {:d} harmonics, X degree {:d} ({:d} coefficients)'.format(
+        harmonics, surface.degree, surface.coefficients.size))
+    print('  Residual Max: {:5.4e}'.format(np.max(np.abs(residual))))
+    print('  Residual RMS: {:5.4e}'.format(np.sqrt(np.mean(residual**2))))
+    if np.max(np.abs(residual)) > tolerance:
+        print('  Residual is above the tolerance ({:5.4f}), the spline may be needed'.format(tolerance))
+
+    # Fewest equally spaced angles (every step-th probed angle) that give the
+    # same model, within the tolerance at all the probe points
+    angles_needed = probe_num_A
+    for step in range(probe_num_A//(2*harmonics + 1), 1, -1):
+        if probe_num_A % step != 0:
+            continue
+        subset, subset_residual = fit_harmonic_surface(X[:,::step], A[:,::step], dZ_points[:,::step],
+                                                       probe_dim, harmonics, degree)
+        if np.max(np.abs(subset.evaluate(X, A) - surface.evaluate(X, A))) <= tolerance:
+            angles_needed = probe_num_A//step
+            break
+    print('  Probe Angles Needed: {:d} of {:d}'.format(angles_needed, probe_num_A))
+
+    # Compare with the spline on a fine grid
+    spline_f = setup_interpolation(probe_X_values, probe_A_values, dZ, probe_dim, metrics)
+    A_check = np.linspace(0.0, 360.0, 361)
+    if probe_dim == 1:
+        difference = surface(A_check)[0] - spline_f(A_check)[0]
+    else:
+        X_check = np.linspace(probe_X_values[0], probe_X_values[-1], 4*probe_X_values.size)
+        difference = surface(X_check, A_check) - spline_f(X_check, A_check)
+    print('  Max Difference from Spline: {:5.4e}'.format(np.max(np.abs(difference))))
+
+    return surface, probe_dim
+
+
+# Best fit cylinder
+def cylinder_z(parameters, X, A, x_center=0.0):
+    # Probed Z (top of the stock) of a cylinder whose axis is off the A axis.
+    # parameters are the radius, the axis offset (Y, Z at A 0) at x_center
+    # and the axis tilt (change in the offset per unit of X).
+    radius, offset_y, offset_z, tilt_y, tilt_z = parameters
+    A_rad = np.radians(A)
+    cos_A = np.cos(A_rad)
+    sin_A = np.sin(A_rad)
+    dX = np.asarray(X, dtype=float) - x_center
+    axis_y = offset_y + tilt_y*dX
+    axis_z = offset_z + tilt_z*dX
+    # Axis location once the stock is rotated to A
+    y = axis_y*cos_A - axis_z*sin_A
+    z = axis_z*cos_A + axis_y*sin_A
+
+    return z + np.sqrt(np.maximum(radius**2 - y**2, 0.0))
+
+
+class CylinderSurface(AnalyticSurface):
+    # Delta Z (cylinder_z - z_ref) of the best fit cylinder
+    # (fit_cylinder_surface), stock mounted off center and/or tilted
+    # relative to the A axis.
+
+    def __init__(self, parameters, probe_dim, x_center=0.0, z_ref=0.0):
+        self.parameters = [float(p) for p in parameters]
+        self.radius, self.offset_y, self.offset_z, self.tilt_y, self.tilt_z = self.parameters
+        self.probe_dim = probe_dim
+        self.x_center = x_center
+        self.z_ref = z_ref
+
+    def value(self, x, A):
+        # Single point without numpy
+        A_rad = math.radians(A)
+        cos_A = math.cos(A_rad)
+        sin_A = math.sin(A_rad)
+        dX = x - self.x_center
+        axis_y = self.offset_y + self.tilt_y*dX
+        axis_z = self.offset_z + self.tilt_z*dX
+        y = axis_y*cos_A - axis_z*sin_A
+        z = axis_z*cos_A + axis_y*sin_A
+        return z + math.sqrt(max(self.radius**2 - y*y, 0.0)) - self.z_ref
+
+    def evaluate(self, X, A):
+        A = np.asarray(A, dtype=float)
+        X = np.broadcast_to(np.asarray(X, dtype=float), A.shape)
+        return cylinder_z(self.parameters, X, A, self.x_center) - self.z_ref
+
+
+def fit_cylinder_surface(X, A, Z, probe_dim, z_ref=0.0):
+    # Least squares fit of a cylinder (radius, axis offset and tilt) to the
+    # probe points. The tilt is only fit for 3D probe data. The small offset
+    # linear model (Z = R + offset_z cos A + offset_y sin A) is the starting
+    # point. Returns the CylinderSurface and the residual (fit - probed) at
+    # every point.
+    from scipy import optimize
+
+    X = np.ravel(X)
+    A = np.ravel(A)
+    Z = np.ravel(Z)
+    x_center = 0.5*(X.max() + X.min())
+    A_rad = np.radians(A)
+    dX = X - x_center
+    columns = [np.ones(A.size), np.sin(A_rad), np.cos(A_rad)]
+    if probe_dim == 2:
+        columns += [dX*np.sin(A_rad), dX*np.cos(A_rad)]
+    start = np.linalg.lstsq(np.stack(columns, axis=-1), Z, rcond=None)[0]
+    num_free = start.size
+
+    def residual(free):
+        parameters = np.append(free, np.zeros(5 - num_free))
+        return cylinder_z(parameters, X, A, x_center) - Z
+
+    fit = optimize.least_squares(residual, start)
+    parameters = np.append(fit.x, np.zeros(5 - num_free))
+    surface = CylinderSurface(parameters, probe_dim, x_center, z_ref)
+
+    return surface, residual(fit.x)
+
+
+def load_cylinder_surface(filename, z_ref, tolerance=0.0005, metrics=None):
+    # Reads a Z probe file and fits the stock's true axis (offset and tilt)
+    # and radius. Prints the fit and the residual at the probe points, if it
+    # is above the tolerance the part isn't a cylinder on a shifted axis
+    # (e.g. bent or out of round) and the spline is still needed. Returns
+    # the surface and the probe dimension.
+    probe_num_X, probe_num_A, probe_X, probe_Z, probe_A = read_cylinder_probe_file(filename)
+    probe_dim = 1 if np.unique(probe_X).size == 1 else 2
+    if metrics is not None:
+        metrics.stage('cylinder_fit')
+    # The 360 degree column is a copy of 0
+    surface, residual = fit_cylinder_surface(probe_X[:,:-1], probe_A[:,:-1], probe_Z[:,:-1], probe_dim, z_ref)
+
+    # Offsets as a size and the A of the high side, so they don't depend on
+    # the A direction
+    print('\nCylinder Fit')
+    print('  Radius: {:5.4f} (z_ref {:5.4f})'.format(surface.radius, z_ref))
+    print('  Axis Offset: {:5.4f} at A {:5.1f} (X {:5.4f})'.format(
+        math.hypot(surface.offset_y, surface.offset_z),
+        math.degrees(math.atan2(surface.offset_y, surface.offset_z)) % 360.0, surface.x_center))
+    if probe_dim == 2:
+        print('  Axis Tilt: {:5.4e} per unit X at A {:5.1f}'.format(
+            math.hypot(surface.tilt_y, surface.tilt_z),
+            math.degrees(math.atan2(surface.tilt_y, surface.tilt_z)) % 360.0))
+    print('  Residual Max: {:5.4e}'.format(np.max(np.abs(residual))))
+    print('  Residual RMS: {:5.4e}'.format(np.sqrt(np.mean(residual**2))))
+    if np.max(np.abs(residual)) > tolerance:
+        print('  Residual is above the tolerance ({:5.4f}), the spline is still needed'.format(tolerance))
+    else:
+        print('  Residual is within the tolerance ({:5.4f}), the spline isn\'t needed'.format(tolerance))
+
+    return surface, probe_dim
+
+
+class ProbeSurface:
+    # Delta Z surface (from load_probe_surface) with one interface for both
+    # probe dimensions. Arrays of points are evaluated in one call
+    # (evaluate), or a whole X by A table at once (precompute_grid).
+    #
+    # Single points (calling the surface) go through an LRU cache keyed on X
+    # and A rounded to resolution_x (in) and resolution_a (deg), so points
+    # that repeat (e.g. the same X/A on every depth pass) are only
+    # evaluated once. The first value found for a key is used for it.
+
+    def __init__(self, probe_f, probe_dim, cache_size=65536, resolution_x=1.0e-5, resolution_a=1.0e-4):
+        self.probe_f = probe_f
+        self.probe_dim = probe_dim
+        self.cache_size = cache_size
+        self.resolution_x = resolution_x
+        self.resolution_a = resolution_a
+        self.cache = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def key(self, x, A):
+        if self.probe_dim == 1 or x is None:
+            return (0, int(round(A/self.resolution_a)))
+        return (int(round(x/self.resolution_x)), int(round(A/self.resolution_a)))
+
+    def __call__(self, x, A):
+        # Delta Z at one point, x is ignored for an A only surface
+        key = self.key(x, A)
+        value = self.cache.get(key)
+        if value is not None:
+            self.hits += 1
+            self.cache.move_to_end(key)
+            return value
+        self.misses += 1
+        if self.probe_dim == 1:
+            value = float(self.probe_f(A)[0])
+        else:
+            value = float(self.probe_f(x, A)[0,0])
+        self.store(key, value)
+
+        return value
+
+    def store(self, key, value):
+        self.cache[key] = value
+        if len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+            self.evictions += 1
+
+    def evaluate(self, X, A):
+        # Delta Z at arrays of points (X can be a single value)
+        A = np.asarray(A, dtype=float)
+        if self.probe_dim == 1:
+            return self.probe_f(A)[0]
+        X = np.broadcast_to(np.asarray(X, dtype=float), A.shape)
+        return self.probe_f(X, A, grid=False)
+
+    def precompute_grid(self, X_values, A_values):
+        # Delta Z table (len(X_values) x len(A_values)) for every combination,
+        # evaluated in one call and loaded into the cache
+        X_values = np.nan_to_num(np.asarray(X_values, dtype=float))
+        A_values = np.asarray(A_values, dtype=float)
+        X, A = np.meshgrid(X_values, A_values, indexing='ij')
+        table = self.evaluate(X.ravel(), A.ravel()).reshape(X.shape)
+        for x, a, value in zip(X.ravel().tolist(), A.ravel().tolist(), table.ravel().tolist()):
+            key = self.key(x, a)
+            if key not in self.cache:
+                self.store(key, value)
+
+        return table
+
+    def status(self):
+        return {
+            'size': len(self.cache),
+            'max_size': self.cache_size,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+        }
+
+
+def max_along_moves(probe_f, probe_dim, X0, A0, X1, A1, step_x=0.05, step_a=2.0, tool_radius=0.0):
+    # Highest delta Z of the surface under each straight X/A move from
+    # (X0, A0) to (X1, A1), e.g. the rapids between holes. Each move is
+    # sampled at least every step_x (in) and step_a (deg), all the moves are
+    # evaluated in one call. A can be outside 0-360 (continuous A). With
+    # tool_radius, the surface is also checked at X +/- tool_radius.
+    X0 = np.asarray(X0, dtype=float)
+    X1 = np.asarray(X1, dtype=float)
+    A0 = np.asarray(A0, dtype=float)
+    A1 = np.asarray(A1, dtype=float)
+    if X0.size == 0:
+        return np.zeros(0)
+    # X isn't known (NaN) for an A only probe surface without x_loc
+    num_steps = max(np.max(np.nan_to_num(np.abs(X1 - X0)))/step_x, np.max(np.abs(A1 - A0))/step_a, 1.0)
+    t = np.linspace(0.0, 1.0, int(math.ceil(num_steps)) + 1)
+    if tool_radius > 0.0:
+        offsets = np.array([-tool_radius, 0.0, tool_radius])
+    else:
+        offsets = np.zeros(1)
+    X = X0[:,None,None] + t[:,None]*(X1 - X0)[:,None,None] + offsets
+    A = np.mod(A0[:,None,None] + t[:,None]*(A1 - A0)[:,None,None], 360.0) + 0.0*offsets
+    dZ = ProbeSurface(probe_f, probe_dim).evaluate(X.ravel(), A.ravel())
+
+    return np.max(dZ.reshape(A.shape[0], -1), axis=1)
@@ -1,3 +1,17 @@
+import io
+import os
+import sys
+import json
+import math
+import time
+import getopt
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows
+    resource = None
+
 # Write dict
 def write_dict(outfile, dict):
     for k, v in dict.items():
@@ -10,3 +24,438 @@ def write_dict(outfile, dict):
     outfile.write('}\n')
  
     return
+
+
+# Inputs files
+def read_inputs_file(filename, defaults):
+    # Runs an .inputs file and returns the input dictionaries it defines.
+    # defaults maps each dictionary name to its default values, the file can
+    # either redefine a whole dictionary or set single entries. A default can
+    # also be a list (e.g. the stages of a pipeline.py job).
+    namespace = {}
+    for name, values in defaults.items():
+        namespace[name] = values.copy()
+    exec(open(filename).read(), namespace)
+
+    return {name: namespace[name] for name in defaults}
+
+
+def write_inputs_file(filename, defaults):
+    # Writes an .inputs file template with the default values
+    try:
+        outputfile = open(filename, 'w')
+    except IOError:
+        print('Cannot open', filename, '\nExiting!')
+        sys.exit(1)
+    print('Writing input values to:', filename)
+    for name, values in defaults.items():
+        outputfile.write(name + ' = {\n')
+        write_dict(outputfile, values)
+    outputfile.close()
+
+
+# Files
+# G-code and probe files can be compressed, picked by the file name suffix.
+# The compression modules are only loaded when they're used, .zst needs the
+# zstandard package.
+compression_suffixes = ['.gz', '.xz', '.bz2', '.zst']
+# Read and write buffer (bytes)
+file_buffer_size = 1 << 20
+
+
+def file_compression(filename):
+    # Compression suffix of the file name, None for a plain file
+    suffix = os.path.splitext(filename)[1].lower()
+    if suffix in compression_suffixes:
+        return suffix
+    return None
+
+
+def open_file(filename, mode='r', compression=None):
+    # Opens a G-code or probe file as text for reading ('r') or writing
+    # ('w'), compressed or decompressed as it is streamed according to the
+    # file name suffix (or compression, e.g. for a temporary file name).
+    # Raises IOError if the file can't be opened.
+    if compression is None:
+        compression = file_compression(filename)
+    if compression is None:
+        return open(filename, mode, buffering=file_buffer_size)
+    reading = mode[0] == 'r'
+    binary_mode = mode[0] + 'b'
+    if compression == '.gz':
+        import gzip
+        stream = gzip.open(filename, binary_mode, compresslevel=6)
+    elif compression == '.xz':
+        import lzma
+        stream = lzma.open(filename, binary_mode)
+    elif compression == '.bz2':
+        import bz2
+        stream = bz2.open(filename, binary_mode)
+    elif compression == '.zst':
+        try:
+            import zstandard
+        except ImportError:
+            raise IOError('The zstandard package is needed for .zst files')
+        raw_file = open(filename, binary_mode)
+        if reading:
+            stream = zstandard.ZstdDecompressor().stream_reader(raw_file, read_size=file_buffer_size)
+        else:
+            stream = zstandard.ZstdCompressor().stream_writer(raw_file, write_return_read=True)
+    else:
+        raise IOError('Unknown compression: ' + compression)
+    if reading:
+        return io.TextIOWrapper(io.BufferedReader(stream, file_buffer_size))
+    return io.TextIOWrapper(io.BufferedWriter(stream, file_buffer_size))
+
+
+# Toolpaths
+def air_rapid_A(A_from, A_to, x=None):
+    # Rapid over a run of A moves that are all in air (above the stock).
+    # Every angle between them is clear, so whole turns are left out. x is
+    # the X at the end for moves that also move X (a helix). Returns the new
+    # absolute A and the G0 line (empty if there's no move left).
+    full_turns = 360.0*int((A_to - A_from)/360.0)
+    A_to -= full_turns
+    if x is not None:
+        return A_to, 'G0 X {:5.4f} A {:6.2f}\n'.format(x, A_to)
+    if A_to == A_from:
+        return A_to, ''
+    return A_to, 'G0 A {:6.2f}\n'.format(A_to)
+
+
+# Feed scheduling
+def check_feed_schedule(cutter_inputs):
+    # Feed scheduling is on when chip_load is set. Raises ValueError if the
+    # other inputs it needs are missing.
+    if cutter_inputs.get('chip_load') is None:
+        return False
+    for name in ['chip_load', 'spindle_rpm', 'num_flutes', 'feedrate_max']:
+        if cutter_inputs.get(name) is None or cutter_inputs[name] <= 0:
+            raise ValueError(name + ' needs to be a positive value for feed scheduling.')
+    if cutter_inputs.get('axial_limit') is not None and cutter_inputs['axial_limit'] <= 0:
+        raise ValueError('axial_limit needs to be a positive value.')
+    return True
+
+
+def engagement_feedrate(cutter_inputs, axial_engagement, radial_engagement=None, mill_diameter=None):
+    # Highest feed rate (IPM) that keeps the chip load within
+    # cutter_inputs['chip_load'] (in/tooth), capped at feedrate_max.
+    # axial_engagement is the depth of cut and radial_engagement the width of
+    # cut, None is a full width slot. Below half the mill diameter the chips
+    # are thinner than the feed per tooth, so the feed per tooth can go up by
+    # the chip thinning factor. The depth of cut doesn't change the chip
+    # thickness, so a shallow cut never feeds faster. With
+    # cutter_inputs['axial_limit'] set, cuts deeper than it (e.g. a full
+    # depth slot) are fed slower by axial_limit/axial_engagement, to keep
+    # the cutting force down. Nothing engaged is feedrate_max.
+    if axial_engagement <= 0.0 or (radial_engagement is not None and radial_engagement <= 0.0):
+        return cutter_inputs['feedrate_max']
+    feed_per_tooth = cutter_inputs['chip_load']
+    if radial_engagement is not None and radial_engagement < mill_diameter/2.0:
+        feed_per_tooth *= mill_diameter/(2.0*math.sqrt(radial_engagement*(mill_diameter - radial_engagement)))
+    axial_limit = cutter_inputs.get('axial_limit')
+    if axial_limit is not None and axial_engagement > axial_limit:
+        feed_per_tooth *= axial_limit/axial_engagement
+    feedrate = cutter_inputs['spindle_rpm']*cutter_inputs['num_flutes']*feed_per_tooth
+
+    return min(feedrate, cutter_inputs['feedrate_max'])
+
+
+# Metrics
+# Command line options shared by every script for timing and profiling
+metrics_options = ['profile', 'metrics-json=', 'cprofile=']
+metrics_usage = '[--profile] [--metrics-json=metrics.json] [--cprofile=stats.prof]'
+
+
+class Metrics:
+    # Records the wall time of each stage of a script, timers for functions
+    # called from inside a stage (e.g. surface evaluations), counters and the
+    # peak memory. Stages are sequential, starting a stage ends the last one.
+    #
+    # Nothing is recorded unless one of the metrics options is given, so the
+    # calls can stay in the scripts at no cost.
+
+    def __init__(self, script):
+        self.script = script
+        self.enabled = False
+        self.print_summary = False
+        self.json_filename = None
+        self.cprofile_filename = None
+        self.profiler = None
+        self.stages = {}
+        self.timers = {}
+        self.counts = {}
+        self.current_stage = None
+        self.stage_start = None
+        self.start_time = time.perf_counter()
+
+    def parse_option(self, opt, arg):
+        # Returns True if the option is one of the metrics options
+        if opt == '--profile':
+            self.print_summary = True
+        elif opt == '--metrics-json':
+            self.json_filename = arg
+        elif opt == '--cprofile':
+            self.cprofile_filename = arg
+        else:
+            return False
+        self.enabled = True
+        if self.cprofile_filename is not None and self.profiler is None:
+            import cProfile
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+
+        return True
+
+    def stage(self, name):
+        if not self.enabled:
+            return
+        now = time.perf_counter()
+        if self.current_stage is not None:
+            self.stages[self.current_stage] = self.stages.get(self.current_stage, 0.0) + now - self.stage_start
+        self.current_stage = name
+        self.stage_start = now
+
+    def count(self, name, value=1):
+        if self.enabled:
+            self.counts[name] = self.counts.get(name, 0) + value
+
+    def timed(self, name, function):
+        # Returns function wrapped to record its total time and number of
+        # calls, or function itself if metrics are off
+        if not self.enabled:
+            return function
+        self.timers.setdefault(name, 0.0)
+        self.counts.setdefault(name + '_calls', 0)
+        perf_counter = time.perf_counter
+
+        def timed_function(*args, **kwargs):
+            start = perf_counter()
+            result = function(*args, **kwargs)
+            self.timers[name] += perf_counter() - start
+            self.counts[name + '_calls'] += 1
+            return result
+
+        return timed_function
+
+    def peak_rss(self):
+        # Peak resident memory (bytes), None where it isn't available
+        if resource is None:
+            return None
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # ru_maxrss is in kB on Linux and bytes on macOS
+        if sys.platform != 'darwin':
+            peak *= 1024
+
+        return peak
+
+    def results(self):
+        peak = self.peak_rss()
+        return {
+            'script': self.script,
+            'total_time': time.perf_counter() - self.start_time,
+            'stages': self.stages,
+            'timers': self.timers,
+            'counts': self.counts,
+            'peak_rss_mb': None if peak is None else peak/1.0e6,
+        }
+
+    def finish(self):
+        if not self.enabled:
+            return
+        self.stage(None)
+        if self.profiler is not None:
+            self.profiler.disable()
+            self.profiler.dump_stats(self.cprofile_filename)
+            print('\ncProfile stats written to:', self.cprofile_filename)
+        results = self.results()
+
+        if self.print_summary:
+            print('\nProfile ({})'.format(self.script))
+            for name, value in results['stages'].items():
+                print('  {:24s} {:9.4f} s'.format(name, value))
+            for name, value in results['timers'].items():
+                print('  {:24s} {:9.4f} s (in stage)'.format(name, value))
+            for name, value in results['counts'].items():
+                print('  {:24s} {:9d}'.format(name, value))
+            print('  {:24s} {:9.4f} s'.format('total', results['total_time']))
+            if results['peak_rss_mb'] is not None:
+                print('  {:24s} {:9.1f} MB'.format('peak memory', results['peak_rss_mb']))
+
+        if self.json_filename is not None:
+            json_file = open(self.json_filename, 'w')
+            json.dump(results, json_file, indent=2)
+            json_file.close()
+            print('\nMetrics written to:', self.json_filename)
+
+
+def metrics_from_argv(script, argv):
+    # Command line parsing for scripts that only take the metrics options
+    usage = script + '.py ' + metrics_usage
+    metrics = Metrics(script)
+    try:
+        opts, args = getopt.getopt(argv, 'h', metrics_options)
+    except getopt.GetoptError:
+        print(usage)
+        sys.exit(1)
+
+    for opt, arg in opts:
+        if opt == '-h':
+            print(usage)
+            sys.exit()
+        metrics.parse_option(opt, arg)
+
+    return metrics
+
+
+# Progress
+# Lines between progress checks, the hot loops only do
+#   if not line_count & progress_mask: progress.update(line_count)
+progress_mask = 0x3fff
+
+
+class Progress:
+    # Progress, throughput and ETA for a pass through an input file. Progress
+    # is taken from the byte offset of the file descriptor, so no per-line
+    # bookkeeping is needed (the offset is ahead of the line being processed
+    # by at most one read buffer). For a compressed file (open_file) it's
+    # the offset in the compressed file, streams without a file descriptor
+    # only report the line count. Updates are printed to stderr at a fixed
+    # time interval, on a single line when stderr is a terminal.
+
+    def __init__(self, input_file, quiet=False, interval=2.0):
+        self.quiet = quiet
+        self.interval = interval
+        try:
+            self.fd = input_file.fileno()
+            self.total_bytes = os.fstat(self.fd).st_size
+        except (OSError, AttributeError):
+            self.fd = None
+            self.total_bytes = 0
+        self.start_time = time.perf_counter()
+        self.next_update = self.start_time + interval
+        self.tty = sys.stderr.isatty()
+
+    def position(self):
+        if self.fd is None:
+            return 0
+        return os.lseek(self.fd, 0, os.SEEK_CUR)
+
+    def update(self, line_count):
+        now = time.perf_counter()
+        if self.quiet or now < self.next_update:
+            return
+        self.next_update = now + self.interval
+        elapsed = now - self.start_time
+        position = self.position()
+        if position > 0 and self.total_bytes > 0:
+            fraction = min(position/self.total_bytes, 1.0)
+            eta = elapsed*(1.0 - fraction)/fraction
+        else:
+            fraction = 0.0
+            eta = 0.0
+        message = '  {:5.1f}%  {:d} lines  {:8.0f} lines/s  {:6.2f} MB/s  ETA {}'.format(
+            100.0*fraction, line_count, line_count/elapsed, position/elapsed/1.0e6, format_time(eta))
+        if self.tty:
+            sys.stderr.write('\r' + message)
+        else:
+            sys.stderr.write(message + '\n')
+        sys.stderr.flush()
+
+    def finish(self, line_count):
+        if self.quiet:
+            return
+        elapsed = max(time.perf_counter() - self.start_time, 1.0e-9)
+        if self.tty:
+            sys.stderr.write('\r')
+        sys.stderr.write('  {:d} lines in {}  {:8.0f} lines/s  {:6.2f} MB/s\n'.format(
+            line_count, format_time(elapsed), line_count/elapsed, self.total_bytes/elapsed/1.0e6))
+        sys.stderr.flush()
+
+
+def format_time(seconds):
+    minutes, seconds = divmod(int(seconds + 0.5), 60)
+    hours, minutes = divmod(minutes, 60)
+    return '{:d}:{:02d}:{:02d}'.format(hours, minutes, seconds)
+
+
+# Threaded read, transform and write
+# Bytes per block read from the input and lines per block written
+thread_block_bytes = 1 << 20
+thread_block_lines = 16384
+# Blocks waiting in each queue, caps the memory used
+thread_queue_blocks = 8
+
+
+def run_threaded(input_file, output_file, transform, block_bytes=None, block_lines=None, queue_blocks=None):
+    # Runs transform (a function of the input lines returning the output
+    # lines, e.g. a modifier's generator) with a reader thread filling blocks
+    # of input lines and a writer thread draining blocks of output lines, so
+    # the disk reads and writes overlap with the transform in this thread.
+    # The queues between them are bounded, a slow disk or transform holds up
+    # the others rather than using more memory. Errors from the reader or
+    # writer are raised here. Progress on input_file runs ahead by up to the
+    # queued blocks.
+    import queue
+    import threading
+    import itertools
+    block_bytes = block_bytes or thread_block_bytes
+    block_lines = block_lines or thread_block_lines
+    queue_blocks = queue_blocks or thread_queue_blocks
+    input_blocks = queue.Queue(queue_blocks)
+    output_blocks = queue.Queue(queue_blocks)
+    errors = []
+    stop = threading.Event()
+
+    def read_blocks():
+        try:
+            while not stop.is_set():
+                lines = input_file.readlines(block_bytes)
+                if not lines:
+                    break
+                input_blocks.put(lines)
+        except Exception as error:
+            errors.append(error)
+        input_blocks.put(None)
+
+    def write_blocks():
+        while True:
+            lines = output_blocks.get()
+            if lines is None:
+                return
+            if not errors:
+                try:
+                    output_file.writelines(lines)
+                except Exception as error:
+                    errors.append(error)
+
+    def input_lines():
+        while True:
+            lines = input_blocks.get()
+            if lines is None:
+                return
+            yield from lines
+
+    reader = threading.Thread(target=read_blocks, daemon=True)
+    writer = threading.Thread(target=write_blocks, daemon=True)
+    reader.start()
+    writer.start()
+    try:
+        output_lines = iter(transform(input_lines()))
+        while not errors:
+            lines = list(itertools.islice(output_lines, block_lines))
+            if not lines:
+                break
+            output_blocks.put(lines)
+    finally:
+        # Let the reader finish if it's waiting on a full queue
+        stop.set()
+        while reader.is_alive():
+            try:
+                input_blocks.get(timeout=0.1)
+            except queue.Empty:
+                pass
+        output_blocks.put(None)
+        writer.join()
+    if errors:
+        raise errors[0]
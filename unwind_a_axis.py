@@ -0,0 +1,293 @@
+#!/usr/bin/env python
+import sys
+import re
+import getopt
+
+import rotary_axis_cam
+
+# Code assumes we are in G90 (absolute travel mode)
+
+# The generators keep adding to A across passes (e.g. cut_recess_cylinder.py
+# starts at 360 and adds angular_increment every move), so a long program
+# ends up thousands of degrees from zero and a G0 A back to the start
+# unwinds all of it. This post-processor tracks A through the program and,
+# at safe rapids (G0 with the tool at the safe height, the first Z found),
+# moves to the closest equivalent angle instead: the part is the same at A
+# and A + 360. The A of every following move is shifted by the same whole
+# number of turns, so the cuts are unchanged.
+#
+# With --g92 the A position is also renumbered at safe rapids once it's a
+# turn or more from zero (G92 A, no motion), so A stays small for
+# controllers that lose precision at large A values.
+#
+# Rapids in A below the safe height (e.g. the air rapids of skip_air, at
+# cutting depth) keep their direction, the other way round could go through
+# the stock.
+#
+# Every line with an A word is shifted, including modal moves without a G
+# word and N numbered lines. Lines it can't shift (G91, G92, A with G28 etc.)
+# raise ValueError. --check reads the output back and checks it against the
+# input (check_unwound).
+
+# Can also be used as a module:
+#   import unwind_a_axis
+#   for line in unwind_a_axis.unwind(open('recess.nc')):
+#       ...
+
+usage = 'unwind_a_axis.py --input=input.nc --output=output.nc [--g92] [--a-rapid=3600.0] [--check] [--quiet] ' + rotary_axis_cam.metrics_usage
+
+word_pattern = re.compile(r'([A-Z])\s*([-+]?(?:\d+\.?\d*|\.\d+))')
+a_pattern = re.compile(r'A\s*[-+]?(?:\d+\.?\d*|\.\d+)', re.IGNORECASE)
+
+# G codes that take an A word without it being a move in the motion mode
+not_handled = {10: 'G10', 28: 'G28', 30: 'G30', 53: 'G53'}
+
+
+def closest_angle(a_from, a_to):
+    # The angle equivalent to a_to (a whole number of turns away) that is
+    # closest to a_from
+    return a_from + (a_to - a_from + 180.0) % 360.0 - 180.0
+
+
+def parse_line(code, motion, line_count):
+    # Returns the words of a line of G-code (without its comment) and the
+    # motion mode (0-3, G0-G3) after it. The motion mode is modal, so a line
+    # without a G word (e.g. 'X1 A1120' or 'N10 A1110') moves in the mode
+    # set before it. Raises ValueError for what unwind can't shift.
+    words = word_pattern.findall(code.upper())
+    has_a = any(letter == 'A' for letter, value in words)
+    for letter, value in words:
+        if letter != 'G':
+            continue
+        g = float(value)
+        if g == 92:
+            raise ValueError('Line {:d}: G92 is already used in the input'.format(line_count))
+        if g == 91:
+            raise ValueError('Line {:d}: G91 (incremental) is not supported'.format(line_count))
+        if has_a and g in not_handled:
+            raise ValueError('Line {:d}: A with {} is not supported'.format(line_count, not_handled[g]))
+        if g in [0, 1, 2, 3]:
+            motion = int(g)
+        elif 80 <= g < 90:
+            # Canned cycles and G80 end the G0-G3 motion mode
+            motion = None
+    if has_a and motion is None:
+        raise ValueError('Line {:d}: A move without a G0-G3 motion mode'.format(line_count))
+    return dict(words), motion
+
+
+def unwind(input_lines, g92=False, a_rapid=3600.0, progress=None, stats=None):
+    # Yields the input G-code lines with the safe rapids in A taken the short
+    # way round, and the A of the other moves shifted to match. With g92 the
+    # A position is renumbered to 0-360 at safe rapids with G92 A. If given,
+    # progress is updated as lines are read and stats is filled in with the
+    # line counts, the largest A in and out and the A rapid time in and out
+    # (mins) at a_rapid (deg/min).
+    progress_mask = rotary_axis_cam.progress_mask
+    z_safe = None
+    z_current = None
+    motion = None
+    # Position as programmed and as written, the difference is always a
+    # whole number of turns
+    a_input = 0.0
+    a_output = 0.0
+
+    line_count = 0
+    modified_count = 0
+    rapids_shortened = 0
+    renumber_count = 0
+    a_max_input = 0.0
+    a_max_output = 0.0
+    rapid_time_input = 0.0
+    rapid_time_output = 0.0
+    for line in input_lines:
+        line_count += 1
+        if progress is not None and not line_count & progress_mask:
+            progress.update(line_count)
+        code, comment_start, comment = line.partition('(')
+        words, motion = parse_line(code, motion, line_count)
+        if 'Z' in words and motion is not None:
+            z_current = float(words['Z'])
+            if z_safe is None:
+                # Assume first Z found is safe height
+                z_safe = z_current
+        if 'A' not in words:
+            yield line
+            continue
+
+        a_target = float(words['A'])
+        a_offset = a_input - a_output
+        if motion == 0:
+            a_new = a_target - a_offset
+            if z_current is not None and z_current >= z_safe:
+                if g92 and abs(a_output) >= 360.0:
+                    # Renumber the current position, no motion
+                    a_renumbered = a_output % 360.0
+                    yield 'G92 A {:.4f}\n'.format(a_renumbered)
+                    renumber_count += 1
+                    a_output = a_renumbered
+                    a_offset = a_input - a_output
+                    a_new = a_target - a_offset
+                a_new = closest_angle(a_output, a_new)
+                if abs(a_new - a_output) < abs(a_target - a_input) - 1.0e-9:
+                    rapids_shortened += 1
+            rapid_time_input += abs(a_target - a_input)/a_rapid
+            rapid_time_output += abs(a_new - a_output)/a_rapid
+        else:
+            a_new = a_target - a_offset
+        a_input = a_target
+        a_output = a_new
+        a_max_input = max(a_max_input, abs(a_input))
+        a_max_output = max(a_max_output, abs(a_output))
+
+        if a_input == a_output:
+            # Nothing shifted yet, keep the line as it is
+            yield line
+        else:
+            code = a_pattern.sub('A {:.4f}'.format(a_output), code, count=1)
+            modified_count += 1
+            if comment_start:
+                yield code + comment_start + comment
+            else:
+                yield code.rstrip() + '\n'
+
+    if stats is not None:
+        stats['lines_read'] = line_count
+        stats['lines_modified'] = modified_count
+        stats['rapids_shortened'] = rapids_shortened
+        stats['renumbered'] = renumber_count
+        stats['a_max_input'] = a_max_input
+        stats['a_max_output'] = a_max_output
+        stats['rapid_time_input'] = rapid_time_input
+        stats['rapid_time_output'] = rapid_time_output
+
+
+def check_unwound(input_lines, output_lines, tolerance=0.001):
+    # Checks output_lines against the input_lines they were made from: every
+    # line with an A in the input has one in the output a whole number of
+    # turns away, and that offset only changes at G0 moves or G92 A, so every
+    # feed move (modal ones without a G word included) carries the offset of
+    # the rapid before it. Raises ValueError at the first line that doesn't,
+    # returns the number of lines checked.
+    output_lines = iter(output_lines)
+    motion = None
+    a_output = 0.0
+    a_offset = 0.0
+    line_count = 0
+    for line in input_lines:
+        line_count += 1
+        output_line = next(output_lines, None)
+        while output_line is not None and output_line.upper().startswith('G92'):
+            # Renumbered, the offset changes by the same amount as the position
+            a_renumbered = float(dict(word_pattern.findall(output_line.upper()))['A'])
+            a_offset += a_output - a_renumbered
+            a_output = a_renumbered
+            output_line = next(output_lines, None)
+        if output_line is None:
+            raise ValueError('Line {:d}: missing from the output'.format(line_count))
+        words, motion = parse_line(line.partition('(')[0], motion, line_count)
+        output_words = dict(word_pattern.findall(output_line.partition('(')[0].upper()))
+        if ('A' in words) != ('A' in output_words):
+            raise ValueError('Line {:d}: A word added or lost'.format(line_count))
+        if 'A' not in words:
+            continue
+        a_output = float(output_words['A'])
+        offset = float(words['A']) - a_output
+        turns = round(offset/360.0)
+        if abs(offset - 360.0*turns) > tolerance:
+            raise ValueError('Line {:d}: A shifted by {:.4f}, not a whole number of turns'.format(line_count, offset))
+        if motion != 0 and abs(offset - a_offset) > tolerance:
+            raise ValueError('Line {:d}: A offset {:.4f} on a G{:d} move, {:.4f} expected'.format(line_count, offset, motion, a_offset))
+        a_offset = offset
+    if next(output_lines, None) is not None:
+        raise ValueError('Output has more lines than the input')
+    return line_count
+
+
+def main(argv):
+    input_filename = 'input.nc'
+    output_filename = 'output.nc'
+    g92 = False
+    a_rapid = 3600.0 # deg/min
+    check = False
+    quiet = False
+    metrics = rotary_axis_cam.Metrics('unwind_a_axis')
+
+    try:
+        opts, args = getopt.getopt(argv, "h", ['input=', 'output=', 'g92', 'a-rapid=', 'check', 'quiet'] + rotary_axis_cam.metrics_options)
+    except getopt.GetoptError:
+        print(usage)
+        sys.exit(1)
+
+    for opt, arg in opts:
+        if opt == '-h':
+            print(usage)
+            sys.exit()
+        if opt == '--input':
+            input_filename = arg
+        if opt == '--output':
+            output_filename = arg
+        if opt == '--g92':
+            g92 = True
+        if opt == '--a-rapid':
+            a_rapid = float(arg)
+        if opt == '--check':
+            check = True
+        if opt == '--quiet':
+            quiet = True
+        metrics.parse_option(opt, arg)
+    if a_rapid <= 0.0:
+        print('--a-rapid needs to be a positive value\nExiting!')
+        sys.exit(1)
+
+    metrics.stage('open_files')
+    input_file = rotary_axis_cam.open_file(input_filename,'r')
+    output_file = rotary_axis_cam.open_file(output_filename,'w')
+    write = metrics.timed('write', output_file.write)
+
+    metrics.stage('process')
+    progress = rotary_axis_cam.Progress(input_file, quiet)
+    stats = {}
+    try:
+        for line in unwind(input_file, g92, a_rapid, progress, stats):
+            write(line)
+    except ValueError as error:
+        print(str(error) + '\nExiting!')
+        sys.exit(1)
+    progress.finish(stats['lines_read'])
+    print('Safe rapids shortened: {:d}'.format(stats['rapids_shortened']))
+    if g92:
+        print('A renumbered (G92): {:d}'.format(stats['renumbered']))
+    print('Largest A (input):  {:10.4f}'.format(stats['a_max_input']))
+    print('Largest A (output): {:10.4f}'.format(stats['a_max_output']))
+    print('A Rapid Time (input):  {:6.1f} mins'.format(stats['rapid_time_input']))
+    print('A Rapid Time (output): {:6.1f} mins'.format(stats['rapid_time_output']))
+    print('Time Saved:            {:6.1f} mins'.format(stats['rapid_time_input'] - stats['rapid_time_output']))
+
+    metrics.stage('close_files')
+    input_file.close()
+    output_file.close()
+
+    if check:
+        # Read both files back and check the output against the input
+        metrics.stage('check')
+        input_file = rotary_axis_cam.open_file(input_filename,'r')
+        output_file = rotary_axis_cam.open_file(output_filename,'r')
+        try:
+            checked = check_unwound(input_file, output_file)
+        except ValueError as error:
+            print('Check failed: ' + str(error) + '\nExiting!')
+            sys.exit(1)
+        finally:
+            input_file.close()
+            output_file.close()
+        print('Check passed: {:d} lines'.format(checked))
+
+    metrics.count('lines_read', stats['lines_read'])
+    metrics.count('lines_modified', stats['lines_modified'])
+    metrics.count('rapids_shortened', stats['rapids_shortened'])
+    metrics.finish()
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
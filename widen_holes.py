@@ -2,85 +2,255 @@
 import sys
 import math
 import re
+import getopt
+
+import rotary_axis_cam
 
 # Code assumes we are in G90   (absolute travel mode)
 # Code assumes we are in G90.1 (absolute arc center mode)
 
-input_file = open('drill_holes.nc','r')
-output_file = open('drill_wider_holes.nc','w')
-
-# Hole parameters
-old_hole_diam = 0.1250
-new_hole_diam = 0.1360
-delta_R = (new_hole_diam-old_hole_diam)/2.0
-print('Delta Radius: {:.4f}'.format(delta_R))
-feed_rate = 4.0 # in/min
-
-last_X = 0.0
-last_Y = 0.0
-arc_mode = ''
-
-hole_count = 0
-plunge_feed = 0.0
-for line in input_file:
-    if line[0] == '(':
-        # Don't modify
-        output_file.write(line)
-    elif line[0] == 'M': # Misc
-        # Don't modify, but add G90.1 code if needed
-        command = line[:2]
-        trailing = line[2:]
-        if command == 'M6' and arc_mode is not 'G90.1':
-            # Add absolute arc center mode
-            output_file.write('(Set Absolute Arc Center Mode)\n')
-            output_file.write('G90.1\n')
-        output_file.write(line)
-    elif line[0] == 'G':
-        command = re.split('X|Y|Z|A|F',line)
-        command_0 = command[0].strip()
-        trailing = line[2:]
-        # Check for arc mode
-        if 'G90.1' in line:
-            arc_mode = 'G90.1'
-        if command_0 == 'G0' or command_0 == 'G00':
-            # Don't modify, but get X, Y values
-            output_file.write(line)
-            # Get last x, and y locations
-            if 'X' in trailing:
-                last_X = float(re.split('X|Y|Z|A|F',trailing)[1])
-            if 'Y' in trailing:
-                last_Y = float(re.split('Y|Z|A|F',trailing)[1]) # Omit X, so Y value is always at the 1 index
-        elif command_0 == 'G1' or command_0 == 'G01':
-            # Check if X, Y and A are not present 
-            if 'X' not in line and 'Y' not in line and 'A' not in line:
+# Widens the holes of a flat drilling program. After each plunge (a G1 with
+# a Z and no X, Y or A) the tool moves out by half the diameter difference and cuts a full
+# circle at the bottom of the hole.
+#
+# With --helical the plunge is replaced by a helical ramp: the tool rapids
+# to just above the top of the stock (--top), moves out to the hole wall and
+# ramps down in full G2 turns that each drop --pitch, then cuts a cleanup
+# circle at the bottom. This avoids the full depth plunge at the plunge feed
+# rate and the full depth side load.
+
+# Can also be used as a module:
+#   import widen_holes
+#   for line in widen_holes.widen(open('drill_holes.nc'), 0.125, 0.136, 4.0, pitch=0.02):
+#       ...
+
+usage = 'widen_holes.py --input=drill_holes.nc --output=drill_wider_holes.nc [--old-diameter=0.125] [--new-diameter=0.136] [--feed=4.0] [--helical] [--pitch=0.02] [--top=0.0] [--quiet] ' + rotary_axis_cam.metrics_usage
+
+# Height above the top of the stock that the helical ramp starts at
+ramp_clearance = 0.02
+
+
+def word_value(line, letter):
+    # Value of the letter in the line, None if it isn't there
+    match = re.search(letter + r'\s*([-+]?(?:\d+\.?\d*|\.\d+))', line)
+    if match is None:
+        return None
+    return float(match.group(1))
+
+
+def helix_turns(z_top, z_bottom, pitch):
+    # Z at the end of each full turn, the last turn ends at z_bottom
+    num_turns = max(int(math.ceil((z_top - z_bottom)/pitch - 1.0e-9)), 1)
+    return [z_top - (z_top - z_bottom)*(turn + 1)/num_turns for turn in range(num_turns)]
+
+
+def widen(input_lines, old_hole_diam, new_hole_diam, feed_rate, pitch=None, z_top=0.0,
+          quiet=True, progress=None, stats=None):
+    # Yields the G-code lines with every hole widened. With pitch, holes are
+    # widened with a helical ramp instead of a plunge. Lines that aren't
+    # plunges are passed through unchanged. If given, progress is updated as
+    # lines are read and stats is filled in with the line and hole counts and
+    # the estimated time to get the tool to the bottom of the holes (mins),
+    # as written (entry_time) and if every hole was plunged (plunge_time).
+    progress_mask = rotary_axis_cam.progress_mask
+    delta_R = (new_hole_diam-old_hole_diam)/2.0
+    circle_length = 2.0*math.pi*delta_R
+
+    last_X = 0.0
+    last_Y = 0.0
+    last_Z = None
+    arc_mode = ''
+
+    hole_count = 0
+    line_count = 0
+    passed_count = 0
+    plunge_feed_rate = None
+    plunge_time = 0.0
+    entry_time = 0.0
+    for line in input_lines:
+        line_count += 1
+        if progress is not None and not line_count & progress_mask:
+            progress.update(line_count)
+        if line[0] == '(':
+            # Don't modify
+            yield line
+        elif line[0] == 'M': # Misc
+            # Don't modify, but add G90.1 code if needed
+            command = line[:2]
+            if command == 'M6' and arc_mode != 'G90.1':
+                # Add absolute arc center mode
+                yield '(Set Absolute Arc Center Mode)\n'
+                yield 'G90.1\n'
+            yield line
+        elif line[0] == 'G':
+            command = re.split('X|Y|Z|A|F',line)
+            command_0 = command[0].strip()
+            # Check for arc mode
+            if 'G90.1' in line:
+                arc_mode = 'G90.1'
+            if command_0 == 'G0' or command_0 == 'G00':
+                # Don't modify, but get X, Y and Z values
+                yield line
+                if 'X' in line:
+                    last_X = word_value(line, 'X')
+                if 'Y' in line:
+                    last_Y = word_value(line, 'Y')
+                if 'Z' in line:
+                    last_Z = word_value(line, 'Z')
+            elif (command_0 == 'G1' or command_0 == 'G01') and 'Z' in line and 'X' not in line and 'Y' not in line and 'A' not in line:
                 # Plunge Cut, Add Circular Arc Cut to Widen Hole
                 hole_count += 1
-                print('Hole Center:',last_X, last_Y)
+                if not quiet:
+                    print('Hole Center:',last_X, last_Y)
                 # Check for plunge feed rate, save for later
                 if 'F' in line:
                     plunge_feed_rate = float(re.split('F',line)[-1])
-                    print('Found Plunge Feed Rate:', plunge_feed_rate)
-                    # Don't modify current line and add additional lines
-                    output_file.write(line)
-                else:
-                    # Add plunge feed rate
-                    output_file.write(line.strip() + ' F {:.2f}\n'.format(plunge_feed_rate))
-                
-                # Move to arc starting point in X axis at Feed Rate
+                    if not quiet:
+                        print('Found Plunge Feed Rate:', plunge_feed_rate)
+                elif plunge_feed_rate is None:
+                    raise ValueError('Line {:d}: plunge without a feed rate'.format(line_count))
+                z_bottom = word_value(line, 'Z')
+                z_start = last_Z if last_Z is not None else z_top
+                plunge_time += (z_start - z_bottom)/plunge_feed_rate
+
                 new_X = last_X + delta_R
-                new_line = 'G1 X {:.4f} Y {:.4f} F {:.2f}\n'.format(new_X, last_Y, feed_rate)
-                output_file.write(new_line)
-                # Add circular arc
-                new_line = 'G2 X {:.4f} Y {:.4f} I {:.4f} J {:.4f} F {:.2f}\n'.format(new_X, last_Y, last_X, last_Y, feed_rate)
-                output_file.write(new_line)
+                if pitch is not None and z_bottom < z_top:
+                    # Ramp down the hole wall
+                    turns = helix_turns(z_top + ramp_clearance, z_bottom, pitch)
+                    turn_pitch = (z_top + ramp_clearance - z_bottom)/len(turns)
+                    yield 'G0 Z {:.4f}\n'.format(z_top + ramp_clearance)
+                    yield 'G1 X {:.4f} Y {:.4f} F {:.2f}\n'.format(new_X, last_Y, feed_rate)
+                    for z_turn in turns:
+                        yield 'G2 X {:.4f} Y {:.4f} Z {:.4f} I {:.4f} J {:.4f} F {:.2f}\n'.format(new_X, last_Y, z_turn, last_X, last_Y, feed_rate)
+                    entry_time += len(turns)*math.hypot(circle_length, turn_pitch)/feed_rate
+                    # Cleanup circle at the bottom
+                    yield 'G2 X {:.4f} Y {:.4f} I {:.4f} J {:.4f} F {:.2f}\n'.format(new_X, last_Y, last_X, last_Y, feed_rate)
+                else:
+                    if 'F' in line:
+                        # Don't modify current line and add additional lines
+                        yield line
+                    else:
+                        # Add plunge feed rate
+                        yield line.strip() + ' F {:.2f}\n'.format(plunge_feed_rate)
+                    entry_time += (z_start - z_bottom)/plunge_feed_rate
+
+                    # Move to arc starting point in X axis at Feed Rate
+                    yield 'G1 X {:.4f} Y {:.4f} F {:.2f}\n'.format(new_X, last_Y, feed_rate)
+                    # Add circular arc
+                    yield 'G2 X {:.4f} Y {:.4f} I {:.4f} J {:.4f} F {:.2f}\n'.format(new_X, last_Y, last_X, last_Y, feed_rate)
+                last_Z = z_bottom
             else:
-                print('Not plunge, Fix This!')
-                print(line)
-                sys.exit(1)
+                # Don't modify all other GXX commands (including feed moves
+                # that aren't plunges), but keep track of the location
+                if command_0 in ['G1', 'G01', 'G2', 'G02', 'G3', 'G03']:
+                    passed_count += 1
+                    if command_0 in ['G1', 'G01'] and 'F' in line and 'X' not in line and 'Y' not in line and 'A' not in line:
+                        # Feed rate only (e.g. G1 F10), it's the modal feed
+                        # for the plunges after it
+                        plunge_feed_rate = word_value(line, 'F')
+                    if 'X' in line:
+                        last_X = word_value(line, 'X')
+                    if 'Y' in line:
+                        last_Y = word_value(line, 'Y')
+                    if 'Z' in line:
+                        last_Z = word_value(line, 'Z')
+                yield line
         else:
-            # Don't modify all other GXX commands
-            output_file.write(line)
+            # Blank lines etc.
+            yield line
+
+    if stats is not None:
+        stats['lines_read'] = line_count
+        stats['holes_widened'] = hole_count
+        stats['feed_moves_passed'] = passed_count
+        stats['plunge_time'] = plunge_time
+        stats['entry_time'] = entry_time
+
+
+def main(argv):
+    input_filename = 'drill_holes.nc'
+    output_filename = 'drill_wider_holes.nc'
+    quiet = False
+    # Hole parameters
+    old_hole_diam = 0.1250
+    new_hole_diam = 0.1360
+    feed_rate = 4.0 # in/min
+    helical = False
+    pitch = 0.02
+    z_top = 0.0
+    metrics = rotary_axis_cam.Metrics('widen_holes')
+
+    try:
+        opts, args = getopt.getopt(argv, "h", ['input=', 'output=', 'old-diameter=', 'new-diameter=', 'feed=',
+                                               'helical', 'pitch=', 'top=', 'quiet'] + rotary_axis_cam.metrics_options)
+    except getopt.GetoptError:
+        print(usage)
+        sys.exit(1)
+
+    for opt, arg in opts:
+        if opt == '-h':
+            print(usage)
+            sys.exit()
+        if opt == '--input':
+            input_filename = arg
+        if opt == '--output':
+            output_filename = arg
+        if opt == '--old-diameter':
+            old_hole_diam = float(arg)
+        if opt == '--new-diameter':
+            new_hole_diam = float(arg)
+        if opt == '--feed':
+            feed_rate = float(arg)
+        if opt == '--helical':
+            helical = True
+        if opt == '--pitch':
+            pitch = float(arg)
+        if opt == '--top':
+            z_top = float(arg)
+        if opt == '--quiet':
+            quiet = True
+        metrics.parse_option(opt, arg)
+    if pitch <= 0.0:
+        print('--pitch needs to be a positive value\nExiting!')
+        sys.exit(1)
+    if not helical:
+        pitch = None
+
+    metrics.stage('open_files')
+    input_file = rotary_axis_cam.open_file(input_filename,'r')
+    output_file = rotary_axis_cam.open_file(output_filename,'w')
+
+    delta_R = (new_hole_diam-old_hole_diam)/2.0
+    print('Delta Radius: {:.4f}'.format(delta_R))
+    if pitch is not None:
+        print('Helical Pitch: {:.4f}'.format(pitch))
+
+    metrics.stage('process')
+    progress = rotary_axis_cam.Progress(input_file, quiet)
+    stats = {}
+    try:
+        output_file.writelines(widen(input_file, old_hole_diam, new_hole_diam, feed_rate, pitch, z_top,
+                                     quiet, progress, stats))
+    except ValueError as error:
+        print(str(error) + '\nExiting!')
+        sys.exit(1)
+    progress.finish(stats['lines_read'])
+    print('Holes widened:', stats['holes_widened'])
+    if stats['feed_moves_passed']:
+        print('Feed moves passed through (not plunges):', stats['feed_moves_passed'])
+    if pitch is not None:
+        saved = stats['plunge_time'] - stats['entry_time']
+        print('Hole Entry Time (plunge):  {:6.1f} mins'.format(stats['plunge_time']))
+        print('Hole Entry Time (helical): {:6.1f} mins'.format(stats['entry_time']))
+        print('Time Saved:                {:6.1f} mins'.format(saved))
+    metrics.stage('close_files')
+    input_file.close()
+    output_file.close()
+
+    metrics.count('lines_read', stats['lines_read'])
+    metrics.count('holes_widened', stats['holes_widened'])
+    metrics.finish()
+
 
-print('Holes widened:', hole_count)
-input_file.close()
-output_file.close()
+if __name__ == '__main__':
+    main(sys.argv[1:])
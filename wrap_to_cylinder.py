@@ -0,0 +1,405 @@
+#!/usr/bin/env python
+import os
+import re
+import sys
+import math
+import getopt
+
+import numpy as np
+
+import rotary_axis_cam
+
+# Wraps a flat XY G-code program onto a cylinder and writes it with inverse
+# time (G93) feeds, in place of wrapping with G-Code-Ripper and then running
+# convert_to_inverse_time.py.
+#
+# The flat program is in absolute (G90) units/min (G94) coordinates with:
+#   X along the cylinder axis (unchanged)
+#   Y around the outer surface, wrapped to A (degrees) at the given radius
+#   Z=0 at the outer surface, so the output Z is radius + Z
+# Arcs (G2/G3 in the XY plane, I/J centers) are split into lines so the
+# chord error is within the tolerance. With a probe file the feed moves, and
+# rapids below the safe height (the first Z), are autoleveled in the same
+# pass, and long moves are split to max_segment so the surface is followed
+# between the end points.
+#
+# The program is parsed into arrays and the wrapping, arc splitting,
+# autoleveling and feed calculations are done on all moves at once.
+
+# Can also be used as a module:
+#   import wrap_to_cylinder
+#   for line in wrap_to_cylinder.wrap(open('flat.nc'), 3.0):
+#       ...
+
+usage = 'wrap_to_cylinder.py --input=flat.nc --output=wrapped.nc --radius=3.0 [--tolerance=0.0005] [--probe=probe_results.txt] [--z-ref=3.0] [--max-segment=0.1] [--quiet] ' + rotary_axis_cam.metrics_usage
+
+number = r'([-+]?(?:\d+\.?\d*|\.\d+))'
+word_re = re.compile(r'([A-Z])\s*' + number)
+comment_re = re.compile(r'\([^)]*\)|;.*')
+# Most lines are a plain move, in this order, and take the fast path
+move_re = re.compile(r'\s*(?:N\d+\s*)?(?:G0*([0-3])(?![\d.])\s*)?' +
+                     ''.join(r'(?:{}\s*{}\s*)?'.format(letter, number) for letter in 'XYZIJF') + '$')
+
+# G codes that can't be wrapped
+unsupported_G = {
+    18: 'G18 (XZ plane)', 19: 'G19 (YZ plane)', 91: 'G91 (incremental mode)',
+    93: 'G93 (input must be in units/min)', 28: 'G28', 30: 'G30', 53: 'G53',
+    73: 'canned cycles', 76: 'canned cycles', 81: 'canned cycles', 82: 'canned cycles',
+    83: 'canned cycles', 84: 'canned cycles', 85: 'canned cycles', 86: 'canned cycles',
+    87: 'canned cycles', 88: 'canned cycles', 89: 'canned cycles',
+}
+
+# Columns of the parsed rows
+G, X, Y, Z, I, J, F, IJ = range(8)
+
+
+def parse(input_lines, progress=None):
+    # Splits the program into moves and pass through lines. Returns a dict
+    # of move arrays and the pass through lines as (number of moves before
+    # the line, line). X, Y and Z are NaN where the line doesn't give them.
+    # Motion mode, feed rate and arc center mode are modal, lines that only
+    # change them are kept as rows without a move and filled in afterwards.
+    progress_mask = rotary_axis_cam.progress_mask
+    rows = []
+    line_numbers = []
+    passthrough = []
+    no_change = ('nan',)*8
+    line_count = 0
+    for line in input_lines:
+        line_count += 1
+        if progress is not None and not line_count & progress_mask:
+            progress.update(line_count)
+        match = move_re.match(line)
+        if match:
+            row = match.groups('nan') + ('nan',)
+            if row != no_change:
+                rows.append(row)
+                line_numbers.append(line_count)
+            continue
+
+        # General case
+        words = word_re.findall(comment_re.sub('', line).upper())
+        if not words:
+            if line.strip():
+                # Comments are kept
+                passthrough.append((len(rows), line.rstrip('\r\n') + '\n'))
+            continue
+        row = ['nan']*8
+        other = []
+        for letter, value in words:
+            if letter == 'G':
+                if value in ['90.1', '91.1']:
+                    row[IJ] = '1' if value == '90.1' else '0'
+                    other.append('G' + value)
+                    continue
+                g = int(float(value))
+                if g in [0, 1, 2, 3]:
+                    row[G] = str(g)
+                elif g in unsupported_G:
+                    raise ValueError('Line {:d}: {} is not supported'.format(line_count, unsupported_G[g]))
+                elif g != 94:
+                    other.append('G' + value)
+            elif letter in 'XYZIJF':
+                row['GXYZIJF'.index(letter)] = value
+            elif letter == 'R':
+                raise ValueError('Line {:d}: R format arcs are not supported, use I and J'.format(line_count))
+            elif letter != 'N':
+                other.append(letter + value)
+        if other:
+            # Everything but the move (e.g. M3, S, T, G20) on its own line
+            passthrough.append((len(rows), ' '.join(other) + '\n'))
+        if row != ['nan']*8:
+            rows.append(tuple(row))
+            line_numbers.append(line_count)
+    if progress is not None:
+        progress.finish(line_count)
+
+    values = np.array(rows, dtype=float).reshape(-1, 8)
+    line_numbers = np.array(line_numbers, dtype=int)
+    # Modal values
+    for column in [G, F, IJ]:
+        values[:,column] = forward_fill(values[:,column])
+    # Drop the rows without a move, pass through lines are counted in moves
+    is_move = ~np.all(np.isnan(values[:,X:Z+1]), axis=1)
+    moves_before = np.concatenate([[0], np.cumsum(is_move)])
+    passthrough = [(int(moves_before[row]), line) for row, line in passthrough]
+    values = values[is_move]
+    line_numbers = line_numbers[is_move]
+    no_motion = np.isnan(values[:,G])
+    if np.any(no_motion):
+        raise ValueError('Line {:d}: move without G0/G1/G2/G3'.format(line_numbers[np.argmax(no_motion)]))
+
+    moves = {
+        'mode': values[:,G].astype(int),
+        'X': values[:,X],
+        'Y': values[:,Y],
+        'Z': values[:,Z],
+        'I': values[:,I],
+        'J': values[:,J],
+        'F': values[:,F],
+        'ij_absolute': values[:,IJ] == 1.0,
+        'line': line_numbers,
+        'lines_read': line_count,
+    }
+
+    return moves, passthrough
+
+
+def forward_fill(values):
+    # Replaces each NaN with the last value before it (NaN if none)
+    index = np.where(np.isnan(values), 0, np.arange(values.size))
+    np.maximum.accumulate(index, out=index)
+
+    return values[index]
+
+
+def segments(moves, tolerance, max_segment=None):
+    # Splits the moves into straight flat segments. Returns the segment end
+    # points (x, y, z), the index of the move each segment came from, and
+    # the number of segments of each move.
+    X = forward_fill(moves['X'])
+    Y = forward_fill(moves['Y'])
+    Z = forward_fill(moves['Z'])
+    num_moves = X.size
+    X0 = np.concatenate([[np.nan], X[:-1]])
+    Y0 = np.concatenate([[np.nan], Y[:-1]])
+    Z0 = np.concatenate([[np.nan], Z[:-1]])
+    mode = moves['mode']
+    feed_move = mode > 0
+    arc = mode >= 2
+
+    unknown = feed_move & (np.isnan(X0) | np.isnan(Y0) | np.isnan(Z0) | np.isnan(X) | np.isnan(Y) | np.isnan(Z))
+    if np.any(unknown):
+        raise ValueError('Line {:d}: feed move before the X, Y and Z position is known'.format(moves['line'][np.argmax(unknown)]))
+    no_feed = feed_move & np.isnan(moves['F'])
+    if np.any(no_feed):
+        raise ValueError('Line {:d}: feed move without a feed rate'.format(moves['line'][np.argmax(no_feed)]))
+
+    # Arc centers, radii and sweep angles
+    I = np.nan_to_num(moves['I'])
+    J = np.nan_to_num(moves['J'])
+    CX = np.where(moves['ij_absolute'], I, X0 + I)
+    CY = np.where(moves['ij_absolute'], J, Y0 + J)
+    R0 = np.hypot(X0 - CX, Y0 - CY)
+    R1 = np.hypot(X - CX, Y - CY)
+    angle0 = np.arctan2(Y0 - CY, X0 - CX)
+    angle1 = np.arctan2(Y - CY, X - CX)
+    ccw = np.mod(angle1 - angle0, 2*math.pi)
+    full_circle = arc & (np.hypot(X - X0, Y - Y0) < 1.0e-9)
+    ccw = np.where(full_circle, 2*math.pi, ccw)
+    cw = np.where(full_circle, 2*math.pi, np.mod(angle0 - angle1, 2*math.pi))
+    sweep = np.where(mode == 3, ccw, -cw)
+    if np.any(arc & (R0 < 1.0e-9)):
+        raise ValueError('Line {:d}: arc with zero radius'.format(moves['line'][np.argmax(arc & (R0 < 1.0e-9))]))
+
+    # Number of segments in each move
+    counts = np.ones(num_moves, dtype=int)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        # Largest angle with a chord error (sagitta) within the tolerance
+        max_angle = 2.0*np.arccos(np.clip(1.0 - tolerance/np.maximum(R0, R1), -1.0, 1.0))
+        arc_counts = np.ceil(np.abs(sweep)/np.maximum(max_angle, 1.0e-6))
+    counts[arc] = np.maximum(arc_counts[arc], 1).astype(int)
+    if max_segment is not None:
+        line_move = mode == 1
+        lengths = np.hypot(X - X0, Y - Y0)
+        counts[line_move] = np.maximum(np.ceil(lengths[line_move]/max_segment), 1).astype(int)
+        arc_length = np.abs(sweep)*np.maximum(R0, R1)
+        counts[arc] = np.maximum(counts[arc], np.ceil(arc_length[arc]/max_segment).astype(int))
+
+    # Expand to segments, t is the fraction along the move
+    move_index = np.repeat(np.arange(num_moves), counts)
+    first = np.cumsum(counts) - counts
+    t = (np.arange(move_index.size) - first[move_index] + 1)/counts[move_index]
+
+    x = X0[move_index] + t*(X - X0)[move_index]
+    y = Y0[move_index] + t*(Y - Y0)[move_index]
+    z = Z0[move_index] + t*(Z - Z0)[move_index]
+    on_arc = arc[move_index]
+    angle = angle0[move_index][on_arc] + t[on_arc]*sweep[move_index][on_arc]
+    radius = R0[move_index][on_arc] + t[on_arc]*(R1 - R0)[move_index][on_arc]
+    x[on_arc] = CX[move_index][on_arc] + radius*np.cos(angle)
+    y[on_arc] = CY[move_index][on_arc] + radius*np.sin(angle)
+    # End points exactly as programmed
+    last = t == 1.0
+    x[last] = X[move_index][last]
+    y[last] = Y[move_index][last]
+    z[last] = Z[move_index][last]
+
+    return x, y, z, move_index, counts
+
+
+def wrap(input_lines, radius, tolerance=0.0005, probe_f=None, probe_dim=None, max_segment=None,
+         progress=None, stats=None):
+    # Yields the wrapped program. probe_f and probe_dim are the delta Z
+    # surface from probe.load_probe_surface, when given the feed moves and
+    # the rapids below the first Z are autoleveled. Raises ValueError if the program can't be wrapped. If
+    # given, progress is updated while the input is read and stats is filled
+    # in with the line counts and cutting time (min).
+    moves, passthrough = parse(input_lines, progress)
+    x, y, z, move_index, counts = segments(moves, tolerance, max_segment)
+
+    # Wrap
+    a = np.degrees(y/radius)
+    z_out = radius + z
+    feed_segment = moves['mode'][move_index] > 0
+    leveled = np.zeros(move_index.size, dtype=bool)
+    if probe_f is not None:
+        import probe
+        # Rapids below the safe height (the first Z in the program) are
+        # leveled too, like apply_cylinder_autolevel does, so low clearance
+        # moves don't rapid into stock that sits high
+        z_given = moves['Z'][~np.isnan(moves['Z'])]
+        low_rapid = ~feed_segment & (z < z_given[0]) if z_given.size else np.zeros_like(feed_segment)
+        unknown = low_rapid & (np.isnan(x) | np.isnan(y))
+        if np.any(unknown):
+            raise ValueError('Line {:d}: rapid below the safe height before the X and Y position is known'.format(
+                moves['line'][move_index[np.argmax(unknown)]]))
+        leveled = feed_segment | low_rapid
+        a_probe = np.mod(a[leveled], 360.0)
+        dz = probe.ProbeSurface(probe_f, probe_dim).evaluate(x[leveled], a_probe)
+        z_out[leveled] += dz
+
+    # Inverse time feed rates, from the length of each segment at the
+    # radius it's cut at. Zero length feed moves are dropped.
+    x_start = np.concatenate([[np.nan], x[:-1]])
+    a_start = np.concatenate([[np.nan], a[:-1]])
+    z_start = np.concatenate([[np.nan], z_out[:-1]])
+    cut_radius = 0.5*(z_out + z_start)
+    length = np.sqrt((x - x_start)**2 + (np.radians(a - a_start)*cut_radius)**2 + (z_out - z_start)**2)
+    keep = ~feed_segment | (length > 1.0e-9)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        F = moves['F'][move_index]/length
+
+    # Format the feed moves all at once. Rapids are few, they only give the
+    # axes that were programmed (and Z when it's leveled).
+    lines = np.empty(move_index.size, dtype=object)
+    feed_lines = np.flatnonzero(feed_segment & keep)
+    lines[feed_lines] = ['G1 X%.4f A%.3f Z%.4f F%.3f\n' % values for values in
+                         zip(x[feed_lines].tolist(), a[feed_lines].tolist(), z_out[feed_lines].tolist(), F[feed_lines].tolist())]
+    rapid_lines = np.flatnonzero(~feed_segment)
+    rapid_moves = move_index[rapid_lines]
+    rapid_z = np.where(leveled[rapid_lines], z_out[rapid_lines], radius + moves['Z'][rapid_moves])
+    rapid_words = zip(moves['X'][rapid_moves].tolist(), moves['Y'][rapid_moves].tolist(), rapid_z.tolist())
+    lines[rapid_lines] = ['G0' + (' X%.4f' % x_value if x_value == x_value else '') +
+                          (' A%.3f' % math.degrees(y_value/radius) if y_value == y_value else '') +
+                          (' Z%.4f' % z_value if z_value == z_value else '') + '\n'
+                          for x_value, y_value, z_value in rapid_words]
+    lines = lines[keep].tolist()
+
+    # Back in program order, G93 around the moves
+    kept = np.concatenate([[0], np.cumsum(np.add.reduceat(keep, np.cumsum(counts) - counts) if counts.size else [])]).astype(int)
+    num_moves = counts.size
+    passthrough = [item for item in passthrough if item[0] == 0] + [(0, 'G93 (inverse time)\n')] + \
+                  [item for item in passthrough if 0 < item[0] < num_moves] + \
+                  [(num_moves, 'G94 (standard feed rates)\n')] + [item for item in passthrough if item[0] == num_moves and num_moves > 0]
+    start = 0
+    for moves_before, line in passthrough:
+        yield from lines[start:kept[moves_before]]
+        start = kept[moves_before]
+        yield line
+    yield from lines[start:]
+
+    if stats is not None:
+        stats['lines_read'] = moves['lines_read']
+        stats['moves'] = int(num_moves)
+        stats['arcs'] = int(np.count_nonzero(moves['mode'] >= 2))
+        stats['lines_written'] = len(lines) + len(passthrough)
+        stats['cutting_time'] = float(np.sum(1.0/F[feed_lines])) if feed_lines.size else 0.0
+
+
+def main(argv):
+    input_filename = 'flat.nc'
+    output_filename = 'wrapped.nc'
+    radius = None
+    tolerance = 0.0005
+    probe_filename = None
+    z_ref = None
+    max_segment = None
+    quiet = False
+    metrics = rotary_axis_cam.Metrics('wrap_to_cylinder')
+
+    try:
+        opts, args = getopt.getopt(argv, 'h', ['input=', 'output=', 'radius=', 'tolerance=', 'probe=', 'z-ref=',
+                                               'max-segment=', 'quiet'] + rotary_axis_cam.metrics_options)
+    except getopt.GetoptError:
+        print(usage)
+        sys.exit(1)
+
+    for opt, arg in opts:
+        if opt == '-h':
+            print(usage)
+            sys.exit()
+        if opt == '--input':
+            input_filename = arg
+        if opt == '--output':
+            output_filename = arg
+        if opt == '--radius':
+            radius = float(arg)
+        if opt == '--tolerance':
+            tolerance = float(arg)
+        if opt == '--probe':
+            probe_filename = arg
+        if opt == '--z-ref':
+            z_ref = float(arg)
+        if opt == '--max-segment':
+            max_segment = float(arg)
+        if opt == '--quiet':
+            quiet = True
+        metrics.parse_option(opt, arg)
+
+    if radius is None or radius <= 0.0:
+        print('A positive --radius is needed\nExiting!')
+        sys.exit(1)
+    if tolerance <= 0.0:
+        print('--tolerance needs to be a positive value\nExiting!')
+        sys.exit(1)
+
+    probe_f = None
+    probe_dim = None
+    if probe_filename is not None:
+        metrics.stage('read_probe')
+        import probe
+        print('\nReading Probe Data')
+        if z_ref is None:
+            z_ref = radius
+        try:
+            probe_f, probe_dim = probe.load_probe_surface(probe_filename, z_ref, metrics)
+        except (IOError, ValueError):
+            print('Error reading probe file!\nExiting')
+            sys.exit(1)
+        if max_segment is None:
+            max_segment = 0.1
+
+    metrics.stage('process')
+    try:
+        input_file = rotary_axis_cam.open_file(input_filename, 'r')
+    except IOError:
+        print('Error reading input file!\nExiting')
+        sys.exit(1)
+    print('\nWrapping', input_filename, 'onto radius {:5.4f}'.format(radius))
+    progress = rotary_axis_cam.Progress(input_file, quiet)
+    stats = {}
+    output_file = rotary_axis_cam.open_file(output_filename, 'w')
+    try:
+        output_file.writelines(wrap(input_file, radius, tolerance, probe_f, probe_dim, max_segment, progress, stats))
+    except ValueError as error:
+        print(str(error) + '\nExiting!')
+        sys.exit(1)
+
+    metrics.stage('close_files')
+    input_file.close()
+    output_file.close()
+    metrics.count('bytes_written', os.path.getsize(output_filename))
+
+    print('Lines Read: {:d}'.format(stats['lines_read']))
+    print('Arcs Split: {:d}'.format(stats['arcs']))
+    print('Lines Written: {:d} ({})'.format(stats['lines_written'], output_filename))
+    print('Cutting Time: {:4.0f} mins'.format(stats['cutting_time']))
+
+    metrics.count('lines_read', stats['lines_read'])
+    metrics.count('lines_written', stats['lines_written'])
+    metrics.finish()
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])